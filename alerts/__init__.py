@@ -0,0 +1,29 @@
+import time
+from typing import Any, Dict, NamedTuple, Optional
+
+import numpy as np
+
+
+class AlertJob(NamedTuple):
+    """
+    Everything needed to render and dispatch an alert, built on the websocket thread and handed over to the
+    alert pipeline. It is immutable and owns a copy of the candles so the pipeline never reads a buffer
+    the websocket thread keeps writing to.
+    """
+    # BTCUSDT
+    trading_symbol: str
+    base: str
+    quote: str
+    # Plain text message (no terminal colors) to send to the writers
+    message: str
+    # Read only copies of the CandleRingBuffer columns to plot, see CandleRingBuffer.snapshot
+    candles: Dict[str, np.ndarray]
+    # time.perf_counter() when the alert was detected
+    detected_at: float
+    # What was detected (volume multiplier, price impact, thresholds...) as logged in the alert log
+    details: Optional[Dict[str, Any]] = None
+
+    @staticmethod
+    def create(trading_symbol: str, base: str, quote: str, message: str,
+               candles: Dict[str, np.ndarray], details: Optional[Dict[str, Any]] = None) -> 'AlertJob':
+        return AlertJob(trading_symbol, base, quote, message, candles, time.perf_counter(), details)
@@ -0,0 +1,112 @@
+import collections
+import math
+from typing import Deque, Iterable, Optional
+
+import numpy as np
+
+
+class RollingBaseline:
+    """
+    Statistics of the last `window` values of a series (the quote volume of the closed candles of a symbol),
+    updated in O(1) per value, nothing is ever rescanned:
+
+    - mean and variance over the window, with Welford's algorithm extended to drop the value leaving the window
+    - an exponentially weighted moving average, alpha = 2 / (window + 1), that reacts faster to regime changes
+
+    The windowed updates accumulate rounding errors, the statistics are computed again from scratch once every
+    `window` values, which keeps the amortized cost O(1).
+    """
+    window: int
+    alpha: float
+    count: int
+    mean: float
+    ewma: Optional[float]
+
+    def __init__(self, window: int = 60):
+        if window < 2:
+            raise ValueError(f'window must be at least 2, got {window}')
+
+        self.window = window
+        self.alpha = 2 / (window + 1)
+        self._values: Deque[float] = collections.deque(maxlen=window)
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.ewma = None
+        self._since_resync = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def seed(self, values: Iterable[float]):
+        """
+        Starts over from the given values, ordered from the oldest to the newest, only the last `window` are kept
+        """
+        values = np.asarray(values, dtype=np.float64)
+        self._values.clear()
+        self._values.extend(values[-self.window:].tolist())
+        self._resync()
+
+        self.ewma = None
+        for value in values[-self.window * 4:].tolist():
+            self._update_ewma(value)
+
+    def _resync(self):
+        values = np.fromiter(self._values, dtype=np.float64, count=len(self._values))
+        self.count = len(values)
+        self.mean = float(values.mean()) if self.count > 0 else 0.0
+        self._m2 = float(((values - self.mean) ** 2).sum()) if self.count > 0 else 0.0
+        self._since_resync = 0
+
+    def _update_ewma(self, value: float):
+        if self.ewma is None:
+            self.ewma = value
+        else:
+            self.ewma += self.alpha * (value - self.ewma)
+
+    def push(self, value: float):
+        if self.count == self.window:
+            oldest = self._values[0]
+            self._values.append(value)
+            old_mean = self.mean
+            self.mean += (value - oldest) / self.window
+            self._m2 += (value - oldest) * (value - self.mean + oldest - old_mean)
+        else:
+            self._values.append(value)
+            self.count += 1
+            delta = value - self.mean
+            self.mean += delta / self.count
+            self._m2 += delta * (value - self.mean)
+
+        self._update_ewma(value)
+
+        self._since_resync += 1
+        if self._since_resync >= self.window:
+            self._resync()
+
+    @property
+    def variance(self) -> float:
+        if self.count < 2:
+            return 0.0
+        return max(self._m2, 0.0) / (self.count - 1)
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+    def zscore(self, value: float) -> Optional[float]:
+        """
+        How many standard deviations the value is above the mean, None if the series is flat
+        """
+        std = self.std
+        if std <= 0:
+            return None
+        return (value - self.mean) / std
+
+    def multiple(self, value: float) -> Optional[float]:
+        """
+        value / EWMA baseline, None if there is no baseline yet
+        """
+        if self.ewma is None or self.ewma <= 0:
+            return None
+        return value / self.ewma
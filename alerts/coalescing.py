@@ -0,0 +1,72 @@
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+
+class AlertCoalescer:
+    """
+    Binance pushes an update of the open candle every ~250ms and the volume rule is evaluated on each of them,
+    so a single spike would fire several alerts for the same candle, each one rendering and uploading a chart.
+    This decides, per (trading symbol, candle open time), whether an alert that fired should be sent.
+
+    Policies:
+     - first_only: only the first alert of each candle is sent
+     - escalate: the first alert is sent, later ones within the same candle only if the volume multiplier
+       grew at least escalation_factor times since the last alert sent
+     - cooldown: the first alert is sent, later ones within the same candle only once cooldown_secs elapsed
+       since the last alert sent
+     - none: every alert is sent (previous behaviour)
+
+    Whatever the policy, the first alert of a candle is never held back. Only the newest candle of each symbol
+    is remembered, so memory is bounded by the number of symbols.
+    """
+    POLICIES = ('first_only', 'escalate', 'cooldown', 'none')
+
+    policy: str
+    escalation_factor: float
+    cooldown_secs: float
+    # Seconds, only differences matter: time.monotonic, or the time frames were received at when replaying them
+    clock: Callable[[], float]
+    # trading symbol -> (open_unix, multiplier, time) of the last alert sent
+    _last_sent: Dict[str, Tuple[int, float, float]]
+    suppressed: int
+
+    def __init__(self, policy: str = 'first_only', escalation_factor: float = 1.5, cooldown_secs: float = 30,
+                 clock: Callable[[], float] = time.monotonic):
+        if policy not in self.POLICIES:
+            raise ValueError(f'unknown alert coalescing policy {policy}, expected one of {self.POLICIES}')
+
+        self.policy = policy
+        self.escalation_factor = escalation_factor
+        self.cooldown_secs = cooldown_secs
+        self.clock = clock
+        self._last_sent = {}
+        self.suppressed = 0
+
+    def should_alert(self, trading_symbol: str, open_unix: int, multiplier: float,
+                     now: Optional[float] = None) -> bool:
+        """
+        :param trading_symbol: BTCUSDT
+        :param open_unix: open time of the candle that triggered the alert
+        :param multiplier: volume multiplier of the alert, 3 means x3 volume
+        :param now: as given by clock, if not given it is taken here
+        :return: True if the alert should be sent, it is then remembered as the last alert sent
+        """
+        if now is None:
+            now = self.clock()
+
+        last = self._last_sent.get(trading_symbol)
+        if self.policy != 'none' and last is not None and last[0] == open_unix:
+            _, last_multiplier, last_time = last
+            if self.policy == 'first_only':
+                send = False
+            elif self.policy == 'escalate':
+                send = multiplier >= last_multiplier * self.escalation_factor
+            else:
+                send = now - last_time >= self.cooldown_secs
+
+            if not send:
+                self.suppressed += 1
+                return False
+
+        self._last_sent[trading_symbol] = (open_unix, multiplier, now)
+        return True
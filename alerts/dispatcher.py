@@ -0,0 +1,214 @@
+import datetime
+import multiprocessing
+import os
+import queue
+import threading
+from typing import Optional
+
+from termcolor import colored
+
+from alerts import AlertJob
+from alerts.pipeline import AlertPipeline
+from core import config
+from rendering import RenderRequest
+from rendering.service import RenderService
+from storage.alert_log import AlertLog
+from writers import IWriter
+from writers.filesystem import FsWriter
+from writers.queued import QueuedWriter
+
+
+class IAlertSink:
+    """
+    Where BaseKLineProcessor hands the alerts it detects over, it must never block the websocket event loop
+    """
+
+    def submit(self, job: AlertJob) -> bool:
+        raise NotImplemented('Should be implemented by super Implementation class')
+
+    def warm_up(self):
+        """
+        Gets ready to send the first alert quickly, called once the websocket streams are up so it does not
+        delay them
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+class AlertDispatcher(IAlertSink):
+    """
+    Renders the chart of the alerts and sends them to the writers, on the alert pipeline's threads and the
+    render service's processes. There is a single one per app, even when symbols are processed by several
+    worker processes, they forward their alerts to it through a QueueAlertSink.
+    """
+
+    def __init__(self, app_config: config.AppConfig):
+        self.app_config = app_config
+        self.timeframe_plot = getattr(app_config, 'timeframe_plot', 1)
+        self.plot_framework = getattr(app_config, 'plot_framework', 'plotly')
+        self.debug = getattr(app_config, 'debug', False)
+
+        # Imported here, aiohttp takes a while to import and worker processes only forward their alerts
+        from writers.slack_async import AsyncSlackWriter
+
+        # Each writer has its own queue and thread, a slow or failing one does not hold up the others
+        self.out_writers = [self.queued(w) for w in [
+            FsWriter(app_config.out_dir),
+            AsyncSlackWriter(
+                slack_token=os.getenv('SLACK_ACCESS_TOKEN'),
+                channel_id=os.getenv('SLACK_CHANNEL_ID'),
+                batch_window=getattr(app_config, 'slack_batch_window_secs', 1.0),
+                upload_flow=getattr(app_config, 'slack_upload_flow', 'external'),
+                max_connections=getattr(app_config, 'slack_max_connections', 10),
+            )
+        ]]
+
+        self.render_service = RenderService(
+            self.plot_framework,
+            processes=getattr(app_config, 'render_processes', min(4, os.cpu_count() or 1)),
+            timeout=getattr(app_config, 'render_timeout', 60),
+            debug=self.debug,
+            figure_cache_size=getattr(app_config, 'matplotlib_figure_cache_size', 0))
+
+        # History of the alerts, with their charts
+        self.alert_log = None
+        alert_log_dir = getattr(app_config, 'alert_log_dir', './alert_log')
+        if alert_log_dir:
+            self.alert_log = AlertLog(
+                alert_log_dir,
+                segment_max_bytes=int(getattr(app_config, 'alert_log_segment_mb', 64) * 1024 * 1024),
+                segment_max_secs=getattr(app_config, 'alert_log_segment_secs', 24 * 60 * 60)).start()
+
+        # There is no point in having fewer threads waiting on renders than render processes
+        self.alert_pipeline = AlertPipeline(
+            self.generate_graph, self.out_writers,
+            workers=getattr(app_config, 'alert_workers', max(2, self.render_service.processes)),
+            max_queue_size=getattr(app_config, 'alert_queue_size', 100),
+            debug=self.debug,
+            alert_log=self.alert_log)
+
+    def queued(self, writer: IWriter) -> QueuedWriter:
+        """
+        Wraps the writer in its queue, with the writer_* settings, overridden by the ones given for its name in
+        writer_overrides
+        """
+        settings = {
+            'max_size': getattr(self.app_config, 'writer_queue_size', 100),
+            'overflow_policy': getattr(self.app_config, 'writer_overflow_policy', 'drop_oldest'),
+            'retries': getattr(self.app_config, 'writer_retries', 3),
+            'retry_delay': getattr(self.app_config, 'writer_retry_delay_secs', 1),
+            'timeout': getattr(self.app_config, 'writer_timeout_secs', 60),
+            'down_after': getattr(self.app_config, 'writer_down_after', 5),
+        }
+        settings.update(getattr(self.app_config, 'writer_overrides', {}).get(writer.name, {}))
+        return QueuedWriter(writer, **settings)
+
+    def submit(self, job: AlertJob) -> bool:
+        return self.alert_pipeline.submit(job)
+
+    def warm_up(self):
+        # Render processes start and import the plotting framework in the background
+        self.render_service.start()
+
+    def close(self):
+        self.alert_pipeline.close()
+        self.render_service.close()
+        for w in self.out_writers:
+            w.close(getattr(self.app_config, 'writer_timeout_secs', 60))
+        if self.alert_log is not None:
+            self.alert_log.close()
+
+    def render_request(self, job: AlertJob, framework: Optional[str] = None) -> RenderRequest:
+        return RenderRequest(
+            framework=framework or self.plot_framework,
+            base=job.base,
+            quote=job.quote,
+            candles=job.candles,
+            timeframe_plot=self.timeframe_plot,
+            up_color=getattr(self.app_config, 'candle_up_color', '#26a69a'),
+            down_color=getattr(self.app_config, 'candle_down_color', '#ef5350'),
+            width=getattr(self.app_config, 'plot_width', 1080),
+            height=getattr(self.app_config, 'plot_height', 720),
+        )
+
+    def generate_graph(self, job: AlertJob) -> bytes:
+        """
+        Renders the chart of an alert, it runs on the alert pipeline's worker threads so it must only
+        read from the job, never from the ticker cache. The rendering itself happens on the render service.
+        """
+        if self.debug:
+            print(
+                f'{job.base}/{job.quote} - '
+                f'First Candle: {datetime.datetime.fromtimestamp(job.candles["open_unix"][0] / 1000, datetime.timezone.utc)}')
+
+            plotly_chart_bytes = self.render_service.render(self.render_request(job, 'plotly')).image
+
+            with open(f'./output/plotly_{job.base}{job.quote}.png', 'wb') as fd:
+                fd.write(plotly_chart_bytes)
+
+            mpl_chart_bytes = self.render_service.render(self.render_request(job, 'matplotlib')).image
+            with open(f'./output/matplotlib_{job.base}{job.quote}.png', 'wb') as fd:
+                fd.write(mpl_chart_bytes)
+
+            if self.plot_framework == 'matplotlib':
+                return mpl_chart_bytes
+            else:
+                return plotly_chart_bytes
+
+        if self.plot_framework not in ('matplotlib', 'plotly', 'native'):
+            raise OSError(f'unknown value {self.plot_framework}')
+
+        return self.render_service.render(self.render_request(job)).image
+
+
+class QueueAlertSink(IAlertSink):
+    """
+    Used by the worker processes, alerts are put on a queue read by the process owning the AlertDispatcher.
+    multiprocessing.Queue pickles and writes on a background thread, so submit() returns right away; the candle
+    columns of the job are NumPy arrays, pickled as raw buffers.
+    """
+
+    def __init__(self, alert_queue: multiprocessing.Queue, worker_name: str = ''):
+        self.alert_queue = alert_queue
+        self.worker_name = worker_name
+        self.dropped = 0
+
+    def submit(self, job: AlertJob) -> bool:
+        try:
+            self.alert_queue.put_nowait(job)
+        except queue.Full:
+            self.dropped += 1
+            print(colored(f'{self.worker_name} alert queue is full, dropping alert for {job.base}/{job.quote}',
+                          'red'))
+            return False
+        return True
+
+
+class AlertQueueListener:
+    """
+    Reads the alerts sent by the worker processes and hands them to the dispatcher, on a thread of the process
+    owning the dispatcher
+    """
+
+    def __init__(self, alert_queue: multiprocessing.Queue, dispatcher: IAlertSink):
+        self.alert_queue = alert_queue
+        self.dispatcher = dispatcher
+        self.received = 0
+        self._thread = threading.Thread(target=self._listen, name='alert-queue-listener', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _listen(self):
+        while True:
+            job = self.alert_queue.get()
+            if job is None:
+                break
+            self.received += 1
+            self.dispatcher.submit(job)
+
+    def close(self, timeout: Optional[float] = None):
+        self.alert_queue.put(None)
+        self._thread.join(timeout)
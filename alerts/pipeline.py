@@ -0,0 +1,213 @@
+import concurrent.futures
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from termcolor import colored
+
+from alerts import AlertJob
+from core import metrics
+from storage.alert_log import AlertLog
+from writers import IWriter
+
+ALERTS_SUBMITTED = metrics.counter('alerts_submitted_total', 'Alerts queued to be rendered and sent')
+ALERTS_DROPPED = metrics.counter('alerts_dropped_total', 'Alerts dropped because the queue was full')
+ALERT_RENDER_FAILURES = metrics.counter('alert_render_failures_total', 'Alerts whose chart could not be rendered')
+ALERT_QUEUE_DEPTH = metrics.gauge('alert_queue_depth', 'Alerts waiting to be rendered')
+ALERT_DETECT_TO_RENDER_SECONDS = metrics.histogram('alert_detect_to_render_seconds',
+                                                   'Time from detection until the chart is rendered')
+ALERT_RENDER_TO_ACK_SECONDS = metrics.histogram('alert_render_to_ack_seconds',
+                                                'Time from the chart being rendered until the writer is done',
+                                                ('writer',))
+ALERT_WRITER_ERRORS = metrics.counter('alert_writer_errors_total', 'Alerts the writer failed to send', ('writer',))
+
+
+class StageTimer:
+    """
+    Accumulates how long a stage of the pipeline takes, in seconds
+    """
+    count: int
+    total: float
+    max: float
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, elapsed: float):
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+    @property
+    def avg(self) -> float:
+        return self.total / self.count if self.count > 0 else 0
+
+    def __str__(self):
+        return f'n={self.count} avg={self.avg * 1000:.1f}ms max={self.max * 1000:.1f}ms'
+
+
+class AlertPipeline:
+    """
+    Renders and dispatches alerts on a pool of worker threads, so neither chart rendering nor the writers
+    (a Slack upload may take seconds) block the websocket event loop.
+
+    submit() never blocks: if the queue is full the alert is dropped and counted.
+    Stages timed:
+     - queue: from detection until a worker picks the job
+     - render: chart generation
+     - dispatch: all writers, writers sending in the background only take the time to hand the alert over
+
+    Writers are independent, one failing does not keep the alert from the others. How long each one takes and
+    its errors are reported in the metrics. Wrapped in a QueuedWriter, a slow writer does not delay the others
+    either.
+    """
+    STAGES = ('queue', 'render', 'dispatch')
+
+    def __init__(self, render: Callable[[AlertJob], bytes], writers: List[IWriter], workers: int = 2,
+                 max_queue_size: int = 100, debug: bool = False, alert_log: Optional[AlertLog] = None):
+        """
+        :param alert_log: where every alert rendered (or not) is logged, with its chart
+        """
+        self.render = render
+        self.writers = writers
+        self.alert_log = alert_log
+        self.debug = debug
+        self._queue: queue.Queue[Optional[AlertJob]] = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self.timers: Dict[str, StageTimer] = {stage: StageTimer() for stage in self.STAGES}
+        self.submitted = 0
+        self.dropped = 0
+        self.failed = 0
+        ALERT_QUEUE_DEPTH.set_function(lambda: self.queue_depth)
+
+        self._workers = []
+        for i in range(max(1, workers)):
+            worker = threading.Thread(target=self._work, name=f'alert-worker-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, job: AlertJob) -> bool:
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            ALERTS_DROPPED.inc()
+            print(colored(f'Alert queue is full, dropping alert for {job.base}/{job.quote}', 'red'))
+            return False
+
+        with self._lock:
+            self.submitted += 1
+        ALERTS_SUBMITTED.inc()
+        return True
+
+    def _time(self, stage: str, elapsed: float):
+        with self._lock:
+            self.timers[stage].add(elapsed)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+
+            try:
+                self.process(job)
+            finally:
+                self._queue.task_done()
+
+    def process(self, job: AlertJob):
+        bsq = f'{job.base}/{job.quote}'
+        started = time.perf_counter()
+        self._time('queue', started - job.detected_at)
+
+        try:
+            chart_bytes = self.render(job)
+        except Exception as exc:
+            with self._lock:
+                self.failed += 1
+            ALERT_RENDER_FAILURES.inc()
+            print(f'An error occurred rendering {bsq} - {exc}')
+            self.log(job, None)
+            return
+
+        rendered = time.perf_counter()
+        self.log(job, chart_bytes)
+        self._time('render', rendered - started)
+        ALERT_DETECT_TO_RENDER_SECONDS.observe(rendered - job.detected_at)
+
+        for w in self.writers:
+            writer = w.name
+            try:
+                result = w.write(job.base, job.quote, job.message, chart_bytes)
+            except Exception as exc:
+                self._written(bsq, writer, rendered, exc)
+                continue
+
+            if isinstance(result, concurrent.futures.Future):
+                # Sent in the background, it is acknowledged later
+                result.add_done_callback(
+                    lambda f, writer=writer: self._written(bsq, writer, rendered, f.exception()))
+            else:
+                self._written(bsq, writer, rendered, None)
+
+        self._time('dispatch', time.perf_counter() - rendered)
+
+        if self.debug:
+            print(self.stats_line())
+
+    def log(self, job: AlertJob, chart_bytes: Optional[bytes]):
+        if self.alert_log is None:
+            return
+        record = {
+            'detected_unix': int(time.time() * 1000),
+            **(job.details or {}),
+            'trading_symbol': job.trading_symbol,
+            'base': job.base,
+            'quote': job.quote,
+            'message': job.message,
+        }
+        self.alert_log.append(record, chart_bytes)
+
+    def _written(self, bsq: str, writer: str, rendered: float, exc: Optional[BaseException]):
+        if exc is None:
+            ALERT_RENDER_TO_ACK_SECONDS.labels(writer).observe(time.perf_counter() - rendered)
+            return
+
+        with self._lock:
+            self.failed += 1
+        ALERT_WRITER_ERRORS.labels(writer).inc()
+        print(f'An error occurred sending {bsq} with {writer} - {exc}')
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'queue_depth': self.queue_depth,
+                'submitted': self.submitted,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'timers': {stage: (t.count, t.avg, t.max) for stage, t in self.timers.items()},
+            }
+
+    def stats_line(self) -> str:
+        with self._lock:
+            timers = ' '.join(f'{stage}[{t}]' for stage, t in self.timers.items())
+            return f'Alert pipeline: depth={self.queue_depth} submitted={self.submitted} dropped={self.dropped} ' \
+                   f'failed={self.failed} {timers}'
+
+    def close(self, timeout: Optional[float] = None):
+        """
+        Waits for the queued alerts to be processed, then stops the workers
+        """
+        for _ in self._workers:
+            self._queue.put(None)
+        for w in self._workers:
+            w.join(timeout)
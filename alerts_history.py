@@ -0,0 +1,79 @@
+"""
+Lists the alerts of the alert log (alert_log_dir setting), with a summary per symbol, to look back at what
+fired and judge whether it was worth it.
+
+    python alerts_history.py ./alert_log --symbol TRBUSDT --since 7d
+    python alerts_history.py ./alert_log --since 2022-12-01 --until 2022-12-02 --json > alerts.jsonl
+"""
+import argparse
+import datetime
+import json
+import os
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from termcolor import colored
+
+from storage.alert_log import chart_path, query
+
+DURATION_UNITS = {'m': 60, 'h': 60 * 60, 'd': 24 * 60 * 60, 'w': 7 * 24 * 60 * 60}
+
+
+def parse_time(value: Optional[str]) -> Optional[int]:
+    """
+    :param value: a duration back from now (30m, 12h, 7d, 2w) or an ISO date/time, UTC unless it says otherwise
+    :return: time in ms since the epoch
+    """
+    if value is None:
+        return None
+    if value[-1:] in DURATION_UNITS and value[:-1].replace('.', '', 1).isdigit():
+        return int((time.time() - float(value[:-1]) * DURATION_UNITS[value[-1]]) * 1000)
+
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
+def format_unix(unix: int) -> str:
+    return datetime.datetime.fromtimestamp(unix / 1000, datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def print_alerts(log_dir: str, records: List[Dict]):
+    by_symbol: Dict[str, List[Dict]] = defaultdict(list)
+    for r in records:
+        by_symbol[r['trading_symbol']].append(r)
+        price_pct_diff = r.get('price_pct_diff')
+        chart = chart_path(log_dir, r['chart'], r.get('chart_format')) if r.get('chart') else '-'
+        print(f'{format_unix(r["detected_unix"])}  {r["trading_symbol"]:<14} '
+              f'{r.get("vol_multiple", 0):7.2f}X  '
+              f'{price_pct_diff if price_pct_diff is not None else 0:+7.2f}%  '
+              f'{(r.get("thresholds") or {}).get("rule_set") or "-":<10} {chart}')
+
+    print(colored(f'{len(records)} alerts on {len(by_symbol)} symbols', 'cyan'))
+    for trading_symbol, alerts in sorted(by_symbol.items(), key=lambda item: -len(item[1]))[:20]:
+        multiples = [a.get('vol_multiple', 0) for a in alerts]
+        print(f'\t{trading_symbol}: {len(alerts)} alerts, volume x{sum(multiples) / len(multiples):.1f} avg '
+              f'x{max(multiples):.1f} max')
+
+
+# noinspection PyShadowingNames
+def run(args: argparse.Namespace):
+    records = list(query(args.log_dir, args.symbol, parse_time(args.since), parse_time(args.until)))
+    if args.json:
+        for r in records:
+            print(json.dumps(r))
+    else:
+        print_alerts(os.path.abspath(args.log_dir), records)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('log_dir', nargs='?', default='./alert_log', help='alert_log_dir of the settings')
+    parser.add_argument('--symbol', default=None, help='Only the alerts of this symbol, BTCUSDT')
+    parser.add_argument('--since', default=None, help='Duration back from now (30m, 12h, 7d, 2w) or ISO date')
+    parser.add_argument('--until', default=None, help='Duration back from now or ISO date')
+    parser.add_argument('--json', action='store_true', help='Prints the records, one JSON per line')
+
+    run(parser.parse_args())
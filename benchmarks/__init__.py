@@ -0,0 +1,9 @@
+"""
+Micro benchmarks for the hot paths of the application, each module can be run on its own, for instance:
+
+    python -m benchmarks.bench_candle_buffer
+
+benchmarks.suite runs all of them on synthetic data and stores the results as JSON to compare runs over time:
+
+    python -m benchmarks.suite --symbols 200 --ticks-per-sec 2 --compare benchmarks/results/<previous run>.json
+"""
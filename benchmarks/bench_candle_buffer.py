@@ -0,0 +1,105 @@
+"""
+Compares the previous candle history implementation (a list of Candle objects evicting with pop(0))
+against CandleRingBuffer, both in time per closed candle and in memory per symbol.
+"""
+import random
+import timeit
+import tracemalloc
+
+from core.candle_buffer import CandleRingBuffer
+from core.models import Candle
+
+
+def make_candle(i: int) -> Candle:
+    candle = Candle()
+    candle.open_unix = i * 60_000
+    candle.close_unix = candle.open_unix + 59_999
+    candle.open = random.uniform(1, 2)
+    candle.high = candle.open * 1.01
+    candle.low = candle.open * 0.99
+    candle.close = random.uniform(candle.low, candle.high)
+    candle.base_asset_volume = random.uniform(0, 1_000)
+    candle.quote_asset_volume = candle.base_asset_volume * candle.close
+    return candle
+
+
+def list_append(candles: list, candle: Candle, capacity: int):
+    if len(candles) >= capacity:
+        candles.pop(0)
+    candles.append(candle)
+
+
+def bench_append(capacity: int, n: int):
+    incoming = [make_candle(i) for i in range(n)]
+
+    def run_list():
+        candles = [make_candle(i) for i in range(capacity)]
+        for c in incoming:
+            list_append(candles, c, capacity)
+
+    def run_ring():
+        candles = CandleRingBuffer(capacity)
+        for i in range(capacity):
+            candles.append(make_candle(i))
+        for c in incoming:
+            candles.append(c)
+
+    # Filling the initial history is the same work for both, measure it to subtract it
+    def run_fill():
+        for i in range(capacity):
+            make_candle(i)
+
+    fill = min(timeit.repeat(run_fill, number=1, repeat=5))
+    list_time = min(timeit.repeat(run_list, number=1, repeat=5)) - fill
+    ring_time = min(timeit.repeat(run_ring, number=1, repeat=5)) - fill
+
+    print(f'capacity={capacity} appends={n}')
+    print(f'\tlist + pop(0):    {list_time * 1e9 / n:10.1f} ns/candle')
+    print(f'\tCandleRingBuffer: {ring_time * 1e9 / n:10.1f} ns/candle')
+
+
+def bench_read(capacity: int):
+    """
+    Reading a whole column, which is what plotting and any statistic over the history needs
+    """
+    candles = [make_candle(i) for i in range(capacity)]
+    buffer = CandleRingBuffer(capacity)
+    for c in candles:
+        buffer.append(c)
+
+    n = 2_000
+    list_time = min(timeit.repeat(lambda: [c.close for c in candles], number=n, repeat=5))
+    ring_time = min(timeit.repeat(lambda: buffer.column('close'), number=n, repeat=5))
+
+    print(f'read close column, capacity={capacity}')
+    print(f'\tlist of Candle:   {list_time * 1e6 / n:10.2f} us')
+    print(f'\tCandleRingBuffer: {ring_time * 1e6 / n:10.2f} us')
+
+
+def bench_memory(capacity: int, symbols: int):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    lists = [[make_candle(i) for i in range(capacity)] for _ in range(symbols)]
+    list_bytes = sum(s.size_diff for s in tracemalloc.take_snapshot().compare_to(before, 'filename'))
+    del lists
+
+    before = tracemalloc.take_snapshot()
+    buffers = []
+    for _ in range(symbols):
+        buffer = CandleRingBuffer(capacity)
+        for i in range(capacity):
+            buffer.append(make_candle(i))
+        buffers.append(buffer)
+    ring_bytes = sum(s.size_diff for s in tracemalloc.take_snapshot().compare_to(before, 'filename'))
+    tracemalloc.stop()
+
+    print(f'memory for {symbols} symbols x {capacity} candles')
+    print(f'\tlist of Candle:   {list_bytes / 1024 / 1024:8.2f} MiB')
+    print(f'\tCandleRingBuffer: {ring_bytes / 1024 / 1024:8.2f} MiB')
+
+
+if __name__ == '__main__':
+    for cap in (500, 1500):
+        bench_append(cap, 20_000)
+        bench_read(cap)
+    bench_memory(500, 200)
@@ -0,0 +1,77 @@
+"""
+Compares the previous kline message handling (json.loads of the payload then building a Candle) against
+the decoders of exchanges.binance.decoders, in messages per second, on synthetic futures continuousKline frames.
+"""
+import json
+import random
+import timeit
+
+from core.models import Candle
+from exchanges.binance.decoders import JsonKlineDecoder, OrjsonKlineDecoder, orjson
+
+SYMBOLS = [f'SYM{i}USDT' for i in range(200)]
+
+
+def make_frame(symbol: str, i: int) -> bytes:
+    open_ = random.uniform(1, 2)
+    volume = random.uniform(0, 1_000)
+    open_unix = 1_670_000_000_000 + i * 60_000
+    message = {
+        'stream': f'{symbol.lower()}_perpetual@continuousKline_1m',
+        'data': {
+            'e': 'continuous_kline', 'E': open_unix + 1_000, 'ps': symbol, 'ct': 'PERPETUAL',
+            'k': {
+                't': open_unix, 'T': open_unix + 59_999, 'i': '1m', 'f': 1, 'L': 2, 'o': f'{open_:.4f}',
+                'c': f'{open_ * 1.001:.4f}', 'h': f'{open_ * 1.01:.4f}', 'l': f'{open_ * 0.99:.4f}',
+                'v': f'{volume:.3f}', 'n': 100, 'x': random.random() < 0.05, 'q': f'{volume * open_:.5f}',
+                'V': '0', 'Q': '0', 'B': '0',
+            },
+        },
+    }
+    return json.dumps(message, separators=(',', ':')).encode()
+
+
+def legacy_decode(payload: bytes):
+    json_message = json.loads(payload)
+    stream_data = json_message['data']
+    if 'ps' in stream_data:
+        trading_symbol = stream_data['ps'].upper()
+    else:
+        trading_symbol = stream_data['s'].upper()
+
+    candle_json = stream_data['k']
+    is_candle_closed = candle_json['x']
+    candle = Candle()
+    candle.open_unix = int(candle_json['t'])
+    candle.close_unix = int(candle_json['T'])
+    candle.open = float(candle_json['o'])
+    candle.close = float(candle_json['c'])
+    candle.high = float(candle_json['h'])
+    candle.low = float(candle_json['l'])
+    candle.base_asset_volume = float(candle_json['v'])
+    candle.quote_asset_volume = float(candle_json['q'])
+    return trading_symbol, candle, is_candle_closed
+
+
+def bench(n: int):
+    frames = [make_frame(random.choice(SYMBOLS), i) for i in range(n)]
+    stream_index = {f'{s.lower()}_perpetual@continuousKline_1m': s for s in SYMBOLS}
+
+    decoders = {'json.loads + Candle': legacy_decode, 'JsonKlineDecoder': JsonKlineDecoder(stream_index).decode}
+    if orjson is not None:
+        decoders['OrjsonKlineDecoder'] = OrjsonKlineDecoder(stream_index).decode
+    else:
+        print('orjson is not installed, skipping OrjsonKlineDecoder')
+
+    def run(decode):
+        for frame in frames:
+            decode(frame)
+
+    print(f'{n} frames of {sum(map(len, frames)) // n} bytes on average')
+    for name, decode in decoders.items():
+        elapsed = min(timeit.repeat(lambda: run(decode), number=1, repeat=5))
+        print(f'\t{name:<20} {n / elapsed:12,.0f} msg/s {elapsed * 1e9 / n:8.0f} ns/msg')
+
+
+if __name__ == '__main__':
+    bench(100_000)
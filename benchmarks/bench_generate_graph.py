@@ -0,0 +1,57 @@
+"""
+Time spent per alert building the OHLCV DataFrame that is handed to the plotting framework,
+row by row (previous implementation of generate_graph) vs in bulk from the candle buffer columns.
+"""
+import random
+import timeit
+
+import pandas as pd
+
+from core.candle_buffer import CandleRingBuffer
+from rendering.frames import build_ohlcv_frame
+
+
+def make_buffer(n: int) -> CandleRingBuffer:
+    buffer = CandleRingBuffer(n)
+    price = 100.0
+    for i in range(n):
+        open_ = price
+        price *= random.uniform(0.99, 1.01)
+        buffer.append_values(i * 60_000, i * 60_000 + 59_999, open_, max(open_, price) * 1.002,
+                             min(open_, price) * 0.998, price, random.uniform(0, 1_000), random.uniform(0, 100_000))
+    return buffer
+
+
+def legacy_frame(candles: CandleRingBuffer, candles_to_plot: int, timeframe_plot: int) -> pd.DataFrame:
+    df = pd.DataFrame(columns=['unix', 'date', 'open', 'high', 'low', 'close', 'volume'])
+    df = df.astype({'open': 'float64', 'high': 'float64', 'close': 'float64', 'low': 'float64', 'volume': 'float64'})
+    df['date'] = pd.to_datetime(df['unix'], unit='ms')
+    df.set_index('date', inplace=True)
+
+    for i in range(0, min(candles_to_plot, len(candles))):
+        candle = candles[i]
+        df.loc[pd.to_datetime(candle.open_unix, unit='ms')] = {
+            'unix': candle.open_unix, 'open': candle.open, 'high': candle.high, 'low': candle.low,
+            'close': candle.close, 'volume': candle.base_asset_volume,
+        }
+
+    return df.resample(f'{timeframe_plot}min').agg(
+        {'close': 'last', 'open': 'first', 'high': 'max', 'low': 'min', 'volume': 'sum'})
+
+
+def bench(candles_to_plot: int, timeframe_plot: int):
+    buffer = make_buffer(candles_to_plot)
+
+    legacy = min(timeit.repeat(lambda: legacy_frame(buffer, candles_to_plot, timeframe_plot), number=1, repeat=3))
+    n = 200
+    bulk = min(timeit.repeat(
+        lambda: build_ohlcv_frame(buffer.columns(candles_to_plot), timeframe_plot), number=n, repeat=5)) / n
+
+    print(f'candles_to_plot={candles_to_plot} timeframe_plot={timeframe_plot}')
+    print(f'\trow by row: {legacy * 1e3:10.2f} ms/alert')
+    print(f'\tbulk:       {bulk * 1e3:10.2f} ms/alert')
+
+
+if __name__ == '__main__':
+    for tf in (1, 5):
+        bench(500, tf)
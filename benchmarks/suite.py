@@ -0,0 +1,414 @@
+"""
+Runs the benchmarks of the hot paths on synthetic data and stores the results as JSON, so runs can be compared
+over time:
+
+    python -m benchmarks.suite --symbols 200 --ticks-per-sec 2 --duration 600
+    python -m benchmarks.suite --compare benchmarks/results/20261017-101500.json
+
+- decode:    cost of decoding a kline message, per decoder
+- detect:    cost of processing a decoded update (on_kline), per detector mode and with the rule engine
+- aggregate: cost of building the aggregated candles the price check compares against
+- render:    time to render the chart of an alert, per plot framework, and with matplotlib's figure cache
+- backfill:  time to load the markets and the initial candles of every symbol from the REST simulator
+
+Every metric ends with its unit, times are lower is better, *_per_sec higher is better.
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from alerts.dispatcher import IAlertSink
+from alerts.rules import RuleSet
+from core import config
+from core.models import Ticker, TickerInfo
+from exchanges.backfill import CandleBackfiller
+from exchanges.binance import AbstractBinanceWsClient
+from exchanges.binance.binance_futures_rest import BinanceFuturesRestClient
+from exchanges.binance.binance_futures_ws import BinanceFuturesWsClient
+from exchanges.binance.binance_spot_ws import BinanceSpotWsApi
+from exchanges.binance.decoders import JsonKlineDecoder, OrjsonKlineDecoder, orjson
+from rendering import RenderRequest, render
+from rendering.service import warm_up
+from simulator.market import SyntheticMarket
+from simulator.rest import RestSimulator
+
+BENCHMARKS = ('decode', 'detect', 'aggregate', 'render', 'backfill')
+PLOT_FRAMEWORKS = ('plotly', 'matplotlib', 'native')
+# Suffixes of the metrics that are better the higher they are, the rest are times
+HIGHER_IS_BETTER = ('_per_sec',)
+
+Results = Dict[str, Dict[str, float]]
+
+
+class NullAlertSink(IAlertSink):
+    """
+    Counts the alerts and keeps what identifies them: (trading symbol, candle open time, volume multiplier)
+    """
+    def __init__(self):
+        self.submitted = 0
+        self.alerts = []
+
+    def submit(self, job) -> bool:
+        self.submitted += 1
+        self.alerts.append((job.trading_symbol, job.details['open_unix'], job.details['vol_multiple']))
+        return True
+
+
+@contextlib.contextmanager
+def quiet():
+    """
+    Hides what the code benchmarked prints, printing would be timed as well
+    """
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def summarize(samples: List[float], scale: float, unit: str) -> Dict[str, float]:
+    values = np.asarray(samples) * scale
+    return {
+        f'avg_{unit}': float(values.mean()),
+        f'p50_{unit}': float(np.percentile(values, 50)),
+        f'p99_{unit}': float(np.percentile(values, 99)),
+        f'max_{unit}': float(values.max()),
+    }
+
+
+def create_client(app_config: config.AppConfig, market: SyntheticMarket, candle_buffer_len: int,
+                  alert_sink: IAlertSink) -> AbstractBinanceWsClient:
+    tickers = []
+    for trading_symbol in market.symbols:
+        ticker = Ticker()
+        ticker.base = trading_symbol[:-4]
+        ticker.quote = 'USDT'
+        ticker.price_precision = 6
+        ticker.quantity_precision = 3
+        tickers.append(TickerInfo(ticker, market.candle_buffer(candle_buffer_len, trading_symbol)))
+
+    with quiet():
+        if market.market == 'binance_spot':
+            return BinanceSpotWsApi(app_config, tickers, '1m', alert_sink)
+        return BinanceFuturesWsClient(app_config, tickers, '1m', alert_sink)
+
+
+def bench_decode(market: SyntheticMarket, frames: List[bytes]) -> Results:
+    stream_index = {market.stream_name(s): s for s in market.symbols}
+    decoders = {'json': JsonKlineDecoder(stream_index)}
+    if orjson is not None:
+        decoders['orjson'] = OrjsonKlineDecoder(stream_index)
+
+    results = {}
+    for name, decoder in decoders.items():
+        decode = decoder.decode
+        best = None
+        for _ in range(3):
+            started = time.perf_counter()
+            for frame in frames:
+                decode(frame)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        results[f'decode.{name}'] = {'ns_per_msg': best * 1e9 / len(frames), 'msg_per_sec': len(frames) / best}
+    return results
+
+
+def bench_detect(market: SyntheticMarket, frames: List[bytes], candle_buffer_len: int, batch: int) -> Results:
+    """
+    Updates are fed from an event loop, batch messages per iteration as if they were read off the sockets at
+    once, so the rule engine evaluates each batch as it would live. Per message samples only time on_kline,
+    msg_per_sec includes the evaluations.
+
+    The rule_engine.<mode> variants run the detector mode through the rule engine with the default thresholds
+    only, they must fire exactly the alerts of <mode>: mismatches counts those that differ (a different volume
+    multiplier included).
+    """
+    stream_index = {market.stream_name(s): s for s in market.symbols}
+    decoded = [JsonKlineDecoder(stream_index).decode(frame) for frame in frames]
+
+    variants: Dict[str, Dict] = {
+        'previous': {'detector_mode': 'previous'},
+        'zscore': {'detector_mode': 'zscore'},
+        'baseline_multiple': {'detector_mode': 'baseline_multiple'},
+        # A group of symbols with its own thresholds, everything else with the default ones
+        'rule_engine': {'detector_mode': 'zscore',
+                        'rule_sets': [{'name': 'majors', 'symbols': market.symbols[:len(market.symbols) // 10],
+                                       'min_volume_zscore': 3}]},
+    }
+    # A rule set matching no symbol, everything goes to the default one
+    for mode in RuleSet.DETECTOR_MODES:
+        variants[f'rule_engine.{mode}'] = {'detector_mode': mode, 'rule_sets': [{'name': 'none', 'symbols': []}]}
+    alerts = {}
+
+    results = {}
+    perf_counter = time.perf_counter
+    for name, settings in variants.items():
+        app_config = config.AppConfig()
+        app_config.candle_buffer_len = candle_buffer_len
+        app_config.min_candles_to_plot = min(100, candle_buffer_len)
+        for setting, value in settings.items():
+            setattr(app_config, setting, value)
+
+        sink = NullAlertSink()
+        client = create_client(app_config, market, candle_buffer_len, sink)
+        on_kline = client.on_kline
+        samples = [0.0] * len(decoded)
+
+        async def feed():
+            for start in range(0, len(decoded), batch):
+                for i in range(start, min(len(decoded), start + batch)):
+                    fields = decoded[i]
+                    t0 = perf_counter()
+                    on_kline(*fields)
+                    samples[i] = perf_counter() - t0
+                await asyncio.sleep(0)
+
+        loop = asyncio.new_event_loop()
+        with quiet():
+            started = perf_counter()
+            loop.run_until_complete(feed())
+            elapsed = perf_counter() - started
+        loop.close()
+
+        results[f'detect.{name}'] = {
+            **summarize(samples, 1e6, 'us'),
+            'msg_per_sec': len(decoded) / elapsed,
+            'alerts': sink.submitted,
+        }
+        alerts[name] = sink.alerts
+
+        mode = name.partition('rule_engine.')[2]
+        if mode:
+            mismatches = len(set(alerts[mode]) ^ set(sink.alerts))
+            results[f'detect.{name}']['mismatches'] = mismatches
+            if mismatches:
+                print(f'\trule engine and {mode} disagree on {mismatches} alerts')
+    return results
+
+
+def bench_aggregate(market: SyntheticMarket, candle_buffer_len: int, n: int = 10_000) -> Results:
+    app_config = config.AppConfig()
+    client = create_client(app_config, market, candle_buffer_len, NullAlertSink())
+    trading_symbol = market.symbols[0]
+    ti = client.ticker_cache[trading_symbol]
+
+    def timed(fn: Callable) -> Dict[str, float]:
+        fn()
+        started = time.perf_counter()
+        for _ in range(n):
+            fn()
+        return {'us_per_call': (time.perf_counter() - started) * 1e6 / n}
+
+    results = {}
+    for period in (5, 60):
+        results[f'aggregate.last_n_periods.{period}'] = timed(
+            lambda: client.get_last_n_periods_aggr_candle(ti, period))
+        results[f'aggregate.aligned_diff_pct.{period}'] = timed(lambda: client.get_n_aggr_max_diff_pct(ti, period))
+    results['aggregate.aggregate_candles.all'] = timed(
+        lambda: client.aggregate_candles(ti, 0, len(ti.candles) - 1))
+    return results
+
+
+def bench_render(market: SyntheticMarket, candles_to_plot: int, renders: int,
+                 frameworks: List[str], figure_cache_size: int = 8) -> Results:
+    results = {}
+    for framework in frameworks:
+        try:
+            started = time.perf_counter()
+            warm_up(framework)
+            warm_up_secs = time.perf_counter() - started
+        except Exception as exc:
+            print(f'\tskipping {framework}, it could not render - {exc}')
+            continue
+
+        samples, size = time_renders(market, framework, candles_to_plot, renders, market.symbols)
+        results[f'render.{framework}'] = {**summarize(samples, 1e3, 'ms'), 'warm_up_s': warm_up_secs,
+                                          'png_bytes': size}
+
+        if framework == 'matplotlib' and figure_cache_size > 0:
+            # A pump: the same couple of symbols alert again and again, their figures are reused
+            from rendering.matplotlib_renderer import set_figure_cache_size
+            set_figure_cache_size(figure_cache_size)
+            try:
+                samples, size = time_renders(market, framework, candles_to_plot, renders, market.symbols[:2])
+            finally:
+                set_figure_cache_size(0)
+            results['render.matplotlib.figure_cache'] = {**summarize(samples, 1e3, 'ms'), 'png_bytes': size}
+    return results
+
+
+def time_renders(market: SyntheticMarket, framework: str, candles_to_plot: int, renders: int,
+                 symbols: List[str]) -> Tuple[List[float], int]:
+    samples = []
+    size = 0
+    for i in range(renders):
+        trading_symbol = symbols[i % len(symbols)]
+        request = RenderRequest(framework, trading_symbol[:-4], 'USDT',
+                                market.candle_columns(candles_to_plot, trading_symbol))
+        started = time.perf_counter()
+        size = len(render(request))
+        samples.append(time.perf_counter() - started)
+    return samples, size
+
+
+def bench_backfill(market: SyntheticMarket, candle_buffer_len: int, latency: float, workers: int) -> Results:
+    # The weight limit is never reached, the backfill is timed, not the rate limiter
+    exchange = RestSimulator(market, weight_limit=1_000_000, latency=latency).start()
+    try:
+        rest_client = BinanceFuturesRestClient(base_url=exchange.base_url)
+        started = time.perf_counter()
+        index = rest_client.load_market_index()
+        markets_secs = time.perf_counter() - started
+        tickers = index.tickers(rest_client.get_contract_type())
+
+        backfiller = CandleBackfiller(rest_client, '1m', candle_buffer_len=candle_buffer_len, max_workers=workers)
+        with quiet():
+            started = time.perf_counter()
+            candles = backfiller.load([f'{t.base}{t.quote}' for t in tickers])
+            backfill_secs = time.perf_counter() - started
+    finally:
+        exchange.close()
+
+    return {
+        'backfill.markets': {'s': markets_secs},
+        'backfill.candles': {
+            's': backfill_secs,
+            'symbols_per_sec': len(candles) / backfill_secs,
+            'requests': exchange.requests - 1,
+        },
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Results, previous: Results, threshold: float = 0.1):
+    """
+    Prints the metrics that changed by more than threshold (10%) since the previous run
+    """
+    print(f'\nChanges of more than {threshold:.0%} against the previous run:')
+    changed = 0
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            before = previous.get(name, {}).get(metric)
+            if not before or metric in ('alerts', 'requests', 'png_bytes'):
+                continue
+            ratio = value / before
+            if abs(ratio - 1) < threshold:
+                continue
+            better = ratio > 1 if metric.endswith(HIGHER_IS_BETTER) else ratio < 1
+            changed += 1
+            print(f'\t{"faster" if better else "SLOWER":<7} {name}.{metric}: {before:,.3f} -> {value:,.3f} '
+                  f'({ratio:.2f}x)')
+    if changed == 0:
+        print('\tnone')
+
+
+def print_results(results: Results):
+    for name, metrics in results.items():
+        values = ' '.join(f'{metric}={value:,.3f}' if isinstance(value, float) else f'{metric}={value}'
+                          for metric, value in metrics.items())
+        print(f'\t{name:<36} {values}')
+
+
+# noinspection PyShadowingNames
+def run(args: argparse.Namespace) -> Dict:
+    benchmarks = args.only.split(',') if args.only else list(BENCHMARKS)
+    unknown = set(benchmarks) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError(f'unknown benchmarks {sorted(unknown)}, expected some of {BENCHMARKS}')
+
+    market = SyntheticMarket(symbols=args.symbols, ticks_per_sec=args.ticks_per_sec, market=args.market,
+                             seed=args.seed)
+    frames = []
+    if 'decode' in benchmarks or 'detect' in benchmarks:
+        frames = [payload for _, payload in market.frames(args.duration)]
+        print(f'{len(frames):,} frames of {args.symbols} symbols, {args.duration / 60:.0f}min at '
+              f'{args.ticks_per_sec} ticks/s per symbol')
+
+    results: Results = {}
+    for benchmark in benchmarks:
+        print(f'{benchmark}...')
+        started = time.perf_counter()
+        if benchmark == 'decode':
+            results.update(bench_decode(market, frames))
+        elif benchmark == 'detect':
+            batch = args.batch or max(1, int(args.symbols * args.ticks_per_sec / 10))
+            results.update(bench_detect(market, frames, args.candle_buffer_len, batch))
+        elif benchmark == 'aggregate':
+            results.update(bench_aggregate(market, args.candle_buffer_len))
+        elif benchmark == 'render':
+            results.update(bench_render(market, args.candle_buffer_len, args.renders, args.frameworks.split(','),
+                                        args.figure_cache_size))
+        elif benchmark == 'backfill':
+            results.update(bench_backfill(market, args.candle_buffer_len, args.latency, args.backfill_workers))
+        print(f'\tdone in {time.perf_counter() - started:.1f}s')
+
+    report = {
+        'meta': {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'revision': git_revision(),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'params': vars(args),
+        },
+        'results': results,
+    }
+
+    print()
+    print_results(results)
+
+    out = args.out
+    if out is None:
+        started = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        out = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', f'{started}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as fd:
+        json.dump(report, fd, indent=2)
+    print(f'\nResults written to {out}')
+
+    if args.compare:
+        with open(args.compare) as fd:
+            compare(results, json.load(fd)['results'])
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--only', default='', help=f'Comma separated benchmarks to run, among {",".join(BENCHMARKS)}')
+    parser.add_argument('--symbols', type=int, default=100, help='Number of synthetic symbols')
+    parser.add_argument('--ticks-per-sec', type=float, dest='ticks_per_sec', default=1,
+                        help='Updates per second of every symbol')
+    parser.add_argument('--duration', type=float, default=600, help='Seconds of stream to generate')
+    parser.add_argument('--batch', type=int, default=0,
+                        help='Messages processed per event loop iteration by detect, by default 100ms worth of them')
+    parser.add_argument('--market', default='binance_futures', choices=('binance_futures', 'binance_spot'))
+    parser.add_argument('--candle-buffer-len', type=int, dest='candle_buffer_len', default=500,
+                        help='Candles kept per symbol, plotted and backfilled')
+    parser.add_argument('--renders', type=int, default=5, help='Charts rendered per plot framework')
+    parser.add_argument('--frameworks', default=','.join(PLOT_FRAMEWORKS), help='Plot frameworks to render with')
+    parser.add_argument('--figure-cache-size', type=int, dest='figure_cache_size', default=8,
+                        help='matplotlib figures kept for the figure cache run of render, 0 to skip it')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Seconds the REST simulator waits before answering, a round trip to the exchange')
+    parser.add_argument('--backfill-workers', type=int, dest='backfill_workers', default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=None, help='JSON file to write the results to, by default '
+                                                    'benchmarks/results/{time}.json')
+    parser.add_argument('--compare', default=None, help='JSON results of a previous run to compare against')
+
+    run(parser.parse_args())
@@ -0,0 +1,131 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+from core.candle_buffer import CandleRingBuffer
+from core.models import Candle
+
+# open time, close time, open, high, low, close, base volume, quote volume
+CandleValues = Tuple[int, int, float, float, float, float, float, float]
+
+
+class _PeriodState:
+    """
+    Aggregation state of one period: the candles closed so far in the current bucket, folded into one,
+    and the last complete bucket
+    """
+    __slots__ = ('bucket_ms', 'bucket_start', 'part', 'previous')
+
+    def __init__(self, bucket_ms: int):
+        self.bucket_ms = bucket_ms
+        self.bucket_start = -1
+        # Closed candles of the current bucket aggregated, None if the live candle is the first one of the bucket
+        self.part: Optional[Candle] = None
+        self.previous: Optional[Candle] = None
+
+
+def _fold(into: Optional[Candle], values: CandleValues) -> Candle:
+    open_unix, close_unix, open_, high, low, close, base_asset_volume, quote_asset_volume = values
+    if into is None:
+        into = Candle()
+        into.open_unix = open_unix
+        into.open = open_
+        into.high = high
+        into.low = low
+        into.base_asset_volume = 0
+        into.quote_asset_volume = 0
+    else:
+        if high > into.high:
+            into.high = high
+        if low < into.low:
+            into.low = low
+
+    into.close_unix = close_unix
+    into.close = close
+    into.base_asset_volume += base_asset_volume
+    into.quote_asset_volume += quote_asset_volume
+    return into
+
+
+class CandleAggregator:
+    """
+    Keeps candles of longer timeframes (5m, 15m, 1h...) of a symbol up to date from its stream of candles,
+    aligned to the exchange boundaries: buckets start at multiples of the period since the epoch, so the 5m
+    candle of 10:03 is the one opened at 10:00, the same as on the exchange's charts.
+
+    Updates of the live candle only replace it, O(1) whatever the number of periods. Once a candle closes it is
+    folded into the bucket of each period, O(periods) once per candle. The aggregated candles are only built
+    when asked for.
+    """
+    interval_ms: int
+    periods: Tuple[int, ...]
+
+    def __init__(self, periods: Iterable[int] = (5, 15, 60, 240), interval_ms: int = 60_000):
+        """
+        :param periods: in number of candles of the stream, with 1m candles 60 is the 1h candle
+        :param interval_ms: duration of the candles of the stream
+        """
+        self.interval_ms = interval_ms
+        self.periods = tuple(sorted(set(periods)))
+        self._states: Dict[int, _PeriodState] = {p: _PeriodState(p * interval_ms) for p in self.periods}
+        self._live: Optional[CandleValues] = None
+
+    def seed(self, candles: CandleRingBuffer):
+        """
+        Replays the candles of the buffer needed to fill the current and previous bucket of every period
+        """
+        n = min(len(candles), 2 * max(self.periods) + 1)
+        columns = candles.columns(n)
+        rows = zip(*(columns[name].tolist() for name in CandleRingBuffer.COLUMNS))
+        for values in rows:
+            self.update(*values)
+
+    def update(self, open_unix: int, close_unix: int, open_: float, high: float, low: float, close: float,
+               base_asset_volume: float, quote_asset_volume: float):
+        live = self._live
+        if live is not None and open_unix != live[0]:
+            if open_unix < live[0]:
+                # A late update of a candle that was already folded
+                return
+            # The live candle closed
+            for state in self._states.values():
+                self._close(state, live, open_unix)
+
+        self._live = (open_unix, close_unix, open_, high, low, close, base_asset_volume, quote_asset_volume)
+
+    @staticmethod
+    def _close(state: _PeriodState, closed: CandleValues, next_open_unix: int):
+        bucket_start = closed[0] - closed[0] % state.bucket_ms
+        if bucket_start != state.bucket_start:
+            # First candle seen of this bucket, what we had so far belongs to an older bucket
+            if state.part is not None:
+                state.previous = state.part
+            state.part = None
+            state.bucket_start = bucket_start
+        state.part = _fold(state.part, closed)
+
+        if next_open_unix - next_open_unix % state.bucket_ms != bucket_start:
+            # The next candle opens a new bucket, this one is complete
+            state.previous = state.part
+            state.part = None
+            state.bucket_start = -1
+
+    def current(self, period: int) -> Optional[Candle]:
+        """
+        The candle of the bucket in progress, including the live candle, None if nothing was received yet
+        """
+        if self._live is None:
+            return None
+
+        state = self._states[period]
+        live_bucket = self._live[0] - self._live[0] % state.bucket_ms
+        part = state.part if state.bucket_start == live_bucket else None
+
+        candle = Candle()
+        if part is not None:
+            candle.__dict__.update(part.__dict__)
+        return _fold(candle if part is not None else None, self._live)
+
+    def previous(self, period: int) -> Optional[Candle]:
+        """
+        The last complete candle of the period, None if we did not see a whole bucket yet
+        """
+        return self._states[period].previous
@@ -0,0 +1,230 @@
+from typing import Dict, Optional
+
+import numpy as np
+
+from core.models import Candle
+
+
+class CandleRingBuffer:
+    """
+    Fixed capacity, columnar ring buffer of candles.
+
+    Every column is backed by a NumPy array twice as long as the capacity. Candles are written one after
+    the other, when the end of the storage is reached the newest `capacity - 1` candles are moved back to the
+    front with a single memcpy per column (once every `capacity` appends, so O(1) amortized). That way the
+    candles we hold are always laid out contiguously and in order, so a view of any column is just a slice.
+
+    - append: O(1) amortized, the oldest candle is dropped once the buffer is full. Still 2-3x slower than
+      appending to a list and pop(0) for the capacities we use (benchmarks/bench_candle_buffer.py), the price
+      of cheap column reads
+    - update_last: O(1), updates in place the live(not closed yet) candle
+    - column/columns: O(1), read only views ordered from the oldest to the newest candle. Views are only
+      valid until the next append, copy them if they must outlive it.
+    """
+    # Column name -> NumPy dtype, names match Candle's attributes
+    COLUMNS = {
+        'open_unix': np.int64,
+        'close_unix': np.int64,
+        'open': np.float64,
+        'high': np.float64,
+        'low': np.float64,
+        'close': np.float64,
+        'base_asset_volume': np.float64,
+        'quote_asset_volume': np.float64,
+    }
+
+    capacity: int
+    # Open time of the oldest candle merge() inserted or replaced, for the copies of the candles made elsewhere
+    # (the candle cache) to be written again from there. Reset by whoever copies them, None if nothing changed
+    rewritten_from: Optional[int]
+    _size: int
+    # Position right after the newest candle
+    _end: int
+    _columns: Dict[str, np.ndarray]
+
+    def __init__(self, capacity: int = 500):
+        if capacity <= 0:
+            raise ValueError(f'capacity must be greater than zero, got {capacity}')
+
+        self.capacity = capacity
+        self.rewritten_from = None
+        self._size = 0
+        self._end = 0
+        self._columns = {name: np.zeros(capacity * 2, dtype=dtype) for name, dtype in self.COLUMNS.items()}
+        # Writing a single scalar through a memoryview is several times cheaper than through NumPy's __setitem__,
+        # and the tick path writes one candle at a time.
+        (self._mv_open_unix, self._mv_close_unix, self._mv_open, self._mv_high, self._mv_low, self._mv_close,
+         self._mv_base_vol, self._mv_quote_vol) = [memoryview(self._columns[name]) for name in self.COLUMNS]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __bool__(self) -> bool:
+        return self._size > 0
+
+    def __getitem__(self, index: int) -> Candle:
+        """
+        Materializes the candle at the given position as a Candle object, index 0 is the oldest candle,
+        negative indexes are supported, -1 being the newest candle.
+        Meant for code paths that are not hot, prefer column views otherwise.
+        """
+        if index < 0:
+            index += self._size
+        if index < 0 or index >= self._size:
+            raise IndexError(f'candle index out of range: {index}')
+
+        candle = Candle()
+        pos = self._end - self._size + index
+        for name, col in self._columns.items():
+            setattr(candle, name, col[pos].item())
+        return candle
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield self[i]
+
+    def _compact(self, keep: int):
+        # Move the newest `keep` candles to the front of the storage
+        start = self._end - keep
+        if start > 0:
+            for col in self._columns.values():
+                col[:keep] = col[start:self._end]
+        self._end = keep
+        self._size = keep
+
+    def append(self, candle: Candle):
+        self.append_values(candle.open_unix, candle.close_unix, candle.open, candle.high, candle.low, candle.close,
+                           candle.base_asset_volume, candle.quote_asset_volume)
+
+    def append_values(self, open_unix: int, close_unix: int, open_: float, high: float, low: float, close: float,
+                      base_asset_volume: float, quote_asset_volume: float):
+        if self._end == self.capacity * 2:
+            self._compact(self.capacity - 1)
+
+        pos = self._end
+        self._mv_open_unix[pos] = open_unix
+        self._mv_close_unix[pos] = close_unix
+        self._mv_open[pos] = open_
+        self._mv_high[pos] = high
+        self._mv_low[pos] = low
+        self._mv_close[pos] = close
+        self._mv_base_vol[pos] = base_asset_volume
+        self._mv_quote_vol[pos] = quote_asset_volume
+
+        self._end = pos + 1
+        if self._size < self.capacity:
+            self._size += 1
+
+    def extend(self, columns: Dict[str, np.ndarray]):
+        """
+        Appends many candles at once, columns must be ordered from the oldest to the newest candle.
+        If more candles than the capacity are given only the newest ones are kept.
+        """
+        n = min(len(columns['open_unix']), self.capacity)
+        if n == 0:
+            return
+
+        keep = min(self._size, self.capacity - n)
+        if self._end + n > self.capacity * 2:
+            self._compact(keep)
+
+        start = self._end
+        for name, col in self._columns.items():
+            col[start:start + n] = columns[name][-n:]
+
+        self._end = start + n
+        self._size = keep + n
+
+    def update_last(self, candle: Candle):
+        """
+        Overwrites the newest candle, used when the exchange sends an update of the candle that is still open
+        """
+        self.update_last_values(candle.open_unix, candle.close_unix, candle.open, candle.high, candle.low,
+                                candle.close, candle.base_asset_volume, candle.quote_asset_volume)
+
+    def update_last_values(self, open_unix: int, close_unix: int, open_: float, high: float, low: float,
+                           close: float, base_asset_volume: float, quote_asset_volume: float):
+        if self._size == 0:
+            raise IndexError('update_last called on an empty buffer')
+
+        pos = self._end - 1
+        self._mv_open_unix[pos] = open_unix
+        self._mv_close_unix[pos] = close_unix
+        self._mv_open[pos] = open_
+        self._mv_high[pos] = high
+        self._mv_low[pos] = low
+        self._mv_close[pos] = close
+        self._mv_base_vol[pos] = base_asset_volume
+        self._mv_quote_vol[pos] = quote_asset_volume
+
+    def last(self) -> Optional[Candle]:
+        if self._size == 0:
+            return None
+        return self[-1]
+
+    def last_value(self, name: str):
+        """
+        Value of the given column for the newest candle, cheaper than last() as it does not build a Candle
+        """
+        if self._size == 0:
+            raise IndexError('last_value called on an empty buffer')
+        return self._columns[name][self._end - 1].item()
+
+    def column(self, name: str, n: Optional[int] = None) -> np.ndarray:
+        """
+        Read only, zero copy view of a column ordered from the oldest to the newest candle.
+        :param name: one of CandleRingBuffer.COLUMNS
+        :param n: if given, only the last n candles are returned
+        :return:
+        """
+        start = self._end - self._size
+        if n is not None:
+            start = max(start, self._end - n)
+
+        view = self._columns[name][start:self._end]
+        view.flags.writeable = False
+        return view
+
+    def columns(self, n: Optional[int] = None) -> Dict[str, np.ndarray]:
+        return {name: self.column(name, n) for name in self.COLUMNS}
+
+    def merge(self, columns: Dict[str, np.ndarray], replace: bool = False):
+        """
+        Merges candles that may fall anywhere in the buffer (for instance a gap backfilled from the REST API),
+        keeping everything ordered by open time. For candles present in both, the ones in the buffer win, unless
+        replace is set: closed candles from the REST API are final, they correct the ones the buffer only got
+        partially (the candle live when the connection dropped).
+        Only the newest `capacity` candles are kept. It is O(n), meant for exceptional paths.
+        """
+        if len(columns['open_unix']) == 0:
+            return
+
+        current = self.snapshot()
+        # Among duplicated open times the last one is kept, the winner goes last
+        first, last = (current, columns) if replace else (columns, current)
+        open_unix = np.concatenate((first['open_unix'], last['open_unix']))
+        order = np.argsort(open_unix, kind='stable')
+        sorted_open_unix = open_unix[order]
+        keep = order[np.append(sorted_open_unix[1:] != sorted_open_unix[:-1], True)]
+
+        merged = {name: np.concatenate((first[name], last[name]))[keep] for name in self.COLUMNS}
+        self.clear()
+        self.extend(merged)
+
+        oldest = int(columns['open_unix'].min())
+        self.rewritten_from = oldest if self.rewritten_from is None else min(self.rewritten_from, oldest)
+
+    def snapshot(self, n: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """
+        Same as columns() but the arrays are copies, safe to be handed over to another thread or process
+        """
+        snapshot = {}
+        for name, view in self.columns(n).items():
+            copy = view.copy()
+            copy.flags.writeable = False
+            snapshot[name] = copy
+        return snapshot
+
+    def clear(self):
+        self._size = 0
+        self._end = 0
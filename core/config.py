@@ -23,6 +23,31 @@ class AppConfig:
     # in these situations vs when a x6 occurred with big volume of money traded.
     min_quote_vol: float
 
+    # Rule judging the volume abnormal, see BaseKLineProcessor:
+    #  - previous: min_vol_pct_increase % more volume than the previous update received (noisy on illiquid pairs)
+    #  - zscore: min_volume_zscore standard deviations above the mean volume of the last volume_baseline_window
+    #    closed candles
+    #  - baseline_multiple: min_volume_baseline_multiple times the EWMA of the volume of the closed candles
+    # Baselines need at least volume_baseline_min_samples closed candles before alerting.
+    detector_mode: str
+    min_vol_pct_increase: float
+    min_volume_zscore: float
+    min_volume_baseline_multiple: float
+    volume_baseline_window: int
+    volume_baseline_min_samples: int
+
+    # Named groups of symbols with their own thresholds, for instance stricter ones for majors:
+    # [{'name': 'majors', 'symbols': ['BTCUSDT', 'ETHUSDT'], 'min_quote_vol': 500_000, 'min_vol_pct_increase': 400}]
+    # Any of min_quote_vol, min_vol_pct_increase, min_price_pct_change, compare_last_price, detector_mode,
+    # min_volume_zscore, min_volume_baseline_multiple can be overridden, the others are taken from the settings
+    # above, which also apply to the symbols no rule set lists. A symbol belongs to the first rule set listing it.
+    # When set, the rules of all the symbols updated by a batch of messages are evaluated at once, vectorized.
+    rule_sets: list
+
+    # Timeframes, in number of candles of the stream, kept up to date aligned to the exchange's boundaries,
+    # with 1m candles [5, 15, 60, 240] are the 5m, 15m, 1h and 4h candles
+    aggregate_periods: list
+
     # Min % change in the candle caused by the volume in the event to report
     min_pct_change_to_report: float
     # time frame in minutes, 60 would mean 60minutes timeframe (1h), 240 would mean 4h timeframe
@@ -42,6 +67,105 @@ class AppConfig:
     candle_down_color: str
 
     monitor_all_pairs: bool
+
+    # The volume rule is evaluated on every update of the open candle (every ~250ms), this decides which of the
+    # alerts fired for the same candle are sent: 'first_only', 'escalate' (only if the volume multiplier grew
+    # alert_escalation_factor times since the last alert sent), 'cooldown' (at most one every alert_cooldown_secs)
+    # or 'none' to send them all
+    alert_coalesce_policy: str
+    alert_escalation_factor: float
+    alert_cooldown_secs: float
+
+    # Number of threads rendering charts and sending alerts to the writers, and how many alerts may be waiting
+    # for them, once the queue is full new alerts are dropped rather than blocking the websocket
+    alert_workers: int
+    alert_queue_size: int
+
+    # Alerts sent to Slack within slack_batch_window_secs of each other are posted together, as one message with
+    # a chart per symbol. slack_upload_flow: 'external' (files.getUploadURLExternal + files.completeUploadExternal)
+    # or 'legacy' (files.upload, no batching). Requests go over at most slack_max_connections keep-alive connections
+    slack_batch_window_secs: float
+    slack_upload_flow: str
+    slack_max_connections: int
+
+    # Every writer (file system, Slack) sends the alerts from its own queue of at most writer_queue_size alerts,
+    # when it is full writer_overflow_policy decides: 'block' (wait for room, up to writer_timeout_secs),
+    # 'drop_oldest', 'drop_newest' or 'merge' (replace the alert of the same symbol waiting). Failed writes are
+    # retried writer_retries times, waiting writer_retry_delay_secs then twice as long each time. A writer failing
+    # writer_down_after times in a row is down, its alerts are not retried until it works again.
+    # writer_overrides gives other settings per writer name, {'AsyncSlackWriter': {'overflow_policy': 'merge'}}
+    writer_queue_size: int
+    writer_overflow_policy: str
+    writer_retries: int
+    writer_retry_delay_secs: float
+    writer_timeout_secs: float
+    writer_down_after: int
+    writer_overrides: dict
+
+    # Directory of the alert log, the history of every alert with what fired it and its chart, empty to disable
+    # it (see alerts_history.py to query it). A new segment is started every alert_log_segment_secs or once it
+    # weighs alert_log_segment_mb
+    alert_log_dir: str
+    alert_log_segment_mb: float
+    alert_log_segment_secs: float
+
+    # Number of requests loading the initial candles that may be in flight at once, how fast they go out is
+    # bounded by Binance's request weight limit
+    backfill_workers: int
+
+    # Directory where closed candles are stored so restarts only download what they missed, empty to disable it,
+    # and every how many seconds the candles closed meanwhile are stored
+    candle_cache_dir: str
+    candle_cache_flush_secs: float
+    # The markets (exchangeInfo) are cached in candle_cache_dir as well, they are downloaded again once older
+    # than exchange_info_ttl_secs, and only if they changed
+    exchange_info_ttl_secs: float
+
+    # Streams are spread over at least ws_connections websocket connections with at most
+    # ws_max_streams_per_connection each. Connections are replaced before Binance closes them (24h), and dropped
+    # then reconnected when nothing is received for ws_stall_timeout_secs
+    ws_connections: int
+    ws_max_streams_per_connection: int
+    ws_rotate_after_secs: float
+    ws_stall_timeout_secs: float
+    # Where the REST requests and websocket connections go, empty for Binance. Set them to run against a local
+    # stand-in of the exchange (python -m simulator), for instance 'http://127.0.0.1:9100' and 'ws://127.0.0.1:9101'
+    rest_base_url: str
+    ws_base_url: str
+    # Decoder of the kline messages: json, orjson (pip install orjson, much faster) or auto (orjson if installed)
+    ws_decoder: str
+
+    # Library drawing the charts: 'plotly' (needs kaleido), 'matplotlib' or 'native' (drawn with NumPy, a few ms
+    # per chart, no extra dependency)
+    plot_framework: str
+
+    # Number of worker processes rendering charts, they import the plotting framework once and stay warm,
+    # set it to 0 to render on the alert threads instead. Seconds to wait for a chart before giving up.
+    render_processes: int
+    render_timeout: float
+
+    # matplotlib figures kept per render process, one per symbol: the next charts of a symbol only update the
+    # candles, volumes and axis limits of its figure, several times faster during a pump. A figure takes ~4MB,
+    # the least recently used is dropped past this many, 0 builds a new figure for every chart.
+    matplotlib_figure_cache_size: int
+
+    # Directory where the raw websocket frames are recorded (see replay.py), empty to disable it,
+    # a new compressed file is started every record_chunk_secs
+    record_dir: str
+    record_chunk_secs: float
+
+    # Number of processes the symbols are split among, each one with its own websocket connections, candles
+    # and detection. Alerts are sent to the main process, which renders and dispatches them (see the render and
+    # alert settings above), over a queue of at most alert_ipc_queue_size alerts. 1 runs everything in one process.
+    worker_processes: int
+    alert_ipc_queue_size: int
+
+    # Port serving the metrics (Prometheus text format) on http://metrics_host:metrics_port/metrics, 0 to disable
+    # them. With several worker_processes, this process serves the alert metrics on metrics_port and each worker
+    # its own on metrics_port + 1 + its number.
+    metrics_port: int
+    metrics_host: str
+
     debug: False
 
     def __init__(self):
@@ -0,0 +1,112 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from core.models import Ticker
+from utils.math_utils import precision_from_string
+
+# (BASE, QUOTE, contract type), contract type is '' for spot markets
+MarketKey = Tuple[str, str, str]
+
+
+class MarketIndex:
+    """
+    The markets of an exchange, hashed by base, quote and contract type, with what we need from exchangeInfo
+    already parsed (precisions, request weight limit), so resolving a symbol is a single dict lookup.
+
+    It serializes to rows of plain values (to_dict/from_dict) so it can be cached without keeping the whole
+    exchangeInfo around.
+    """
+    # Rows layout: symbol, base, quote, contract type, price precision, quantity precision
+    ROW_FIELDS = ('symbol', 'base', 'quote', 'contract_type', 'price_precision', 'quantity_precision')
+
+    _tickers: Dict[MarketKey, Ticker]
+    _symbols: Dict[MarketKey, str]
+    # Request weight allowed per minute, None if exchangeInfo did not tell
+    weight_limit: Optional[int]
+
+    def __init__(self, weight_limit: Optional[int] = None):
+        self._tickers = {}
+        self._symbols = {}
+        self.weight_limit = weight_limit
+
+    def __len__(self) -> int:
+        return len(self._tickers)
+
+    def __iter__(self) -> Iterator[Ticker]:
+        return iter(self._tickers.values())
+
+    def add(self, symbol: str, base: str, quote: str, contract_type: str, price_precision: int,
+            quantity_precision: int):
+        ticker = Ticker()
+        ticker.base = base.upper()
+        ticker.quote = quote.upper()
+        ticker.price_precision = price_precision
+        ticker.quantity_precision = quantity_precision
+
+        key = (ticker.base, ticker.quote, contract_type)
+        self._tickers[key] = ticker
+        self._symbols[key] = symbol
+
+    def get(self, base: str, quote: str, contract_type: str = '') -> Optional[Ticker]:
+        return self._tickers.get((base.upper(), quote.upper(), contract_type))
+
+    def symbol(self, base: str, quote: str, contract_type: str = '') -> Optional[str]:
+        """
+        Symbol as named by the exchange (BTCUSDT), None if there is no such market
+        """
+        return self._symbols.get((base.upper(), quote.upper(), contract_type))
+
+    def tickers(self, contract_type: Optional[str] = None) -> List[Ticker]:
+        """
+        :param contract_type: if given, only the markets of this contract type ('' for spot, PERPETUAL...)
+        """
+        if contract_type is None:
+            return list(self._tickers.values())
+        return [t for key, t in self._tickers.items() if key[2] == contract_type]
+
+    @staticmethod
+    def from_exchange_info(markets: Dict) -> 'MarketIndex':
+        """
+        Parses Binance's exchangeInfo response, spot or futures
+        """
+        weight_limit = None
+        for rate_limit in markets.get('rateLimits', []):
+            if rate_limit['rateLimitType'] == 'REQUEST_WEIGHT' and rate_limit['interval'] == 'MINUTE':
+                weight_limit = rate_limit['limit'] // rate_limit.get('intervalNum', 1)
+
+        index = MarketIndex(weight_limit)
+        for s in markets['symbols']:
+            filters = {f['filterType']: f for f in s.get('filters', [])}
+
+            # I don't know why quoteAssetPrecision does not use to have the right price_precision
+            # despite its name, so it is just used as fallback, price_precision comes from the PRICE_FILTER filter
+            # same goes for baseAssetPrecision
+            if 'PRICE_FILTER' in filters:
+                price_precision = precision_from_string(filters['PRICE_FILTER']['tickSize'])
+            else:
+                price_precision = s.get('quoteAssetPrecision', 2)
+
+            if 'LOT_SIZE' in filters:
+                quantity_precision = precision_from_string(filters['LOT_SIZE']['stepSize'])
+            else:
+                quantity_precision = s.get('baseAssetPrecision', 2)
+
+            index.add(s['symbol'], s['baseAsset'], s['quoteAsset'], s.get('contractType', ''), price_precision,
+                      quantity_precision)
+        return index
+
+    def to_dict(self) -> Dict:
+        rows = []
+        for key, ticker in self._tickers.items():
+            rows.append([self._symbols[key], ticker.base, ticker.quote, key[2], ticker.price_precision,
+                         ticker.quantity_precision])
+        return {'weight_limit': self.weight_limit, 'fields': self.ROW_FIELDS, 'rows': rows}
+
+    @staticmethod
+    def from_dict(data: Dict) -> 'MarketIndex':
+        if list(data['fields']) != list(MarketIndex.ROW_FIELDS):
+            raise ValueError(f'unexpected market index fields {data["fields"]}')
+
+        index = MarketIndex(data.get('weight_limit'))
+        for row in data['rows']:
+            index.add(*row)
+        return index
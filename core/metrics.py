@@ -0,0 +1,257 @@
+"""
+Counters, gauges and histograms of what the app does, exposed over HTTP in Prometheus' text format
+(https://prometheus.io/docs/instrumenting/exposition_formats/) when metrics_port is set.
+
+Metrics are declared once, at module level, next to the code updating them:
+
+    KLINE_DECODE_SECONDS = metrics.histogram('kline_decode_seconds', 'Time decoding a kline message')
+    KLINE_DECODE_SECONDS.observe(elapsed)
+
+Updates are cheap (a lock and a few additions) but not free, the per message ones are only made when the
+metrics are served.
+"""
+import bisect
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+# From 50us to 60s, covers decoding a message as well as sending an alert to Slack
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1,
+                   2.5, 5, 10, 30, 60)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    TYPE = ''
+
+    name: str
+    help: str
+    label_names: Tuple[str, ...]
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._children: Dict[LabelValues, 'Metric'] = {}
+
+    def labels(self, *values) -> 'Metric':
+        """
+        The metric of the given label values, keep it around rather than looking it up on every update
+        """
+        values = tuple(str(v) for v in values)
+        if len(values) != len(self.label_names):
+            raise ValueError(f'{self.name} expects labels {self.label_names}, got {values}')
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self) -> 'Metric':
+        raise NotImplemented('Should be implemented by super Implementation class')
+
+    def _samples(self, name: str, labels: str) -> List[str]:
+        raise NotImplemented('Should be implemented by super Implementation class')
+
+    def expose(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.TYPE}']
+        if self.label_names:
+            for values, child in list(self._children.items()):
+                lines += child._samples(self.name, _format_labels(self.label_names, values))
+        else:
+            lines += self._samples(self.name, '')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        super().__init__(name, help, label_names)
+        self.value = 0.0
+
+    def _new_child(self) -> 'Counter':
+        return Counter(self.name, self.help)
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def _samples(self, name: str, labels: str) -> List[str]:
+        return [f'{name}{labels} {_format_value(self.value)}']
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. It can be set, or computed when the metrics are scraped by a function
+    returning the value, or for a gauge with labels a dict label values -> value.
+    """
+    TYPE = 'gauge'
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        super().__init__(name, help, label_names)
+        self.value = 0.0
+        self._function: Optional[Callable[[], Union[float, Dict[LabelValues, float]]]] = None
+
+    def _new_child(self) -> 'Gauge':
+        return Gauge(self.name, self.help)
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function: Optional[Callable[[], Union[float, Dict[LabelValues, float]]]]):
+        self._function = function
+
+    def _samples(self, name: str, labels: str) -> List[str]:
+        return [f'{name}{labels} {_format_value(self.value)}']
+
+    def expose(self) -> str:
+        if self._function is None:
+            return super().expose()
+
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.TYPE}']
+        values = self._function()
+        if self.label_names:
+            for label_values, value in values.items():
+                if not isinstance(label_values, tuple):
+                    label_values = (label_values,)
+                lines.append(f'{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}')
+        else:
+            lines.append(f'{self.name} {_format_value(values)}')
+        return '\n'.join(lines)
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    buckets: Tuple[float, ...]
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # One more for the values above the last bucket, counts are per bucket, cumulated when exposed
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def _new_child(self) -> 'Histogram':
+        return Histogram(self.name, self.help, buckets=self.buckets)
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def _samples(self, name: str, labels: str) -> List[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self.sum, self.count
+
+        lines = []
+        cumulated = 0
+        label_prefix = labels[:-1] + ',' if labels else '{'
+        for bound, n in zip(self.buckets + (math.inf,), counts):
+            cumulated += n
+            lines.append(f'{name}_bucket{label_prefix}le="{_format_value(bound)}"}} {cumulated}')
+        lines.append(f'{name}_sum{labels} {_format_value(total)}')
+        lines.append(f'{name}_count{labels} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.label_names != metric.label_names:
+                    raise ValueError(f'metric {metric.name} is already registered with another type or labels')
+                return existing
+            self._metrics[metric.name] = metric
+        return metric
+
+    def expose(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(m.expose() for m in metrics) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name: str, help: str, label_names: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, label_names))
+
+
+def gauge(name: str, help: str, label_names: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, label_names))
+
+
+def histogram(name: str, help: str, label_names: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, label_names, buckets))
+
+
+class MetricsServer:
+    """
+    Serves the metrics of the registry on http://{host}:{port}/metrics, on a thread
+    """
+
+    def __init__(self, port: int, host: str = '127.0.0.1', registry: MetricsRegistry = REGISTRY):
+        self.registry = registry
+        registry_ = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry_.expose().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics-server', daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/metrics'
+
+    def start(self) -> 'MetricsServer':
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -1,4 +1,7 @@
-from typing import List, Optional
+from typing import Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from core.candle_buffer import CandleRingBuffer
 
 
 class Candle:
@@ -34,17 +37,25 @@ class Ticker:
 
 class TickerInfo:
     ticker: Ticker
-    candles: List[Candle]
-    last_candle: Optional[Candle]
+    candles: 'CandleRingBuffer'
+    # close price and quote volume of the previous update received, of this candle or of the previous one
+    last_close: float
+    last_quote_volume: float
     color: str
+    # True while candles missing in the stream are being fetched
+    backfilling: bool
 
-    def __init__(self, ticker: Ticker = None, candles=None, last_candle: Optional[Candle] = None, color: str = ''):
+    def __init__(self, ticker: Ticker = None, candles=None, color: str = ''):
         if candles is None:
-            candles = []
+            # imported here, core.candle_buffer imports Candle from this module
+            from core.candle_buffer import CandleRingBuffer
+            candles = CandleRingBuffer()
         self.ticker = ticker
-        self.last_candle = last_candle
+        self.last_close = 0
+        self.last_quote_volume = 0
         self.candles = candles
         self.color = color
+        self.backfilling = False
 
     def __str__(self):
         return f'{self.ticker.base}/{self.ticker.quote}'
@@ -0,0 +1,46 @@
+import time
+from typing import List, Tuple
+
+from core import metrics
+
+STARTUP_PHASE_SECONDS = metrics.gauge('startup_phase_seconds', 'Seconds each step of the startup took', ('phase',))
+STARTUP_SECONDS = metrics.gauge('startup_seconds', 'Seconds from the start of the process to the first kline '
+                                                   'processed')
+
+
+class StartupReport:
+    """
+    Time taken by each step of the startup, from the moment this module is imported (first thing main.py does)
+    up to the first kline message, to track the time to first message:
+
+        Startup in 2.41s: imports 0.31s, market index 0.12s, backfill 1.52s, processor 0.05s, first message 0.41s
+    """
+    started: float
+    phases: List[Tuple[str, float]]
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases = []
+
+    def mark(self, phase: str):
+        """
+        Ends the step named phase, which started when the previous one ended
+        """
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        STARTUP_PHASE_SECONDS.labels(phase).set(now - self._last)
+        self._last = now
+
+    def finish(self, phase: str = 'first message') -> str:
+        """
+        Ends the last step and returns the report
+        """
+        self.mark(phase)
+        total = self._last - self.started
+        STARTUP_SECONDS.set(total)
+        steps = ', '.join(f'{name} {secs:.2f}s' for name, secs in self.phases)
+        return f'Startup in {total:.2f}s: {steps}'
+
+
+STARTUP = StartupReport()
@@ -1,40 +1,62 @@
 import abc
-import io
-import os
+import asyncio
 import random
-from typing import Optional, Dict, List
+import time
+from typing import Optional, Dict, List, Tuple, TYPE_CHECKING
 
 import colorama
-import distinctipy
-import matplotlib.ticker as mticker
-import mplfinance as mpf
-import pandas as pd
-import plotly.graph_objects as plotly_go
-import plotly.subplots as plotly_subplots
-from matplotlib import pyplot as plt
+import numpy as np
 from termcolor import colored
 
+from alerts import AlertJob
+from alerts.baseline import RollingBaseline
+from alerts.coalescing import AlertCoalescer
+from alerts.dispatcher import AlertDispatcher, IAlertSink
+from alerts.rules import RuleEngine, RuleSet
 from core import config
+from core.aggregator import CandleAggregator
+from core.candle_buffer import CandleRingBuffer
+from core.market_index import MarketIndex
 from core.models import Candle, TickerInfo
-from utils.colors import fore_from_hex, rgb_to_hex
-from writers.filesystem import FsWriter
-from writers.slack import SlackWriter
+from utils.colors import TICKER_PALETTE, fore_from_hex
+from utils.timeframes import timeframe_to_ms
+
+if TYPE_CHECKING:
+    from exchanges.gap_filler import GapFiller
+    from storage.exchange_info_cache import ExchangeInfoCache
 
 
 class IExchangeRest(abc.ABC):
 
     @abc.abstractmethod
-    def load_candles(self, trading_symbol: str, timeframe: str, candle_buffer_len: int) -> List[Candle]:
+    def load_candles(self, trading_symbol: str, timeframe: str, candle_buffer_len: int) -> CandleRingBuffer:
         raise NotImplemented('Should be implemented by super Implementation class')
 
     @abc.abstractmethod
     def get_rest_kline_url(self) -> str:
         raise NotImplemented('Should be implemented by super Implementation class')
 
+    @abc.abstractmethod
+    def fetch_klines(self, trading_symbol: str, timeframe: str, limit: int, start_time: Optional[int] = None,
+                     end_time: Optional[int] = None) -> Dict[str, np.ndarray]:
+        raise NotImplemented('Should be implemented by super Implementation class')
+
+    @abc.abstractmethod
+    def get_market_name(self) -> str:
+        raise NotImplemented('Should be implemented by super Implementation class')
+
     @staticmethod
     def load_markets() -> Optional[Dict]:
         raise NotImplemented('Should be implemented by super Implementation class')
 
+    @abc.abstractmethod
+    def get_contract_type(self) -> str:
+        raise NotImplemented('Should be implemented by super Implementation class')
+
+    @abc.abstractmethod
+    def load_market_index(self, cache: Optional['ExchangeInfoCache'] = None) -> MarketIndex:
+        raise NotImplemented('Should be implemented by super Implementation class')
+
 
 class IExchangeWsApi(abc.ABC):
 
@@ -56,11 +78,14 @@ class IExchangeWsApi(abc.ABC):
 
 
 class BaseKLineProcessor:
+    DETECTOR_MODES = ('previous', 'zscore', 'baseline_multiple')
+
     timeframe_plot: int
     ticker_cache: Dict[str, TickerInfo]
     min_candles_to_plot: int
 
-    def __init__(self, app_config: config.AppConfig, tickers: List[TickerInfo], timeframe: str):
+    def __init__(self, app_config: config.AppConfig, tickers: List[TickerInfo], timeframe: str,
+                 alert_sink: Optional[IAlertSink] = None):
         super().__init__()
         self.app_config = app_config
         self.timeframe_plot = getattr(app_config, 'timeframe_plot', 1)
@@ -84,19 +109,53 @@ class BaseKLineProcessor:
         #   - if period_pct_change is 7 then it means take last 14 days, aggregate them by 7 in 2 candles, each one 1w
         #   and so compare the resulting two 1w candles
         self.period_pct_change = 1
-
-        self.out_writers = [
-            FsWriter(app_config.out_dir),
-            SlackWriter(
-                slack_token=os.getenv('SLACK_ACCESS_TOKEN'),
-                channel_id=os.getenv('SLACK_CHANNEL_ID')
-            )
-        ]
+        # How the volume of the live candle is judged abnormal, see AppConfig.detector_mode
+        self.detector_mode = getattr(app_config, 'detector_mode', 'previous')
+        if self.detector_mode not in self.DETECTOR_MODES:
+            raise ValueError(f'unknown detector_mode {self.detector_mode}, expected one of {self.DETECTOR_MODES}')
+        self.min_volume_zscore = getattr(app_config, 'min_volume_zscore', 4)
+        self.min_volume_baseline_multiple = getattr(app_config, 'min_volume_baseline_multiple', 5)
+        self.volume_baseline_window = getattr(app_config, 'volume_baseline_window', 60)
+        self.volume_baseline_min_samples = getattr(app_config, 'volume_baseline_min_samples', 20)
+        # trading symbol -> statistics of the quote volume of its last closed candles
+        self.volume_baselines: Dict[str, RollingBaseline] = {}
+        # Candles of longer timeframes, aligned to the exchange's boundaries, kept up to date tick by tick
+        self.aggregate_periods = sorted(set(getattr(app_config, 'aggregate_periods', [5, 15, 60, 240]) +
+                                            [self.period_pct_change]))
+        # trading symbol -> its aggregated candles, created the first time they are needed
+        self.aggregators: Dict[str, CandleAggregator] = {}
+        self.interval_ms = timeframe_to_ms(timeframe)
+        self.gap_filler = None
+
+        self.alert_coalescer = AlertCoalescer(
+            policy=getattr(app_config, 'alert_coalesce_policy', 'first_only'),
+            escalation_factor=getattr(app_config, 'alert_escalation_factor', 1.5),
+            cooldown_secs=getattr(app_config, 'alert_cooldown_secs', 30))
+
+        # Rendering and sending alerts is up to the sink, by default a dispatcher of this very process
+        self.alert_sink = alert_sink if alert_sink is not None else AlertDispatcher(app_config)
 
         # Create a dictionary out of the List of TickerCache using base and quote as keys
         self.ticker_cache = dict(map(lambda x: [f'{x.ticker.base.upper()}{x.ticker.quote.upper()}', x], tickers))
-        # Exclude black and white
 
+        # With rule sets, detection runs in the rule engine, over all the symbols updated by a batch of messages at
+        # once, each symbol judged by the thresholds of its rule set. The flat settings above are the default rule set
+        self.rule_engine = None
+        self._rule_evaluation_scheduled = False
+        rule_sets = getattr(app_config, 'rule_sets', None)
+        if rule_sets:
+            defaults = {
+                'min_quote_vol': self.min_quote_vol,
+                'min_vol_pct_increase': self.min_vol_pct_increase,
+                'min_price_pct_change': self.min_price_pct_change,
+                'compare_last_price': self.compare_last_price,
+                'detector_mode': self.detector_mode,
+                'min_volume_zscore': self.min_volume_zscore,
+                'min_volume_baseline_multiple': self.min_volume_baseline_multiple,
+            }
+            compiled = [RuleSet.from_dict(r, defaults) for r in rule_sets] + [RuleSet('default', **defaults)]
+            self.rule_engine = RuleEngine(compiled, list(self.ticker_cache.keys()),
+                                          baseline_min_samples=self.volume_baseline_min_samples)
         if self.app_config.is_windows:
             colors = random.choices(list(colorama.Fore.__dict__.values()), k=len(self.ticker_cache))
 
@@ -106,33 +165,14 @@ class BaseKLineProcessor:
                 print(color + 'RGB[0:1]: ', end='')
                 print(color)
         else:
-            # max 30 colors, otherwise it hangs
-            generated_colors = distinctipy.get_colors(min(30, len(self.ticker_cache)), [(0, 0, 0), (1, 1, 1)])
-
-            # If we generated less colors than we need, then reuse colors
-            if len(generated_colors) < len(self.ticker_cache):
-                colors = generated_colors + random.choices(generated_colors,
-                                                           k=len(self.ticker_cache) - len(generated_colors))
-            else:
-                colors = generated_colors
-
-            # Framework gives colores in [0, 1] rgb, expand it to [0, 255] range
-            colors_adj = []
-            for c in colors:
-                temp = [int(c2 * 255) for c2 in c]
-                colors_adj.append(temp)
-            # convert rgb colors to hex string colors
-            colors_hex = [rgb_to_hex(tuple(c)) for c in colors_adj]
+            # Taken in turn from a palette generated once, generating it here took a while (and hung past 30 colors)
+            colors = [TICKER_PALETTE[i % len(TICKER_PALETTE)] for i in range(len(self.ticker_cache))]
 
             print('Palette used:')
-            for i in range(0, len(generated_colors)):
-                print(fore_from_hex(f'RGB[0:1]: ', colors_hex[i]), end='')
-                print(generated_colors[i], end=' ')
-                print(fore_from_hex(f'RGB[0:255]: ', colors_hex[i]), end='')
-                print(colors_adj[i], end=' ')
-                print(f'Hex: #{colors_hex[i]}')
-
-            colors = colors_hex
+            for hex_color in TICKER_PALETTE[:len(self.ticker_cache)]:
+                print(fore_from_hex(f'RGB[0:255]: ', hex_color), end='')
+                print([int(hex_color[i:i + 2], 16) for i in (0, 2, 4)], end=' ')
+                print(f'Hex: #{hex_color}')
 
         for i, t in enumerate(self.ticker_cache.values()):
             t.color = colors[i]
@@ -148,91 +188,115 @@ class BaseKLineProcessor:
         print()
         print()
         print(
-            'If a color is not visible enough on your terminal you can exclude it by tweaking the source code,\n'
-            'or just restart the app so it auto generates other set of colors')
+            'If a color is not visible enough on your terminal you can remove it from TICKER_PALETTE in '
+            'utils/colors.py')
         print()
 
     def on_candle(self, trading_symbol: str, candle: Candle, is_candle_closed: bool):
-        current_quote_volume = candle.quote_asset_volume
+        self.on_kline(trading_symbol, is_candle_closed, candle.open_unix, candle.close_unix, candle.open, candle.high,
+                      candle.low, candle.close, candle.base_asset_volume, candle.quote_asset_volume)
+
+    def on_kline(self, trading_symbol: str, is_candle_closed: bool, open_unix: int, close_unix: int, open_: float,
+                 high: float, low: float, close: float, base_asset_volume: float, quote_asset_volume: float):
+        """
+        Processes an update of a candle, fields are given as is and written straight into the symbol's
+        candle buffer, no Candle object is built per update.
+        """
+        current_quote_volume = quote_asset_volume
         ticker_info = self.ticker_cache[trading_symbol]
         price_precision = ticker_info.ticker.price_precision
 
         # base slash quote
         bsq = f'{ticker_info.ticker.base}/{ticker_info.ticker.quote}'
 
-        # If currently given candle is different from the latest we have cached
-        # add it to our cache
-        if ticker_info.last_candle is None or \
-                candle.open_unix != ticker_info.last_candle.open_unix:
-            if len(ticker_info.candles) >= self.candle_buffer_len:
-                # remove first(oldest) element in the list
-                ticker_info.candles.pop(0)
-
-            ticker_info.candles.append(candle)
-        else:
+        # If currently given candle is newer than the latest we have cached
+        # add it to our cache, once the buffer is full the oldest candle is overwritten
+        candles = ticker_info.candles
+        last_open_unix = candles.last_value('open_unix') if candles else None
+        if last_open_unix is None or open_unix > last_open_unix:
+            if last_open_unix is not None and trading_symbol in self.volume_baselines:
+                # The newest candle we have is now closed, it becomes part of the baseline
+                self.volume_baselines[trading_symbol].push(candles.last_value('quote_asset_volume'))
+                if self.rule_engine is not None:
+                    self.refresh_baseline(trading_symbol, ticker_info)
+            if last_open_unix is not None and open_unix - last_open_unix > self.interval_ms:
+                # We missed at least one candle (we were disconnected, a frame was dropped...), the newest one we
+                # have is fetched again too, it likely missed its last updates
+                self.on_gap(trading_symbol, ticker_info, last_open_unix, open_unix - self.interval_ms)
+            candles.append_values(open_unix, close_unix, open_, high, low, close, base_asset_volume,
+                                  quote_asset_volume)
+        elif open_unix == last_open_unix:
             # Update the last candle with the current info
             # (it may have changed the low, high, close, and surely the volume)
             # Before that make sure the data matches what we expect it to be right
-            last_candle = ticker_info.candles[len(ticker_info.candles) - 1]
-            if last_candle.open_unix != candle.open_unix or \
-                    last_candle.quote_asset_volume > candle.quote_asset_volume or \
-                    last_candle.base_asset_volume > candle.base_asset_volume:
-                print(colored(f'Unexpected candle: {candle.__dict__} vs last candle: {last_candle.__dict__}', 'red'))
+            if candles.last_value('quote_asset_volume') > quote_asset_volume or \
+                    candles.last_value('base_asset_volume') > base_asset_volume:
+                print(colored(f'Unexpected candle: {trading_symbol} open time: {open_unix} '
+                              f'volume: {base_asset_volume}/{quote_asset_volume} vs last candle: '
+                              f'{candles.last().__dict__}', 'red'))
                 return
 
-            ticker_info.candles[len(ticker_info.candles) - 1] = candle
+            candles.update_last_values(open_unix, close_unix, open_, high, low, close, base_asset_volume,
+                                       quote_asset_volume)
+        else:
+            # Older than the newest candle we have, a late frame, nothing to do with it
+            return
+
+        aggregator = self.aggregators.get(trading_symbol)
+        if aggregator is not None:
+            aggregator.update(open_unix, close_unix, open_, high, low, close, base_asset_volume, quote_asset_volume)
 
         if is_candle_closed:
             if price_precision <= 0:
-                if '.' in str(candle.open):
-                    price_precision = len(str(candle.open).split('.')[1])
+                if '.' in str(open_):
+                    price_precision = len(str(open_).split('.')[1])
                 else:
                     price_precision = 2
 
             if self.app_config.is_windows:
                 print(
-                    ticker_info.color + f'{bsq} - {candle.close}$')
+                    ticker_info.color + f'{bsq} - {close}$')
             else:
-                print(fore_from_hex(f'{bsq} - {candle.close}$',
+                print(fore_from_hex(f'{bsq} - {close}$',
                                     ticker_info.color))
 
-        if len(ticker_info.candles) >= self.min_candles_to_plot and \
-                ticker_info.last_candle is not None and \
-                ticker_info.last_candle.quote_asset_volume > 0 and \
-                (self.min_quote_vol <= 0 or candle.quote_asset_volume >= self.min_quote_vol):
-            diff_volume = current_quote_volume - ticker_info.last_candle.quote_asset_volume
-            vol_pct_increase = (diff_volume * 100 / ticker_info.last_candle.quote_asset_volume)
-            # ratio = current_quote_volume * 100 / self.last_candle.quote_asset_volume
-
-            if vol_pct_increase >= self.min_vol_pct_increase:
-                # it would mean current volume is at least 100% more than previous candle's volume
-                # if ratio => 200 -> (200 / 100) -> 2 -> x2
-                # if ratio => 300 -> (300 / 100) -> 3 -> x3
-                last_known_price = ticker_info.last_candle.close
-                is_bull_volume = candle.close > last_known_price
-                if is_bull_volume:
-                    bull_or_bear_str = 'Bull'
-                    bull_or_bear_color = 'green'
-                else:
-                    bull_or_bear_str = 'Bear'
-                    bull_or_bear_color = 'red'
+        if self.rule_engine is not None:
+            # The rules of every update logged meanwhile are evaluated at once, right after this batch of messages
+            ready = len(ticker_info.candles) >= self.min_candles_to_plot and not ticker_info.backfilling
+            if ready and trading_symbol in self.rule_engine.baseline_symbols and \
+                    trading_symbol not in self.volume_baselines:
+                self.seed_rule_baseline(trading_symbol, ticker_info, quote_asset_volume)
+            self.rule_engine.update(trading_symbol, open_unix, close, quote_asset_volume, ticker_info.last_close,
+                                    ticker_info.last_quote_volume, ready)
+            if not self._rule_evaluation_scheduled:
+                self.schedule_rule_evaluation()
+
+        # While a gap is being backfilled neither the comparison with the last candle nor the chart would be right
+        elif len(ticker_info.candles) >= self.min_candles_to_plot and \
+                not ticker_info.backfilling and \
+                ticker_info.last_quote_volume > 0 and \
+                (self.min_quote_vol <= 0 or quote_asset_volume >= self.min_quote_vol):
+            spike = self.detect_volume_spike(trading_symbol, ticker_info, current_quote_volume)
+
+            if spike is not None:
+                vol_multiple, reference_quote_volume, reference_name, zscore = spike
+                last_known_price = ticker_info.last_close
+                is_bull_volume = close > last_known_price
 
                 # There are three options when it comes to compute the price difference:
-                # 1. Compare current price(from HTTP response) vs latest price we know about (cached in self.last_candle)
+                # 1. Compare current price(from HTTP response) vs latest price we know about (ticker_info.last_close)
                 # 2. Compare current price vs previous 1min candle
                 # 3. Compare current price vs previous aggregated candle (for instance 5min candle)
-                # Although the code is implemented for all, for the last option, as of now, the code
-                # does not take into account offsets, meaning if we compare against a 5min candle
-                # the current code is always treating the current candle as the last one in the 5min candle, which may
-                # not be the case.
+                # Aggregated candles are aligned to the exchange's boundaries, the 5min candle in progress at 10:03
+                # is the one opened at 10:00 and it is compared against the one opened at 09:55.
                 if self.compare_last_price:
                     # The difference of price that we are going check
                     # will be computed from current price - last known price.
-                    current_price = candle.close
+                    current_price = close
                     diff_price = abs(current_price - last_known_price)
                     price_pct_diff = (diff_price * 100) / current_price
 
-                    if bull_or_bear_str == 'Bear':
+                    if not is_bull_volume:
                         price_pct_diff *= -1
 
                 else:
@@ -240,65 +304,276 @@ class BaseKLineProcessor:
                     # will be computed from current price - last candle's close price.
                     # There is the possibility for the last candle to be in another time frame, it is determined
                     # by period_pct_change, for example if it is 5, yet the candles we have are of 1min timeframe
-                    # it will aggregate candles to 5min and check latest price vs previous 5min candle's close price
+                    # it checks the current 5min candle's high vs previous 5min candle's close price
                     price_pct_diff = self.get_n_aggr_max_diff_pct(ticker_info, self.period_pct_change)
 
+                # we only alert if we did not configure a threshold % price change, or we did
+                # and the current change >= % min price change.
                 if self.min_price_pct_change <= 0 or abs(price_pct_diff) >= self.min_price_pct_change:
-                    # we only alert if we did not configure a threshold % price change, or we did
-                    # and the current change >= % min price change
-
-                    current_quote_vol_adj = format(round(candle.quote_asset_volume, 2),
-                                                   ",")
-                    last_quote_vol_adj = format(
-                        round(ticker_info.last_candle.quote_asset_volume, 2),
-                        ",")
-
-                    if self.app_config.is_windows:
-                        colored_trading_symbol = f'{ticker_info.color}{bsq}{colorama.Style.RESET_ALL}'
-                    else:
-                        colored_trading_symbol = fore_from_hex(
-                            f'{bsq}', ticker_info.color)
-
-                    message = '{0} {1} Alert!\n\t' + \
-                              f'{round((vol_pct_increase / 100), 2)}X Volume' \
-                              f' (current: {current_quote_vol_adj}$ ' \
-                              f'vs last: {last_quote_vol_adj}$)' \
-                              f'\n\t' + \
-                              f'Price: {round(candle.close, price_precision)}\n\t' + \
-                              f'{self.period_pct_change}min price Impact%: {round(price_pct_diff, 2)} %\n\t' + \
-                              f'Volume: {current_quote_vol_adj}$'
-
-                    print(message.format(colored_trading_symbol, colored(bull_or_bear_str, bull_or_bear_color)))
-
-                    try:
-                        chart_bytes = self.generate_graph(ticker_info)
-                        for w in self.out_writers:
-                            w.write(ticker_info.ticker.base, ticker_info.ticker.quote,
-                                    message.format(bsq, bull_or_bear_str), chart_bytes)
-
-                    except Exception as exc:
-                        print(f'An error occurred {bsq} - {exc}')
-        ticker_info.last_candle = candle
+                    self.send_alert(trading_symbol, ticker_info, open_unix, close, quote_asset_volume, vol_multiple,
+                                    reference_quote_volume, reference_name, zscore, price_pct_diff, is_bull_volume)
+        ticker_info.last_close = close
+        ticker_info.last_quote_volume = quote_asset_volume
+
+    def send_alert(self, trading_symbol: str, ticker_info: TickerInfo, open_unix: int, close: float,
+                   quote_asset_volume: float, vol_multiple: float, reference_quote_volume: float, reference_name: str,
+                   zscore: Optional[float], price_pct_diff: float, is_bull_volume: bool,
+                   rule_set: Optional[RuleSet] = None):
+        """
+        Prints the alert and hands it over to the alert sink, unless the coalescer holds it back.
+        The rule is evaluated on every update of the open candle, the coalescer makes sure we
+        do not send the same spike over and over again
+        """
+        if not self.alert_coalescer.should_alert(trading_symbol, open_unix, vol_multiple):
+            return
 
-    def get_n_aggr_max_diff_pct(self, ti: TickerInfo, period: int) -> float:
+        # base slash quote
+        bsq = f'{ticker_info.ticker.base}/{ticker_info.ticker.quote}'
+        price_precision = ticker_info.ticker.price_precision
+        if price_precision <= 0:
+            if '.' in str(close):
+                price_precision = len(str(close).split('.')[1])
+            else:
+                price_precision = 2
+
+        if is_bull_volume:
+            bull_or_bear_str = 'Bull'
+            bull_or_bear_color = 'green'
+        else:
+            bull_or_bear_str = 'Bear'
+            bull_or_bear_color = 'red'
+
+        current_quote_vol_adj = format(round(quote_asset_volume, 2),
+                                       ",")
+        last_quote_vol_adj = format(
+            round(reference_quote_volume, 2),
+            ",")
+        zscore_str = f', z-score: {round(zscore, 1)}' if zscore is not None else ''
+
+        if self.app_config.is_windows:
+            colored_trading_symbol = f'{ticker_info.color}{bsq}{colorama.Style.RESET_ALL}'
+        else:
+            colored_trading_symbol = fore_from_hex(
+                f'{bsq}', ticker_info.color)
+
+        message = '{0} {1} Alert!\n\t' + \
+                  f'{round(vol_multiple, 2)}X Volume' \
+                  f' (current: {current_quote_vol_adj}$ ' \
+                  f'vs {reference_name}: {last_quote_vol_adj}${zscore_str})' \
+                  f'\n\t' + \
+                  f'Price: {round(close, price_precision)}\n\t' + \
+                  f'{self.period_pct_change}min price Impact%: {round(price_pct_diff, 2)} %\n\t' + \
+                  f'Volume: {current_quote_vol_adj}$'
+
+        print(message.format(colored_trading_symbol, colored(bull_or_bear_str, bull_or_bear_color)))
+
+        # Rendering the chart and sending it is slow, leave it to the alert sink
+        # so we keep processing incoming candles meanwhile
+        details = {
+            'detected_unix': int(time.time() * 1000),
+            'open_unix': open_unix,
+            'close': close,
+            'quote_volume': quote_asset_volume,
+            'reference_quote_volume': reference_quote_volume,
+            'reference_name': reference_name,
+            'vol_multiple': vol_multiple,
+            'zscore': zscore,
+            'price_pct_diff': price_pct_diff,
+            'bull': is_bull_volume,
+            'thresholds': self.alert_thresholds(rule_set),
+        }
+        self.alert_sink.submit(AlertJob.create(
+            trading_symbol, ticker_info.ticker.base, ticker_info.ticker.quote,
+            message.format(bsq, bull_or_bear_str), ticker_info.candles.snapshot(self.candles_to_plot), details))
+
+    def alert_thresholds(self, rule_set: Optional[RuleSet] = None) -> Dict:
         """
-        Will take period, build 2 candles aggregating last candles in groups of period parameter
-        Then check the price difference between them
-        :param
-        period:
-        :return:
+        Thresholds an alert passed, those of its rule set if it was fired by the rule engine
         """
-        last_n_aggr_candle = self.get_last_n_periods_aggr_candle(ti, period)
+        source = rule_set if rule_set is not None else self
+        thresholds = {
+            'rule_set': rule_set.name if rule_set is not None else None,
+            'detector_mode': source.detector_mode,
+            'min_quote_vol': source.min_quote_vol,
+            'min_price_pct_change': source.min_price_pct_change,
+        }
+        if source.detector_mode == 'previous':
+            thresholds['min_vol_pct_increase'] = source.min_vol_pct_increase
+        elif source.detector_mode == 'zscore':
+            thresholds['min_volume_zscore'] = source.min_volume_zscore
+        else:
+            thresholds['min_volume_baseline_multiple'] = source.min_volume_baseline_multiple
+        return thresholds
 
-        if last_n_aggr_candle is None:
-            return 100
+    def schedule_rule_evaluation(self):
+        if self._rule_evaluation_scheduled:
+            return
 
-        start = len(ti.candles) - period - period
-        if start < 0:
-            return 100
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not driven by an event loop (replays, tests), nothing to batch
+            self.evaluate_rules()
+            return
 
-        end = len(ti.candles) - period - 1
-        before_last_n_candle = self.aggregate_candles(ti, start, end)
+        self._rule_evaluation_scheduled = True
+        loop.call_soon(self.evaluate_rules)
+
+    def evaluate_rules(self):
+        """
+        Evaluates the updates logged so far and sends the alerts of the hits
+        """
+        self._rule_evaluation_scheduled = False
+        for hit in self.rule_engine.evaluate():
+            ticker_info = self.ticker_cache[hit.trading_symbol]
+            price_pct_diff = hit.price_pct_diff
+            if price_pct_diff is None:
+                # The rule set compares against aggregated candles, only computed for the few symbols left (as they
+                # are at the end of the batch)
+                price_pct_diff = self.get_n_aggr_max_diff_pct(ticker_info, self.period_pct_change)
+                min_price_pct_change = hit.rule_set.min_price_pct_change
+                if min_price_pct_change > 0 and abs(price_pct_diff) < min_price_pct_change:
+                    continue
+
+            self.send_alert(hit.trading_symbol, ticker_info, hit.open_unix, hit.close, hit.quote_volume,
+                            hit.vol_multiple, hit.reference_quote_volume, hit.reference_name, hit.zscore,
+                            price_pct_diff, hit.close > hit.last_close, hit.rule_set)
+
+    def seed_rule_baseline(self, trading_symbol: str, ticker_info: TickerInfo, quote_asset_volume: float):
+        """
+        Creates the volume baseline of a symbol judged by the rule engine at the very update detect_volume_spike
+        would create it, the first one that passes the volume checks: it is seeded from the candles held then,
+        so both paths compare against the same baseline. Only for rule sets that use a baseline
+        """
+        if ticker_info.last_quote_volume <= 0:
+            return
+        rule_set = self.rule_engine.rule_set_of(self.rule_engine.slot(trading_symbol))
+        if rule_set.min_quote_vol > 0 and quote_asset_volume < rule_set.min_quote_vol:
+            return
+        self.refresh_baseline(trading_symbol, ticker_info)
+
+    def refresh_baseline(self, trading_symbol: str, ticker_info: TickerInfo):
+        """
+        Publishes the volume baseline of the symbol to the rule engine, if its rule set uses one
+        """
+        slot = self.rule_engine.slot(trading_symbol)
+        rule_set = self.rule_engine.rule_set_of(slot)
+        if rule_set is None or not rule_set.uses_baseline:
+            return
+
+        baseline = self.volume_baseline(trading_symbol, ticker_info)
+        self.rule_engine.update_baseline(slot, len(baseline), baseline.mean, baseline.std, baseline.ewma)
+
+    def volume_baseline(self, trading_symbol: str, ticker_info: TickerInfo) -> RollingBaseline:
+        baseline = self.volume_baselines.get(trading_symbol)
+        if baseline is None:
+            # Seeded once from the closed candles we hold (all but the live one), then kept up to date
+            # as candles close
+            baseline = RollingBaseline(self.volume_baseline_window)
+            baseline.seed(ticker_info.candles.column('quote_asset_volume')[:-1])
+            self.volume_baselines[trading_symbol] = baseline
+        return baseline
+
+    def detect_volume_spike(self, trading_symbol: str, ticker_info: TickerInfo,
+                            quote_asset_volume: float) -> Optional[Tuple[float, float, str, Optional[float]]]:
+        """
+        Applies the volume rule of detector_mode to the current quote volume of the live candle
+        :return: None if it is not abnormal, otherwise (volume multiplier, volume compared against and its name,
+        z-score if computed)
+        """
+        if self.detector_mode == 'previous':
+            diff_volume = quote_asset_volume - ticker_info.last_quote_volume
+            vol_pct_increase = (diff_volume * 100 / ticker_info.last_quote_volume)
+            # it would mean current volume is at least 100% more than previous candle's volume
+            # if ratio => 200 -> (200 / 100) -> 2 -> x2
+            # if ratio => 300 -> (300 / 100) -> 3 -> x3
+            if vol_pct_increase >= self.min_vol_pct_increase:
+                return vol_pct_increase / 100, ticker_info.last_quote_volume, 'last', None
+            return None
+
+        baseline = self.volume_baseline(trading_symbol, ticker_info)
+        if len(baseline) < self.volume_baseline_min_samples:
+            return None
+
+        multiple = baseline.multiple(quote_asset_volume)
+        if multiple is None:
+            return None
+
+        if self.detector_mode == 'zscore':
+            zscore = baseline.zscore(quote_asset_volume)
+            if zscore is not None and zscore >= self.min_volume_zscore and multiple >= 1:
+                return multiple, baseline.ewma, 'baseline', zscore
+        elif multiple >= self.min_volume_baseline_multiple:
+            return multiple, baseline.ewma, 'baseline', baseline.zscore(quote_asset_volume)
+        return None
+
+    def set_gap_filler(self, gap_filler: 'GapFiller'):
+        """
+        Without a gap filler, gaps in the stream are only reported
+        """
+        self.gap_filler = gap_filler
+
+    def on_gap(self, trading_symbol: str, ticker_info: TickerInfo, start_time: int, end_time: int):
+        """
+        :param start_time: open time of the newest candle we have, it is refetched along with the missing ones
+        :param end_time: open time of the last missing candle
+        """
+        missing = (end_time - start_time) // self.interval_ms
+        print(colored(f'{ticker_info} - missing {missing} candles, from {start_time + self.interval_ms} to '
+                      f'{end_time}', 'yellow'))
+        if self.gap_filler is None:
+            return
+
+        # Alerts for this symbol are suppressed until the buffer is continuous again. With a request already in
+        # flight for the symbol the gap is fetched right after it, before on_gap_filled is called
+        ticker_info.backfilling = True
+        self.gap_filler.request(trading_symbol, start_time, end_time, self.interval_ms)
+
+    def on_gap_filled(self, trading_symbol: str, columns: Dict[str, np.ndarray]):
+        ticker_info = self.ticker_cache[trading_symbol]
+        # The candles fetched are all closed, their final values replace the partial ones we had
+        ticker_info.candles.merge(columns, replace=True)
+        ticker_info.backfilling = False
+        # Seeded again from the buffer, now with the backfilled candles
+        self.volume_baselines.pop(trading_symbol, None)
+        self.aggregators.pop(trading_symbol, None)
+        if self.rule_engine is not None:
+            self.rule_engine.update_baseline(self.rule_engine.slot(trading_symbol), 0, 0.0, 0.0, None)
+
+        open_unix = ticker_info.candles.column('open_unix')
+        holes = np.flatnonzero(np.diff(open_unix) != self.interval_ms)
+        if len(holes) > 0:
+            # The exchange does not have them either (a trading halt for instance), waiting would not help
+            print(colored(f'{ticker_info} - {len(holes)} gaps could not be backfilled', 'yellow'))
+        else:
+            print(colored(f'{ticker_info} - backfilled {len(columns["open_unix"])} candles', 'green'))
+
+    def on_gap_failed(self, trading_symbol: str):
+        ticker_info = self.ticker_cache[trading_symbol]
+        ticker_info.backfilling = False
+        print(colored(f'{ticker_info} - could not backfill the missing candles, resuming anyway', 'red'))
+
+    def aggregator(self, trading_symbol: str, ticker_info: TickerInfo) -> CandleAggregator:
+        aggregator = self.aggregators.get(trading_symbol)
+        if aggregator is None:
+            aggregator = CandleAggregator(self.aggregate_periods, self.interval_ms)
+            aggregator.seed(ticker_info.candles)
+            self.aggregators[trading_symbol] = aggregator
+        return aggregator
+
+    def get_n_aggr_max_diff_pct(self, ti: TickerInfo, period: int) -> float:
+        """
+        Price difference between the candle of period in progress and the previous complete one, for instance
+        with 1m candles and a period of 5, the current 5m candle against the previous 5m candle
+        :param ti:
+        :param period: one of aggregate_periods
+        :return: % the high of the current candle is above the close of the previous one
+        """
+        aggregator = self.aggregator(f'{ti.ticker.base}{ti.ticker.quote}', ti)
+        last_n_aggr_candle = aggregator.current(period)
+        before_last_n_candle = aggregator.previous(period)
+        if last_n_aggr_candle is None or before_last_n_candle is None:
+            return 100
 
         is_bull = True
         if is_bull:
@@ -316,6 +591,7 @@ class BaseKLineProcessor:
         aggregate them into one single candle and return it.
         So if the data was 1 m, this will return the last 5 m candle.
         If the data was in 1 d and period argument was 7, this method will return the last 1w candle
+        Unlike the aggregator, the candles are not aligned to the exchange's boundaries.
         :param ti:
         :param period:
         :return: a Candle object resulted from aggregating last period candles
@@ -323,293 +599,45 @@ class BaseKLineProcessor:
         start = max(0, len(ti.candles) - period)
         end = min(len(ti.candles) - 1, start + period - 1)
 
-        # print(f'{start}-{end}')
         candle = self.aggregate_candles(ti, start, end)
         return candle
 
-    def aggregate_base_asset_volume(self, ti: TickerInfo, start: int, end: int):
+    @staticmethod
+    def aggregate_base_asset_volume(ti: TickerInfo, start: int, end: int) -> float:
         """
-        Aggregates
-        the
-        volume_base
-        volume
-        using
-        sum,
-        for instance if we should aggregate 5 1min candles into one 5min candle
-        the
-        5
-        min
-        's volume_base should be the sum of each one of the 5 1min candles
-        Base in BTC / USDT
-        ticker
-        would
-        be
-        BTC, so
-        we
-        are
-        handling
-        BTC
-        volume.
-        :param
-        ti:
-        :param
-        start:
-        :param
-        end:
-        :return:
+        Sum of the base asset volume (BTC in BTC/USDT) of the candles in the range [start, end)
         """
-        total_volume = 0
-        for i in range(start, end):
-            total_volume += ti.candles[i].base_asset_volume
-
-        return total_volume
+        return float(ti.candles.column('base_asset_volume')[start:end].sum())
 
-    def aggregate_quote_asset_volume(self, ti: TickerInfo, start: int, end: int):
+    @staticmethod
+    def aggregate_quote_asset_volume(ti: TickerInfo, start: int, end: int) -> float:
         """
-        Aggregates
-        the
-        volume_quote
-        volume
-        using
-        sum,
-        for instance if we should aggregate 5 1min candles into one 5min
-        candle
-        the
-        5
-        min
-        's volume_base should be the sum of each one of the 5 1min candles.
-        Quote in BTC / USDT
-        ticker
-        would
-        be
-        USDT, so
-        we
-        are
-        handling
-        USDT
-        volume.
-        :param
-        ti:
-        :param
-        start:
-        :param
-        end:
-        :return:
+        Sum of the quote asset volume (USDT in BTC/USDT) of the candles in the range [start, end)
         """
-        total_volume = 0
-        for i in range(start, end):
-            total_volume += ti.candles[i].quote_asset_volume
+        return float(ti.candles.column('quote_asset_volume')[start:end].sum())
 
     @staticmethod
     def aggregate_candles(ti: TickerInfo, start: int, end: int) -> Optional[Candle]:
         """
-        Takes
-        candles in the
-        range[start, end]
-        from self.candles and aggregates
-        them
-        into
-        one
-        resulting
-        candle.For
-        example, we
-        have
-        1
-        min
-        candles
-        cached in self.candles, to
-        aggregate
-        the
-        first
-        5
-        candles
-        into
-        one
-        candle
-        of
-        5
-        min
-        we
-        would
-        call
-        this
-        function
-        with start=0, end=4
-        :param
-        ti:
-        :param
-        start: index
-        of
-        the
-        first
-        candle
-        to
-        aggregate
-        :param
-        end: index
-        of
-        the
-        last
-        candle
-        to
-        aggregate
+        Aggregates the candles in the range [start, end] of the buffer into one, for example with 1m candles
+        start=0, end=4 gives the 5m candle of the first 5 candles
+        :param ti:
+        :param start: index of the first candle to aggregate
+        :param end: index of the last candle to aggregate
         :return:
         """
         if start >= len(ti.candles) or end >= len(ti.candles):
             return None
 
+        columns = ti.candles.columns()
         result_candle = Candle()
-        result_candle.open = ti.candles[start].open
-        result_candle.close = ti.candles[end].close
-
-        for i in range(start, end + 1):
-            current_candle = ti.candles[i]
-            if result_candle.high < current_candle.high:
-                result_candle.high = current_candle.high
-
-            if result_candle.low == 0 or result_candle.low > current_candle.low:
-                result_candle.low = current_candle.low
-
-            result_candle.quote_asset_volume += current_candle.quote_asset_volume
-            result_candle.base_asset_volume += current_candle.base_asset_volume
+        result_candle.open_unix = int(columns['open_unix'][start])
+        result_candle.close_unix = int(columns['close_unix'][end])
+        result_candle.open = float(columns['open'][start])
+        result_candle.close = float(columns['close'][end])
+        result_candle.high = float(columns['high'][start:end + 1].max())
+        result_candle.low = float(columns['low'][start:end + 1].min())
+        result_candle.base_asset_volume = float(columns['base_asset_volume'][start:end + 1].sum())
+        result_candle.quote_asset_volume = float(columns['quote_asset_volume'][start:end + 1].sum())
 
         return result_candle
-
-    def generate_graph(self, ti: TickerInfo):
-
-        df = pd.DataFrame(columns=['unix', 'date', 'open', 'high', 'low', 'close', 'volume'])
-        df = df.astype({
-            'open': 'float64',
-            'high': 'float64',
-            'close': 'float64',
-            'low': 'float64',
-            'volume': 'float64',
-        })
-
-        # https://stackoverflow.com/questions/19231871/convert-unix-time-to-readable-date-in-pandas-dataframe
-        # if unix is in nanoseconds then unit='ns' but we know from documentation that Binance API issues
-        # dates as Unix timestamps with ms precision and not nanosecond precision.
-        df['date'] = pd.to_datetime(df['unix'], unit='ms')
-        df.set_index('date', inplace=True)
-
-        max_index = self.candles_to_plot
-        if max_index >= len(ti.candles):
-            max_index = len(ti.candles)
-
-        for i in range(0, max_index):
-            candle = ti.candles[i]
-
-            open_datetime = pd.to_datetime(candle.open_unix, unit='ms')
-            df.loc[open_datetime] = {
-                'unix': candle.open_unix,
-                'open': candle.open,
-                'high': candle.high,
-                'low': candle.low,
-                'close': candle.close,
-                'volume': candle.base_asset_volume,
-            }
-
-        # Resample the data. For example we fetch the data in 1min, but we need to plot it in 5min
-        df_ohlcv = df.resample(f'{self.timeframe_plot}min').agg(
-            {
-                'close': 'last',  # The Close value to keep is the latest Close price in the aggregate
-                'open': 'first',  # The Open value to keep is the first Opening value for the aggregate
-                'high': 'max',  # The High value to keep is the Max/highest in the aggregate
-                'low': 'min',  # The Low value to keep is the low/min in the aggregate
-                'volume': 'sum',  # The Volume to keep is the sum of volumes
-            })
-
-        if self.debug:
-            print(
-                f'{ti.ticker.base}/{ti.ticker.quote} - '
-                f'First Candle: {pd.to_datetime(ti.candles[0].open_unix, unit="ms")} '
-                f'First Dataframe: {df_ohlcv.index[0]}')
-
-            plotly_chart_bytes = self.generate_graph_plotly(ti, df_ohlcv)
-
-            with open(f'./output/plotly_{ti.ticker.base}{ti.ticker.quote}.png', 'wb') as fd:
-                fd.write(plotly_chart_bytes)
-
-            mpl_chart_bytes = self.generate_graph_matplotlib(ti, df_ohlcv)
-            with open(f'./output/matplotlib_{ti.ticker.base}{ti.ticker.quote}.png', 'wb') as fd:
-                fd.write(mpl_chart_bytes)
-
-            if self.plot_framework == 'matplotlib':
-                return mpl_chart_bytes
-            else:
-                return plotly_chart_bytes
-
-        if self.plot_framework == 'matplotlib':
-            chart_bytes = self.generate_graph_matplotlib(ti, df_ohlcv)
-            return chart_bytes
-        elif self.plot_framework == 'plotly':
-            # plot price graph
-            chart_bytes = self.generate_graph_plotly(ti, df_ohlcv)
-            return chart_bytes
-        else:
-            raise OSError(f'unknown value {self.plot_framework}')
-
-    def generate_graph_matplotlib(self, ti: TickerInfo, df_ohlcv: pd.DataFrame) -> bytes:
-
-        fig: plt.Figure
-        fig, (ax1, ax2) = plt.subplots(nrows=2, gridspec_kw=dict(height_ratios=[3, 1]))
-        # https://stackoverflow.com/questions/63918394/how-can-i-change-the-formatting-of-the-mplfinance-volume-on-the-chart
-
-        # Make sure the Volume plot shows zeros rather than 10 to the power, for example: 1000000 rather than 10^6
-        ax2.yaxis.set_major_formatter(mticker.FormatStrFormatter('%d'))
-        mpf.plot(df_ohlcv[:min(self.candles_to_plot, len(df_ohlcv))], type='candle', style='binance',
-                 volume=ax2,
-                 ax=ax1)
-
-        fig.suptitle(f'{ti.ticker.base}/{ti.ticker.quote}')
-        fig.autofmt_xdate()
-        fig.set_size_inches(11.25, 7.5)
-        # export plot to jpg, from there get the bytes array
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='jpg')
-        buffer.seek(0)
-        plt.clf()
-        plt.cla()
-        plt.close()
-        return buffer.read()
-
-    def generate_graph_plotly(self, ti: TickerInfo, df: pd.DataFrame) -> bytes:
-        up_color = getattr(self.app_config, 'candle_up_color', '#26a69a')
-        down_color = getattr(self.app_config, 'candle_down_color', '#ef5350')
-
-        # Create a figure with 2 subplots
-        fig = plotly_subplots.make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.7, 0.3])
-        # In the first subplot add the Candlestick
-        # noinspection PyTypeChecker
-        fig.add_trace(
-            plotly_go.Candlestick(name='price', showlegend=False,
-                                  x=df.index, open=df.open, high=df.high, low=df.low, close=df.close,
-                                  increasing_line_color=up_color, decreasing_line_color=down_color),
-            row=1, col=1)
-
-        # In the second subplot add the Volume
-        bullish_rows = df[df['close'] > df['open']]
-        bearish_rows = df[df['close'] < df['open']]
-
-        # noinspection PyTypeChecker
-        fig.add_trace(
-            plotly_go.Bar(x=bearish_rows.index, y=bearish_rows.volume,
-                          showlegend=False, marker_color=down_color), row=2, col=1)
-        # noinspection PyTypeChecker
-        fig.add_trace(
-            plotly_go.Bar(x=bullish_rows.index, y=bullish_rows.volume,
-                          showlegend=False, marker_color=up_color), row=2, col=1)
-        # Hide the Range Slider, it is not useful in a static image which is what we are going to get at the end
-        # noinspection PyArgumentList
-        fig.update(layout_xaxis_rangeslider_visible=False)
-        fig.update_layout(title=f'{ti.ticker.base}/{ti.ticker.quote}',
-                          yaxis_title=f'Price ({ti.ticker.quote})')
-        # Adjust the plot size
-        fig.update_layout(width=getattr(self.app_config, 'plot_width', 1080),
-                          height=getattr(self.app_config, 'plot_height', 720))
-
-        fig.update_yaxes(title_text=f'Volume ({ti.ticker.base})', row=2, col=1)
-        fig.update_xaxes(title_text='Date', row=2)
-
-        # Export plot to bytes
-        return fig.to_image(format="png")
@@ -0,0 +1,103 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from termcolor import colored
+
+from core.candle_buffer import CandleRingBuffer
+from exchanges import IExchangeRest
+from storage.candle_cache import CandleCache
+from utils.timeframes import timeframe_to_ms
+
+
+class CandleBackfiller:
+    """
+    Loads the initial candles of many symbols concurrently. How fast requests go out is only bounded by the
+    REST client's rate limiter (which follows the weight the exchange reports as used), not by round trips:
+    a pool of threads keeps several requests in flight over the client's keep-alive connections.
+
+    If a candle cache is given, candles are read from disk and only the ones after the newest stored candle
+    are requested, then the cache is brought up to date.
+    """
+    timeframe: str
+    candle_buffer_len: int
+    max_workers: int
+    retry_delay: float
+
+    def __init__(self, rest_client: IExchangeRest, timeframe: str, candle_buffer_len: int = 500,
+                 max_workers: int = 8, retry_delay: float = 5, cache: Optional[CandleCache] = None):
+        self.rest_client = rest_client
+        self.cache = cache
+        self.timeframe = timeframe
+        self.candle_buffer_len = candle_buffer_len
+        self.max_workers = max_workers
+        self.retry_delay = retry_delay
+
+    def _load_delta(self, trading_symbol: str) -> Optional[CandleRingBuffer]:
+        """
+        Loads the candles stored on disk and fetches the ones after them
+        :return: None if nothing useful was stored, the whole history must be downloaded then
+        """
+        candles = self.cache.load(trading_symbol, self.timeframe, self.candle_buffer_len)
+        if not candles:
+            return None
+
+        interval = timeframe_to_ms(self.timeframe)
+        if np.any(np.diff(candles.column('open_unix')) != interval):
+            # Holes in what was stored (a gap stored before being backfilled), the download replaces it
+            return None
+
+        first_missing = candles.last_value('open_unix') + interval
+        # including the live candle
+        missing = (int(time.time() * 1000) - first_missing) // interval + 1
+        if missing >= min(self.candle_buffer_len, 1500):
+            # We were down for longer than what we keep, nothing to reuse
+            return None
+
+        delta = self.rest_client.fetch_klines(trading_symbol, self.timeframe, limit=missing + 1,
+                                              start_time=first_missing)
+        if len(delta['open_unix']) > 0 and delta['open_unix'][0] != first_missing:
+            # Should not happen, but if there is a hole better start over
+            return None
+
+        candles.extend(delta)
+        return candles
+
+    def _load_one(self, trading_symbol: str) -> CandleRingBuffer:
+        while True:
+            try:
+                candles = None
+                if self.cache is not None:
+                    candles = self._load_delta(trading_symbol)
+                downloaded = candles is None
+                if downloaded:
+                    candles = self.rest_client.load_candles(trading_symbol, self.timeframe, self.candle_buffer_len)
+                if self.cache is not None:
+                    self.cache.store(trading_symbol, self.timeframe, candles, rewrite=downloaded)
+                return candles
+            except Exception as exc:
+                print(colored(
+                    f'An error occurred loading candles for {trading_symbol}, retrying in {self.retry_delay}seconds. '
+                    f'Error Details: {exc}', 'red'))
+                time.sleep(self.retry_delay)
+
+    def load(self, trading_symbols: List[str],
+             on_loaded: Optional[Callable[[str, CandleRingBuffer], None]] = None) -> Dict[str, CandleRingBuffer]:
+        """
+        :param trading_symbols: BTCUSDT, ETHUSDT...
+        :param on_loaded: called, from the calling thread, as soon as the candles of a symbol are loaded
+        :return: trading symbol -> its candles
+        """
+        started = time.perf_counter()
+        candles = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='backfill') as executor:
+            futures = {executor.submit(self._load_one, s): s for s in trading_symbols}
+            for future in as_completed(futures):
+                trading_symbol = futures[future]
+                candles[trading_symbol] = future.result()
+                if on_loaded is not None:
+                    on_loaded(trading_symbol, candles[trading_symbol])
+
+        print(f'Loaded candles for {len(candles)} pairs in {time.perf_counter() - started:.2f}s')
+        return candles
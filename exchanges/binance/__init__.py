@@ -1,79 +1,229 @@
 import abc
-import json
+import time
+import urllib.parse
 from typing import Any
 from typing import List, Optional, Dict
 
+import numpy as np
 import requests
+import requests.adapters
 from termcolor import colored
 
-from core.models import Candle
+from core import metrics
+from core.candle_buffer import CandleRingBuffer
+from core.market_index import MarketIndex
+from core.models import Candle, TickerInfo
 from exchanges import IExchangeRest, IExchangeWsApi
+from exchanges.binance.decoders import IKlineDecoder, create_kline_decoder
+from storage.exchange_info_cache import ExchangeInfoCache
+from storage.frame_recorder import FrameRecorder
+from utils.rate_limit import WeightRateLimiter
 from ws_facades.autobahn_api import AbstractAutobahnWsClient
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+KLINE_DECODE_SECONDS = metrics.histogram('kline_decode_seconds', 'Time decoding a kline message')
+KLINE_PROCESS_SECONDS = metrics.histogram('kline_process_seconds',
+                                          'Time processing a decoded kline: candle update and detection')
+# Includes the clock difference between Binance and us, keep the clock synced (NTP)
+KLINE_LAG_SECONDS = metrics.histogram('kline_lag_seconds', 'Time from Binance sending a kline message to its receipt')
+CANDLE_BUFFER_CANDLES = metrics.gauge('candle_buffer_candles', 'Candles in the buffer of the symbol', ('symbol',))
+
+
+def klines_to_columns(rows: List[List[Any]]) -> Dict[str, np.ndarray]:
+    """
+    Converts kline rows, as returned by the klines REST endpoint, to CandleRingBuffer columns in bulk,
+    NumPy parses the numeric strings itself rather than calling float() once per field.
+    Row layout: open time, open, high, low, close, base asset volume, close time, quote asset volume,
+    number of trades, taker buy base asset volume, taker buy quote asset volume, ignore
+    """
+    if len(rows) == 0:
+        return {name: np.empty(0, dtype=dtype) for name, dtype in CandleRingBuffer.COLUMNS.items()}
+
+    values = np.array([row[:8] for row in rows], dtype=np.float64)
+    return {
+        'open_unix': values[:, 0].astype(np.int64),
+        'open': values[:, 1],
+        'high': values[:, 2],
+        'low': values[:, 3],
+        'close': values[:, 4],
+        'base_asset_volume': values[:, 5],
+        'close_unix': values[:, 6].astype(np.int64),
+        'quote_asset_volume': values[:, 7],
+    }
+
 
 class AbstractBinanceRestClient(IExchangeRest):
+    session: requests.Session
+    rate_limiter: WeightRateLimiter
+    # scheme and host the REST requests are sent to, https://fapi.binance.com
+    base_url: str
+
+    def __init__(self, max_connections: int = 10, base_url: Optional[str] = None):
+        """
+        :param base_url: to send the requests somewhere else than to Binance (the simulator...), None for Binance
+        """
+        self.base_url = (base_url or self.get_default_base_url()).rstrip('/')
+        # One keep-alive connection pool shared by every thread using this client
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.rate_limiter = WeightRateLimiter(self.get_default_weight_limit())
+
+    @abc.abstractmethod
+    def get_default_base_url(self) -> str:
+        raise NotImplemented('Should be implemented by super Implementation class')
+
+    def get_default_weight_limit(self) -> int:
+        """
+        Request weight allowed per minute, only used until exchangeInfo tells us the actual limit
+        """
+        return 1200
+
+    def get_ex_info_weight(self) -> int:
+        return 20
+
+    def get_klines_weight(self, limit: int) -> int:
+        return 2
+
+    def request(self, url: str, weight: int, params: Optional[Dict] = None,
+                headers: Optional[Dict] = None) -> requests.Response:
+        """
+        GET the given url, waiting for the rate limiter to allow a request of the given weight.
+        Keeps the rate limiter in sync with the weight Binance reports as used, and if Binance asks us
+        to back off (429, or 418 once we are banned) every thread is stopped for as long as it tells us.
+        """
+        self.rate_limiter.acquire(weight)
+        res = self.session.get(url, params=params, headers=headers, timeout=30)
+
+        used_weight = res.headers.get('X-MBX-USED-WEIGHT-1M') or res.headers.get('X-MBX-USED-WEIGHT')
+        if used_weight is not None:
+            self.rate_limiter.update_used_weight(int(used_weight))
+
+        if res.status_code in (418, 429):
+            retry_after = int(res.headers.get('Retry-After', 60))
+            self.rate_limiter.block_for(retry_after)
+            print(colored(f'Binance rate limit hit ({res.status_code}), backing off for {retry_after}s', 'red'))
+
+        return res
 
     def load_markets(self) -> Optional[Dict]:
         # https://developers.binance.com/docs/binance-trading-api/futures#general-api-information
         # https://developers.binance.com/docs/binance-trading-api/futures#exchange-information
-        res = requests.get(self.get_rest_ex_info_url())
+        res = self.request(self.get_rest_ex_info_url(), self.get_ex_info_weight())
         if res.status_code == 200:
-            return res.json()
+            markets = res.json()
+            self.apply_rate_limits(markets)
+            return markets
         return None
 
+    def apply_rate_limits(self, markets: Dict):
+        for rate_limit in markets.get('rateLimits', []):
+            if rate_limit['rateLimitType'] == 'REQUEST_WEIGHT' and rate_limit['interval'] == 'MINUTE':
+                self.rate_limiter.set_limit(rate_limit['limit'] // rate_limit.get('intervalNum', 1))
+
+    def get_contract_type(self) -> str:
+        """
+        Contract type of the markets we monitor, as keyed in MarketIndex, '' for spot
+        """
+        return ''
+
+    def load_market_index(self, cache: Optional[ExchangeInfoCache] = None) -> MarketIndex:
+        """
+        Markets of the exchange indexed by base, quote and contract type. exchangeInfo is only downloaded and
+        parsed if there is no cache or it expired, and then conditionally: if the server says it did not change
+        the cached index is kept. If the exchange can not be reached an expired cache is used anyway.
+        """
+        if cache is not None and cache.is_fresh():
+            index = cache.load()
+            print(f'Markets loaded from cache ({len(index)} markets, {cache.age() / 60:.0f}min old)')
+        else:
+            index = self._fetch_market_index(cache)
+
+        if index.weight_limit is not None:
+            self.rate_limiter.set_limit(index.weight_limit)
+        return index
+
+    def _fetch_market_index(self, cache: Optional[ExchangeInfoCache]) -> MarketIndex:
+        headers = cache.validators() if cache is not None else None
+        try:
+            res = self.request(self.get_rest_ex_info_url(), self.get_ex_info_weight(), headers=headers)
+        except requests.RequestException as exc:
+            res = None
+            error = str(exc)
+        else:
+            error = f'{res.status_code} {res.reason}'
+
+        if res is not None and res.status_code == 304:
+            cache.touch()
+            return cache.load()
+
+        if res is not None and res.status_code == 200:
+            # The futures exchangeInfo weighs several MB, orjson parses it much faster if installed
+            markets = orjson.loads(res.content) if orjson is not None else res.json()
+            index = MarketIndex.from_exchange_info(markets)
+            if cache is not None:
+                cache.store(index, res.headers.get('ETag'), res.headers.get('Last-Modified'))
+            return index
+
+        stale = cache.load() if cache is not None else None
+        if stale is None:
+            raise ConnectionError(f'Could not load the markets of {self.get_market_name()} - {error}')
+        print(colored(f'Could not refresh the markets of {self.get_market_name()} ({error}), '
+                      f'using the ones cached {cache.age() / 60:.0f}min ago', 'yellow'))
+        return stale
+
     @abc.abstractmethod
     def get_rest_ex_info_url(self):
         raise NotImplemented('Should be implemented by super Implementation class')
 
-    def load_candles(self, trading_symbol: str, timeframe: str, candle_buffer_len: int) -> List[Candle]:
+    def fetch_klines(self, trading_symbol: str, timeframe: str, limit: int, start_time: Optional[int] = None,
+                     end_time: Optional[int] = None) -> Dict[str, np.ndarray]:
         """
-        Fetches information to construct the initial candle list to start with, so that we have enough
-        initial data to plot a chart
-
-
-        :param trading_symbol:
-        :param timeframe:
-        :param candle_buffer_len:
+        Fetches up to limit (max 1500) candles as CandleRingBuffer columns
+        :param trading_symbol: BTCUSDT
+        :param timeframe: 1m
+        :param limit:
+        :param start_time: if given, open time in ms of the first candle to fetch, otherwise the latest candles
+        :param end_time: if given, open time in ms of the last candle to fetch
         :return:
         """
-
-        candles = []
-
-        res = requests.get(self.get_rest_kline_url(), params={
+        params = {
             'symbol': trading_symbol.upper(),
             'interval': timeframe,
-            'limit': candle_buffer_len,  # default 500, max 1500
-        })
+            'limit': limit,  # default 500, max 1500
+        }
+        if start_time is not None:
+            params['startTime'] = start_time
+        if end_time is not None:
+            params['endTime'] = end_time
+
+        res = self.request(self.get_rest_kline_url(), self.get_klines_weight(limit), params)
 
         if res.status_code != 200:
             raise AssertionError(f'Error on {trading_symbol} - {res.content}')
 
-        rows = res.json()
-        # Let's say we are given by the API 700 candles, but we only cache 500
-        # we only want the latest 500, so we must start reading from 200 all the way to
-        # the 700th candle. If we are given less than what we would save, then
-        # read it all, starting from the first (0 index)
-        start_index = max(0, len(rows) - candle_buffer_len)
-
-        for i in range(start_index, len(rows)):
-            row = rows[i]
-            candle = Candle()
-            candle.open_unix = int(row[0])
-            candle.open = float(row[1])
-            candle.high = float(row[2])
-            candle.low = float(row[3])
-            candle.close = float(row[4])
-            candle.base_asset_volume = float(row[5])
-            candle.close_time = int(row[6])
-            candle.quote_asset_volume = float(row[7])
-            # candle.number_of_trades = float(row[8])
-            # candle.taker_buy_base_asset_volume = float(row[9])
-            # candle.taker_buy_quote_asset_volume = float(row[10])
-            # candle.ignore = bool(row[11])
-            candles.append(candle)
-            if len(candles) >= candle_buffer_len:
-                break
+        return klines_to_columns(res.json())
+
+    def load_candles(self, trading_symbol: str, timeframe: str, candle_buffer_len: int) -> CandleRingBuffer:
+        """
+        Fetches information to construct the initial candle buffer to start with, so that we have enough
+        initial data to plot a chart
+
 
+        :param trading_symbol:
+        :param timeframe:
+        :param candle_buffer_len:
+        :return: a buffer with capacity for candle_buffer_len candles, filled with the latest candles
+        """
+
+        candles = CandleRingBuffer(candle_buffer_len)
+        # If we are given more candles than what we cache, only the latest ones are kept
+        candles.extend(self.fetch_klines(trading_symbol, timeframe, candle_buffer_len))
         return candles
 
     @abc.abstractmethod
@@ -82,6 +232,13 @@ class AbstractBinanceRestClient(IExchangeRest):
 
 
 class AbstractBinanceWsClient(IExchangeWsApi, AbstractAutobahnWsClient):
+    kline_decoder: IKlineDecoder
+    # If set, every frame received is recorded before being processed
+    recorder: Optional[FrameRecorder] = None
+    # scheme, host and port the websocket connects to, wss://fstream.binance.com:443
+    ws_base_url: str
+    # If set, every message is timed, see enable_metrics
+    metrics_enabled: bool = False
 
     def on_connected(self, address: str):
         print(colored(f"Server connected: {address}", 'cyan'))
@@ -89,46 +246,94 @@ class AbstractBinanceWsClient(IExchangeWsApi, AbstractAutobahnWsClient):
     def on_open(self):
         print(colored(f"WebSocket connection opened", 'green'))
 
-    def on_message(self, payload: str):
-        # The payload is documented on
-        # https://github.com/binance/binance-spot-api-docs/blob/master/web-socket-streams.md#klinecandlestick-streams
-        json_message = json.loads(payload)
-        stream_name = json_message['stream']
-        stream_data = json_message['data']
+    def create_kline_decoder(self, app_config, ticker_cache: Dict[str, TickerInfo]) -> IKlineDecoder:
+        """
+        Decoder of our kline streams, it maps stream names back to the keys of the given ticker cache
+        """
+        stream_index = {}
+        for trading_symbol, ti in ticker_cache.items():
+            stream_name = self.get_kline_stream_names([{'base': ti.ticker.base, 'quote': ti.ticker.quote}])[0]
+            stream_index[stream_name] = trading_symbol
 
-        if 'ps' in stream_data:
-            trading_symbol = stream_data['ps'].upper()
-        else:
-            trading_symbol = stream_data['s'].upper()
+        return create_kline_decoder(getattr(app_config, 'ws_decoder', 'auto'), stream_index)
 
-        candle_json = stream_data['k']
-        is_candle_closed = candle_json['x']
-        candle = Candle()
+    def create_ws_base_url(self, app_config) -> str:
+        """
+        ws_base_url of the settings if set (the simulator...), Binance otherwise
+        """
+        return (getattr(app_config, 'ws_base_url', '') or self.get_default_ws_base_url()).rstrip('/')
+
+    @abc.abstractmethod
+    def get_default_ws_base_url(self) -> str:
+        raise NotImplemented('Should be implemented by super Implementation class')
 
-        candle.open_unix = int(candle_json['t'])
-        candle.close_unix = int(candle_json['T'])
+    def get_ws_host(self) -> str:
+        return urllib.parse.urlsplit(self.ws_base_url).hostname
 
-        candle.open = float(candle_json['o'])
-        candle.close = float(candle_json['c'])
-        candle.high = float(candle_json['h'])
-        candle.low = float(candle_json['l'])
-        # in the BTC/USDT pair Base asset is BTC Quote asset is USDT
-        candle.base_asset_volume = float(candle_json['v'])
-        candle.quote_asset_volume = float(candle_json['q'])
+    def get_ws_port(self) -> int:
+        url = urllib.parse.urlsplit(self.ws_base_url)
+        return url.port or (443 if url.scheme == 'wss' else 80)
 
-        self.on_candle(trading_symbol, candle, is_candle_closed)
+    def is_ws_secure(self) -> bool:
+        return urllib.parse.urlsplit(self.ws_base_url).scheme == 'wss'
+
+    def set_recorder(self, recorder: Optional[FrameRecorder]):
+        self.recorder = recorder
+
+    def enable_metrics(self):
+        """
+        Times the decoding and processing of every message and how late it reaches us, and reports the size of
+        the candle buffers. Left disabled, messages take the shortest path.
+        """
+        self.metrics_enabled = True
+        CANDLE_BUFFER_CANDLES.set_function(
+            lambda: {trading_symbol: len(ti.candles) for trading_symbol, ti in list(self.ticker_cache.items())})
+
+    def on_message(self, payload: bytes):
+        # The payload is documented on
+        # https://github.com/binance/binance-spot-api-docs/blob/master/web-socket-streams.md#klinecandlestick-streams
+        # It is decoded straight from the bytes we are given into the fields on_kline takes
+        if self.recorder is not None:
+            self.recorder.write(payload)
+        if not self.metrics_enabled:
+            self.on_kline(*self.kline_decoder.decode(payload))
+            return
+
+        received = time.time()
+        started = time.perf_counter()
+        fields = self.kline_decoder.decode(payload)
+        decoded = time.perf_counter()
+        self.on_kline(*fields)
+        KLINE_PROCESS_SECONDS.observe(time.perf_counter() - decoded)
+        KLINE_DECODE_SECONDS.observe(decoded - started)
+        KLINE_LAG_SECONDS.observe(received - self.kline_decoder.event_unix / 1000)
 
     @abc.abstractmethod
     def on_candle(self, trading_symbol: str, candle: Candle, is_candle_closed: bool):
         raise NotImplemented('Should be implemented by super Implementation class')
 
+    @abc.abstractmethod
+    def on_kline(self, trading_symbol: str, is_candle_closed: bool, open_unix: int, close_unix: int, open_: float,
+                 high: float, low: float, close: float, base_asset_volume: float, quote_asset_volume: float):
+        raise NotImplemented('Should be implemented by super Implementation class')
+
     # noinspection PyPep8Naming
     def on_closed(self, code, reason):
-        print(colored(f'{self.ticker.base}/{self.ticker.quote} - WebSocket connection closed: {reason}', 'orange'))
+        print(colored(f'WebSocket connection closed ({code}): {reason}', 'yellow'))
 
     def build_ws_url_from_many(self, ticker_symbols: List[Dict[str, Any]]):
         stream_names = self.get_kline_stream_names(ticker_symbols)
-        return f'wss://{self.get_ws_host()}:{self.get_ws_port()}/stream?streams={"/".join(stream_names)}'
+        return f'{self.ws_base_url}/stream?streams={"/".join(stream_names)}'
+
+    def build_ws_urls_sharded(self, ticker_symbols: List[Dict[str, Any]], max_streams_per_connection: int,
+                              min_connections: int = 1) -> List[str]:
+        """
+        Splits the symbols into as few connections as possible (at least min_connections) with at most
+        max_streams_per_connection streams each, symbols are spread evenly over them
+        """
+        connections = max(min_connections, -(-len(ticker_symbols) // max_streams_per_connection))
+        connections = min(connections, max(1, len(ticker_symbols)))
+        return [self.build_ws_url_from_many(ticker_symbols[i::connections]) for i in range(connections)]
 
     @abc.abstractmethod
     def get_kline_stream_names(self, ticker_symbols: List[Dict[str, Any]]) -> List[str]:
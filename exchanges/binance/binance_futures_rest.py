@@ -3,9 +3,34 @@ from exchanges.binance import AbstractBinanceRestClient
 
 class BinanceFuturesRestClient(AbstractBinanceRestClient):
 
+    def get_market_name(self) -> str:
+        return 'binance_futures'
+
+    def get_default_base_url(self) -> str:
+        return 'https://fapi.binance.com'
+
     def get_rest_kline_url(self) -> str:
         # https://developers.binance.com/docs/binance-trading-api/futures#klinecandlestick-data
-        return 'https://fapi.binance.com/fapi/v1/klines'
+        return f'{self.base_url}/fapi/v1/klines'
 
     def get_rest_ex_info_url(self):
-        return 'https://fapi.binance.com/fapi/v1/exchangeInfo'
+        return f'{self.base_url}/fapi/v1/exchangeInfo'
+
+    def get_contract_type(self) -> str:
+        return 'PERPETUAL'
+
+    def get_default_weight_limit(self) -> int:
+        return 2400
+
+    def get_ex_info_weight(self) -> int:
+        return 1
+
+    def get_klines_weight(self, limit: int) -> int:
+        # https://binance-docs.github.io/apidocs/futures/en/#kline-candlestick-data
+        if limit < 100:
+            return 1
+        elif limit < 500:
+            return 2
+        elif limit <= 1000:
+            return 5
+        return 10
@@ -7,9 +7,15 @@ from exchanges.binance import AbstractBinanceRestClient
 
 class BinanceSpotRestClient(AbstractBinanceRestClient):
 
+    def get_market_name(self) -> str:
+        return 'binance_spot'
+
+    def get_default_base_url(self) -> str:
+        return 'https://api.binance.com'
+
     def get_rest_kline_url(self) -> str:
-        return 'https://api.binance.com/api/v3/klines'
+        return f'{self.base_url}/api/v3/klines'
 
     def get_rest_ex_info_url(self):
         # https://github.com/binance/binance-spot-api-docs/blob/master/rest-api.md#exchange-information
-        return 'https://binance.com/api/v3/exchangeInfo'
+        return f'{self.base_url}/api/v3/exchangeInfo'
@@ -1,5 +1,6 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
+from alerts.dispatcher import IAlertSink
 from core import config
 from core.models import Candle, TickerInfo
 from exchanges import BaseKLineProcessor
@@ -8,7 +9,8 @@ from exchanges.binance import AbstractBinanceWsClient
 
 class BinanceSpotWsApi(AbstractBinanceWsClient, BaseKLineProcessor):
 
-    def __init__(self, app_config: config.AppConfig, tickers: List[TickerInfo], timeframe: str):
+    def __init__(self, app_config: config.AppConfig, tickers: List[TickerInfo], timeframe: str,
+                 alert_sink: Optional[IAlertSink] = None):
         # We need to call super's constructor to initialize websocket framework's variables if we
         # are extending a framework's class, since we are using autobahn here and extending indirectly
         # WebSocketClientProtocol we need to call its constructor so it initializes its variables like self.is_closed
@@ -18,12 +20,19 @@ class BinanceSpotWsApi(AbstractBinanceWsClient, BaseKLineProcessor):
         # super().__init__()
 
         # Then we also need to call BaseProcessor 's constructor
-        BaseKLineProcessor.__init__(self, app_config, tickers, timeframe)
+        BaseKLineProcessor.__init__(self, app_config, tickers, timeframe, alert_sink)
+        self.kline_decoder = self.create_kline_decoder(app_config, self.ticker_cache)
+        self.ws_base_url = self.create_ws_base_url(app_config)
 
     def on_candle(self, trading_symbol: str, candle: Candle, is_candle_closed: bool):
         # super(BinanceFuturesWsClient, self).on_candle(trading_symbol, candle, is_candle_closed)
         BaseKLineProcessor.on_candle(self, trading_symbol, candle, is_candle_closed)
 
+    def on_kline(self, trading_symbol: str, is_candle_closed: bool, open_unix: int, close_unix: int, open_: float,
+                 high: float, low: float, close: float, base_asset_volume: float, quote_asset_volume: float):
+        BaseKLineProcessor.on_kline(self, trading_symbol, is_candle_closed, open_unix, close_unix, open_, high, low,
+                                    close, base_asset_volume, quote_asset_volume)
+
     def get_kline_stream_names(self, ticker_symbols: List[Dict[str, Any]]) -> List[str]:
         stream_names = []
         for t in ticker_symbols:
@@ -35,10 +44,7 @@ class BinanceSpotWsApi(AbstractBinanceWsClient, BaseKLineProcessor):
         # we must pass the trading pair in lowercase otherwise it connects to the server successfully
         # but it hangs forever
         # https://binance-docs.github.io/apidocs/spot/en/#websocket-market-streams
-        return f"wss://stream.binance.com:9443/ws/{base.lower()}{quote.lower()}@kline_{timeframe}"
-
-    def get_ws_host(self) -> str:
-        return "stream.binance.com"
+        return f"{self.ws_base_url}/ws/{base.lower()}{quote.lower()}@kline_{timeframe}"
 
-    def get_ws_port(self) -> int:
-        return 9443
+    def get_default_ws_base_url(self) -> str:
+        return 'wss://stream.binance.com:9443'
@@ -0,0 +1,85 @@
+"""
+Decoders of the kline messages received from Binance's combined streams, documented on
+https://github.com/binance/binance-spot-api-docs/blob/master/web-socket-streams.md#klinecandlestick-streams
+
+Decoders work on the raw bytes given by the websocket framework and return the fields BaseKLineProcessor.on_kline
+takes, as a tuple, without building any intermediate object.
+"""
+import abc
+import json
+from typing import Dict, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# trading symbol, is candle closed, open time, close time, open, high, low, close, base volume, quote volume
+KlineFields = Tuple[str, bool, int, int, float, float, float, float, float, float]
+
+
+class IKlineDecoder(abc.ABC):
+    # stream name (btcusdt@kline_1m) -> trading symbol (BTCUSDT), the very same str objects used as keys of
+    # BaseKLineProcessor.ticker_cache, so looking them up there only compares pointers
+    stream_index: Dict[str, str]
+    # Time in ms Binance sent the last message decoded ('E' field), to measure how late messages reach us
+    event_unix: int = 0
+
+    def __init__(self, stream_index: Dict[str, str]):
+        self.stream_index = stream_index
+
+    @abc.abstractmethod
+    def decode(self, payload: bytes) -> Optional[KlineFields]:
+        raise NotImplemented('Should be implemented by super Implementation class')
+
+
+class JsonKlineDecoder(IKlineDecoder):
+    """
+    Standard library json, always available
+    """
+
+    @staticmethod
+    def loads(payload: bytes):
+        return json.loads(payload)
+
+    def decode(self, payload: bytes) -> Optional[KlineFields]:
+        message = self.loads(payload)
+        stream_data = message['data']
+        self.event_unix = stream_data['E']
+
+        trading_symbol = self.stream_index.get(message['stream'])
+        if trading_symbol is None:
+            # A stream we did not subscribe to by this name, fall back to the symbol in the payload
+            trading_symbol = stream_data['ps'].upper() if 'ps' in stream_data else stream_data['s'].upper()
+
+        k = stream_data['k']
+        # in the BTC/USDT pair Base asset is BTC Quote asset is USDT
+        return (trading_symbol, k['x'], k['t'], k['T'], float(k['o']), float(k['h']), float(k['l']),
+                float(k['c']), float(k['v']), float(k['q']))
+
+
+class OrjsonKlineDecoder(JsonKlineDecoder):
+    """
+    orjson (optional dependency), several times faster than json parsing bytes
+    """
+
+    @staticmethod
+    def loads(payload: bytes):
+        return orjson.loads(payload)
+
+
+def create_kline_decoder(name: str, stream_index: Dict[str, str]) -> IKlineDecoder:
+    """
+    :param name: 'json', 'orjson' or 'auto' (orjson if it is installed, json otherwise)
+    :param stream_index: stream name -> trading symbol
+    """
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'json'
+
+    if name == 'json':
+        return JsonKlineDecoder(stream_index)
+    elif name == 'orjson':
+        if orjson is None:
+            raise ValueError('ws_decoder is orjson but orjson is not installed, pip install orjson')
+        return OrjsonKlineDecoder(stream_index)
+    raise ValueError(f'unknown kline decoder {name}')
@@ -0,0 +1,107 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from termcolor import colored
+
+from exchanges import IExchangeRest
+
+
+class GapFiller:
+    """
+    Fetches from the REST API candles missing in the stream (after a reconnection, a dropped frame...).
+
+    Requests run on a small pool of threads through the REST client (so they are bound by its rate limiter),
+    results are handed back on the event loop thread, the only one allowed to touch the candle buffers.
+    At most max_candles candles are requested per gap and one request per symbol is in flight at a time, gaps
+    found meanwhile are queued (merged into a single range) and fetched right after, on_filled gets the candles
+    of all of them at once.
+    """
+    timeframe: str
+    max_candles: int
+    retries: int
+    retry_delay: float
+    # symbols with a request in flight
+    _pending: Set[str]
+    # symbol -> (start_time, end_time, interval) to fetch once the request in flight is done
+    _queued: Dict[str, Tuple[int, int, int]]
+    # symbol -> candles fetched so far, while queued ranges are still to be fetched
+    _fetched: Dict[str, List[Dict[str, np.ndarray]]]
+
+    def __init__(self, rest_client: IExchangeRest, timeframe: str, loop: asyncio.AbstractEventLoop,
+                 on_filled: Callable[[str, Dict[str, np.ndarray]], None],
+                 on_failed: Callable[[str], None],
+                 max_workers: int = 2, max_candles: int = 1500, retries: int = 3, retry_delay: float = 5):
+        self.rest_client = rest_client
+        self.timeframe = timeframe
+        self.loop = loop
+        self.on_filled = on_filled
+        self.on_failed = on_failed
+        self.max_candles = max_candles
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._pending = set()
+        self._queued = {}
+        self._fetched = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='gap-filler')
+
+    def request(self, trading_symbol: str, start_time: int, end_time: int, interval: int) -> bool:
+        """
+        Schedules the download of the candles opened in [start_time, end_time], only the newest max_candles
+        :return: False if a request for this symbol is already in flight, the range is then fetched after it
+        """
+        if trading_symbol in self._pending:
+            queued = self._queued.get(trading_symbol)
+            if queued is not None:
+                start_time, end_time = min(start_time, queued[0]), max(end_time, queued[1])
+            self._queued[trading_symbol] = (start_time, end_time, interval)
+            return False
+
+        self._pending.add(trading_symbol)
+        self._submit(trading_symbol, start_time, end_time, interval)
+        return True
+
+    def _submit(self, trading_symbol: str, start_time: int, end_time: int, interval: int):
+        start_time = max(start_time, end_time - (self.max_candles - 1) * interval)
+        limit = (end_time - start_time) // interval + 1
+        self._executor.submit(self._fetch, trading_symbol, start_time, end_time, limit)
+        return True
+
+    def _fetch(self, trading_symbol: str, start_time: int, end_time: int, limit: int):
+        columns: Optional[Dict[str, np.ndarray]] = None
+        for attempt in range(self.retries):
+            try:
+                columns = self.rest_client.fetch_klines(trading_symbol, self.timeframe, limit,
+                                                        start_time=start_time, end_time=end_time)
+                break
+            except Exception as exc:
+                print(colored(f'Could not backfill {trading_symbol} (attempt {attempt + 1}/{self.retries}) - {exc}',
+                              'red'))
+                if attempt < self.retries - 1:
+                    time.sleep(self.retry_delay)
+
+        self.loop.call_soon_threadsafe(self._done, trading_symbol, columns)
+
+    def _done(self, trading_symbol: str, columns: Optional[Dict[str, np.ndarray]]):
+        fetched = self._fetched.setdefault(trading_symbol, [])
+        if columns is not None:
+            fetched.append(columns)
+
+        queued = self._queued.pop(trading_symbol, None)
+        if queued is not None:
+            self._submit(trading_symbol, *queued)
+            return
+
+        self._pending.discard(trading_symbol)
+        del self._fetched[trading_symbol]
+        if not fetched:
+            self.on_failed(trading_symbol)
+        elif len(fetched) == 1:
+            self.on_filled(trading_symbol, fetched[0])
+        else:
+            self.on_filled(trading_symbol, {name: np.concatenate([f[name] for f in fetched]) for name in fetched[0]})
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
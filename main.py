@@ -1,23 +1,32 @@
+# First, so the startup report accounts for the imports
+from core.startup import STARTUP
+
 import argparse
 import asyncio
+import multiprocessing
 import os
 import time
-from typing import List
+from typing import List, Optional
 
-import binance
 import colorama
-from autobahn.asyncio.websocket import WebSocketClientFactory
 from dotenv import load_dotenv
 from termcolor import colored
 
+from alerts.dispatcher import AlertDispatcher, AlertQueueListener, IAlertSink, QueueAlertSink
 from core import config
+from core.metrics import MetricsServer
 from core.models import TickerInfo, Ticker
-from exchanges import IExchangeRest
+from exchanges import IExchangeRest, BaseKLineProcessor
+from exchanges.backfill import CandleBackfiller
+from exchanges.gap_filler import GapFiller
 from exchanges.binance.binance_futures_rest import BinanceFuturesRestClient
 from exchanges.binance.binance_futures_ws import BinanceFuturesWsClient
 from exchanges.binance.binance_spot_rest import BinanceSpotRestClient
 from exchanges.binance.binance_spot_ws import BinanceSpotWsApi
-from utils.math_utils import precision_from_string
+from storage.candle_cache import CandleCache
+from storage.exchange_info_cache import ExchangeInfoCache
+from storage.frame_recorder import FrameRecorder
+from ws_facades.autobahn_manager import AutobahnConnectionManager
 
 # Make ANSI colors work on Windows
 # https://stackoverflow.com/questions/287871/how-do-i-print-colored-text-to-the-terminal
@@ -25,126 +34,276 @@ from utils.math_utils import precision_from_string
 colorama.init(autoreset=True)
 
 
-# noinspection PyShadowingNames
-def run(args: argparse.Namespace):
-    timeframe = binance.Client.KLINE_INTERVAL_1MINUTE  # '1m'
-    # https://stackoverflow.com/questions/73361664/asyncio-get-event-loop-deprecationwarning-there-is-no-current-event-loop
-    # loop = asyncio.get_event_loop() -> DeprecationWarning
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+def schedule_candle_cache_flush(loop: asyncio.AbstractEventLoop, candle_cache: CandleCache,
+                                processor: BaseKLineProcessor, timeframe: str, interval: float):
+    """
+    Stores the closed candles every interval seconds, on the event loop as it is the only one writing to the buffers
+    """
+    def flush():
+        candle_cache.flush(processor.ticker_cache, timeframe)
+        loop.call_later(interval, flush)
+
+    loop.call_later(interval, flush)
+
+
+def start_metrics_server(app_config: config.AppConfig, port_offset: int = 0) -> Optional[MetricsServer]:
+    """
+    Serves the metrics of this process if metrics_port is set, worker processes serve theirs on the ports after it
+    """
+    port = getattr(app_config, 'metrics_port', 0)
+    if not port:
+        return None
+    server = MetricsServer(port + port_offset, getattr(app_config, 'metrics_host', '127.0.0.1')).start()
+    print(colored(f'Metrics served on {server.url}', 'cyan'))
+    return server
+
+
+def load_tickers(app_config: config.AppConfig, ex_rest_client: IExchangeRest) -> List[TickerInfo]:
+    """
+    Resolves the symbols to monitor through the index of the exchange's markets
+    """
+    # exchangeInfo is only downloaded again once the cached copy expires
+    market_cache = None
+    cache_dir = getattr(app_config, 'candle_cache_dir', './cache')
+    if cache_dir:
+        market_cache = ExchangeInfoCache(cache_dir, ex_rest_client.get_market_name(),
+                                         ttl=getattr(app_config, 'exchange_info_ttl_secs', 60 * 60))
+    markets = ex_rest_client.load_market_index(market_cache)
+    contract_type = ex_rest_client.get_contract_type()
+
+    if app_config.monitor_all_pairs:
+        found = markets.tickers(contract_type)
+    else:
+        trading_symbols = config.futures_trading_symbols
+        found = []
+        not_found = []
+        for t in trading_symbols:
+            ticker = markets.get(t['base'], t['quote'], contract_type)
+            if ticker is None:
+                not_found.append(f'{t["base"]}{t["quote"]}')
+            else:
+                found.append(ticker)
 
-    app_config = config.AppConfig()
-    config.out_dir = os.path.abspath('./output/')
+        if len(not_found) > 0:
+            raise ValueError(f'Could not find The following trading pairs: {not_found}')
+
+    print(f'Loading candles for {len(found)} pairs')
 
-    ex_rest_client: IExchangeRest
-    # ex_rest_client = BinanceSpotRestClient()
-    ex_rest_client = BinanceFuturesRestClient()
-    markets = ex_rest_client.load_markets()
-    trading_symbols = config.futures_trading_symbols
     tickers: List[TickerInfo]
     tickers = []
-
-    to_be_found_pairs = set([f'{t["base"]}{t["quote"]}' for t in trading_symbols])
-
-    print(f'Loading candles for {len(to_be_found_pairs)} pairs')
-
-    for i, s in enumerate(markets['symbols']):
-        if 'contractType' in s:
-            if s['contractType'] != 'PERPETUAL':
-                continue
-
-        subscribe_to = False
-        if app_config.monitor_all_pairs:
-            subscribe_to = True
-        else:
-            if len(to_be_found_pairs) == 0:
-                # Done. We found all symbols we were looking for
-                break
-
-            for t in trading_symbols:
-                if t['base'] == s['baseAsset'] and t['quote'] == s['quoteAsset']:
-                    subscribe_to = True
-                    to_be_found_pairs.remove(f'{t["base"]}{t["quote"]}')
-                    break
-
-        if not subscribe_to:
-            continue
-
+    for ticker in found:
         ticker_info = TickerInfo()
-        ticker = Ticker()
-        ticker.base = s['baseAsset'].upper()
-        ticker.quote = s['quoteAsset'].upper()
-        filters = s['filters']
+        ticker_info.ticker = ticker
+        tickers.append(ticker_info)
 
-        # getting the price and quantity precisions for this specific ticker
+    return tickers
 
-        # I don't know why quoteAssetPrecision does not use to have the right price_precision
-        # despite its name, so I am just using it as fallback, I will always get price_precision
-        # from the PRICE_FILTER filter
-        # same goes for baseAssetPrecision
-        ticker.price_precision = getattr(s, 'quoteAssetPrecision', -1)
-        ticker.quantity_precision = getattr(s, 'baseAssetPrecision', -1)
 
-        for f in filters:
-            if 'LOT_SIZE' == f['filterType']:
-                ticker.quantity_precision = precision_from_string(f['stepSize'])
-            if 'PRICE_FILTER' == f['filterType']:
-                ticker.price_precision = precision_from_string(f['tickSize'])
+def run_processor(app_config: config.AppConfig, ex_rest_client: IExchangeRest, tickers: List[TickerInfo],
+                  timeframe: str, alert_sink: Optional[IAlertSink] = None, metrics_port_offset: int = 0):
+    """
+    Loads the candles of the given tickers and processes their streams until interrupted.
+    Without an alert sink, alerts are rendered and sent by this process.
+    """
+    # https://stackoverflow.com/questions/73361664/asyncio-get-event-loop-deprecationwarning-there-is-no-current-event-loop
+    # loop = asyncio.get_event_loop() -> DeprecationWarning
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
 
-            if ticker.price_precision != -1 and ticker.quantity_precision != -1:
-                break
+    # Candles already stored on disk are reused, only the ones we missed while down are downloaded
+    candle_cache = None
+    candle_cache_dir = getattr(app_config, 'candle_cache_dir', './cache')
+    if candle_cache_dir:
+        candle_cache = CandleCache(candle_cache_dir, ex_rest_client.get_market_name())
+
+    # Requests go out concurrently, as fast as Binance's request weight limit allows
+    backfiller = CandleBackfiller(ex_rest_client, timeframe,
+                                  candle_buffer_len=getattr(app_config, 'candles_buffer_len', 500),
+                                  max_workers=getattr(app_config, 'backfill_workers', 8),
+                                  cache=candle_cache)
+    candles = backfiller.load([f'{t.ticker.base}{t.ticker.quote}' for t in tickers],
+                              on_loaded=lambda symbol, _: print(f'Loaded candles for {symbol}'))
+    for ticker_info in tickers:
+        ticker_info.candles = candles[f'{ticker_info.ticker.base}{ticker_info.ticker.quote}']
+    STARTUP.mark('backfill')
+
+    ex_ws_client = BinanceFuturesWsClient(app_config, tickers, timeframe, alert_sink)
+    # ex_ws_client = BinanceSpotWsApi(app_config, tickers, timeframe, alert_sink)
+    STARTUP.mark('processor')
+
+    # Candles missing in the stream are fetched from the REST API
+    gap_filler = GapFiller(ex_rest_client, timeframe, loop, ex_ws_client.on_gap_filled, ex_ws_client.on_gap_failed,
+                           max_candles=getattr(app_config, 'candles_buffer_len', 500))
+    ex_ws_client.set_gap_filler(gap_filler)
+
+    # Subscribe to what we actually loaded, with monitor_all_pairs it is more than trading_symbols
+    subscribed_symbols = [{'base': t.ticker.base, 'quote': t.ticker.quote} for t in tickers]
+    endpoints = ex_ws_client.build_ws_urls_sharded(
+        subscribed_symbols,
+        max_streams_per_connection=getattr(app_config, 'ws_max_streams_per_connection', 200),
+        min_connections=getattr(app_config, 'ws_connections', 1))
+    print(f'Subscribing to {len(subscribed_symbols)} streams over {len(endpoints)} connections')
+
+    # Raw frames recorded to be replayed later with replay.py
+    recorder = None
+    record_dir = getattr(app_config, 'record_dir', '')
+    if record_dir:
+        recorder = FrameRecorder(record_dir, ex_rest_client.get_market_name(), subscribed_symbols,
+                                 chunk_secs=getattr(app_config, 'record_chunk_secs', 60 * 60))
+        ex_ws_client.set_recorder(recorder)
+
+    def on_first_message():
+        print(colored(f'{STARTUP.finish("first message")} (pid {os.getpid()})', 'cyan'))
+        # The streams are up, the plotting framework can load without delaying them
+        ex_ws_client.alert_sink.warm_up()
+
+    # Each connection of the manager forwards its messages to ex_ws_client, which is the one processing them
+    ws_manager = AutobahnConnectionManager(
+        loop, ex_ws_client, endpoints, ex_ws_client.get_ws_host(), ex_ws_client.get_ws_port(),
+        ssl=ex_ws_client.is_ws_secure(),
+        rotate_after=getattr(app_config, 'ws_rotate_after_secs', 23 * 60 * 60),
+        stall_timeout=getattr(app_config, 'ws_stall_timeout_secs', 30),
+        on_first_message=on_first_message)
+    ws_manager.start()
+
+    metrics_server = start_metrics_server(app_config, metrics_port_offset)
+    if metrics_server is not None:
+        ex_ws_client.enable_metrics()
+
+    if candle_cache is not None:
+        schedule_candle_cache_flush(loop, candle_cache, ex_ws_client, timeframe,
+                                    getattr(app_config, 'candle_cache_flush_secs', 60))
+
+    try:
+        loop.run_forever()
+    finally:
+        ws_manager.close()
+        gap_filler.close()
+        if metrics_server is not None:
+            metrics_server.close()
+        if recorder is not None:
+            recorder.close()
+        if candle_cache is not None:
+            candle_cache.flush(ex_ws_client.ticker_cache, timeframe)
+        if alert_sink is None:
+            ex_ws_client.alert_sink.close()
+        loop.close()
+
+
+def run_worker(worker_id: int, app_config: config.AppConfig, tickers: List[Ticker], timeframe: str,
+               alert_queue: multiprocessing.Queue, workers: int):
+    """
+    Entry point of a worker process, it owns the websocket connections, candle buffers and detection of its share
+    of the symbols, its alerts are sent to the supervisor
+    """
+    STARTUP.mark('imports')
+    ex_rest_client = BinanceFuturesRestClient(base_url=getattr(app_config, 'rest_base_url', '') or None)
+    # The request weight limit is per IP, it is split among the workers
+    ex_rest_client.rate_limiter.set_share(1 / workers)
+
+    ticker_infos = []
+    for ticker in tickers:
+        ticker_info = TickerInfo()
+        ticker_info.ticker = ticker
+        ticker_infos.append(ticker_info)
+
+    print(colored(f'Worker {worker_id} (pid {os.getpid()}) processing {len(tickers)} symbols', 'cyan'))
+    try:
+        run_processor(app_config, ex_rest_client, ticker_infos, timeframe,
+                      QueueAlertSink(alert_queue, f'Worker {worker_id}'), metrics_port_offset=1 + worker_id)
+    except KeyboardInterrupt:
+        pass
+
+
+def run_supervisor(app_config: config.AppConfig, ex_rest_client: IExchangeRest, tickers: List[TickerInfo],
+                   timeframe: str, workers: int):
+    """
+    Splits the symbols among worker processes, each one processing its share independently, so throughput
+    scales with the cores. This process renders and sends the alerts detected by all of them, and restarts
+    the workers that die.
+    """
+    # Spread evenly, the same way streams are spread over connections
+    workers = min(workers, len(tickers))
+    partitions = [[t.ticker for t in tickers[i::workers]] for i in range(workers)]
+
+    ctx = multiprocessing.get_context('spawn')
+    alert_queue = ctx.Queue(maxsize=getattr(app_config, 'alert_ipc_queue_size', 1000))
+    dispatcher = AlertDispatcher(app_config)
+    listener = AlertQueueListener(alert_queue, dispatcher)
+    listener.start()
+    metrics_server = start_metrics_server(app_config)
+
+    def start_worker(worker_id: int) -> multiprocessing.Process:
+        process = ctx.Process(target=run_worker, name=f'worker-{worker_id}',
+                              args=(worker_id, app_config, partitions[worker_id], timeframe, alert_queue,
+                                    workers))
+        process.start()
+        return process
+
+    print(f'Processing {len(tickers)} symbols over {workers} worker processes')
+    processes = [start_worker(i) for i in range(workers)]
+    # Workers report their own startup, up to their first message
+    print(colored(STARTUP.finish('workers started'), 'cyan'))
+    dispatcher.warm_up()
+    started_at = [time.monotonic()] * workers
+    restarts = [0] * workers
+    restart_at: List[Optional[float]] = [None] * workers
+
+    try:
+        while True:
+            time.sleep(1)
+            now = time.monotonic()
+            for i, process in enumerate(processes):
+                if restart_at[i] is not None:
+                    if now >= restart_at[i]:
+                        restart_at[i] = None
+                        processes[i] = start_worker(i)
+                        started_at[i] = now
+                    continue
+
+                if process.is_alive():
+                    continue
+
+                # A worker that ran for a while before dying is not crash looping, start over the backoff
+                if now - started_at[i] > 300:
+                    restarts[i] = 0
+                delay = min(60, 2 ** restarts[i])
+                restarts[i] += 1
+                restart_at[i] = now + delay
+                print(colored(f'{process.name} exited with code {process.exitcode}, '
+                              f'restarting it in {delay}s', 'red'))
+    finally:
+        # Workers receive the interrupt as well, give them time to stop cleanly
+        for process in processes:
+            process.join(10)
+            if process.is_alive():
+                process.terminate()
+        listener.close(10)
+        dispatcher.close()
+        if metrics_server is not None:
+            metrics_server.close()
 
-        if ticker.price_precision == -1:
-            ticker.price_precision = 2
 
-        if ticker.quantity_precision == -1:
-            ticker.quantity_precision = 2
+# noinspection PyShadowingNames
+def run(args: argparse.Namespace):
+    STARTUP.mark('imports')
+    timeframe = '1m'
 
-        ticker_info.ticker = ticker
+    app_config = config.AppConfig()
+    config.out_dir = os.path.abspath('./output/')
 
-        while True:
-            try:
-                ticker_info.candles = ex_rest_client.load_candles(f'{ticker.base}{ticker.quote}',
-                                                                  binance.Client.KLINE_INTERVAL_1MINUTE,
-                                                                  getattr(app_config, 'candles_buffer_len', 500))
-                tickers.append(ticker_info)
-                break
-            except Exception as exc:
-                print(colored(
-                    f'An error occurred loading candles for {ticker.base}/{ticker.quote}, retrying in 5seconds. '
-                    f'Error Details: {exc}', 'red'))
-                time.sleep(5)
-
-        if (app_config.monitor_all_pairs and len(markets['symbols']) > 1 and i < len(markets['symbols'])) or \
-                (len(trading_symbols) > 1 and i < len(trading_symbols) - 1):
-            # sleep 0.75 for each trading pair so we don't get rate limited by Binance's API
-            # in the last loop iteration we don't need to sleep as we won't use the API anyway
-
-            print(f'Loaded candles for {ticker.base}/{ticker.quote}')
-            time.sleep(0.75)
-
-    if not app_config.monitor_all_pairs and len(to_be_found_pairs) > 0:
-        raise ValueError(f'Could not find The following trading pairs: {to_be_found_pairs}')
-    markets.clear()
-
-    ex_ws_client = BinanceFuturesWsClient(app_config, tickers, timeframe)
-    # ex_ws_client = BinanceSpotWsApi(app_config, tickers, timeframe)
-
-    endpoint = ex_ws_client.build_ws_url_from_many(trading_symbols)
-    factory = WebSocketClientFactory(endpoint)
-    # protocol field must be a callable object
-    # since we don't want to provide the class as protocol field
-    # because it would create one object of such class but without giving us
-    # the opportunity to pass arguments, then we create an object ourselves, passing all
-    # arguments we want, and implementing the __call__ so when it is called by autobahn
-    # framework, we return the instance we already created
-
-    factory.protocol = ex_ws_client
-    coro = loop.create_connection(factory, ex_ws_client.get_ws_host(), ex_ws_client.get_ws_port(), ssl=True)
-    loop.run_until_complete(coro)
-
-    loop.run_forever()
-    loop.close()
+    ex_rest_client: IExchangeRest
+    rest_base_url = getattr(app_config, 'rest_base_url', '') or None
+    # ex_rest_client = BinanceSpotRestClient(base_url=rest_base_url)
+    ex_rest_client = BinanceFuturesRestClient(base_url=rest_base_url)
+    tickers = load_tickers(app_config, ex_rest_client)
+    STARTUP.mark('market index')
+
+    workers = getattr(app_config, 'worker_processes', 1)
+    if workers > 1:
+        run_supervisor(app_config, ex_rest_client, tickers, timeframe, workers)
+    else:
+        run_processor(app_config, ex_rest_client, tickers, timeframe)
 
 
 if __name__ == '__main__':
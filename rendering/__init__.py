@@ -0,0 +1,46 @@
+"""
+Chart rendering. Renderers only get plain OHLCV arrays in and give image bytes out, they know nothing
+about exchanges or tickers, that way they can run in other processes (see rendering.service).
+"""
+from typing import Dict, NamedTuple
+
+import numpy as np
+
+
+class RenderRequest(NamedTuple):
+    # 'plotly', 'matplotlib' or 'native'
+    framework: str
+    base: str
+    quote: str
+    # CandleRingBuffer columns (a snapshot) with, at least, open_unix, open, high, low, close and base_asset_volume
+    candles: Dict[str, np.ndarray]
+    # timeframe in minutes to plot the chart in
+    timeframe_plot: int = 1
+    up_color: str = '#26a69a'
+    down_color: str = '#ef5350'
+    width: int = 1080
+    height: int = 720
+
+
+class RenderResult(NamedTuple):
+    image: bytes
+    # Seconds spent rendering, measured in the process that rendered the chart
+    elapsed: float
+    pid: int
+
+
+def render(request: RenderRequest) -> bytes:
+    """
+    Renders the request with the framework it asks for, importing it on first use
+    """
+    if request.framework == 'matplotlib':
+        from rendering.matplotlib_renderer import render_matplotlib
+        return render_matplotlib(request)
+    elif request.framework == 'plotly':
+        from rendering.plotly_renderer import render_plotly
+        return render_plotly(request)
+    elif request.framework == 'native':
+        from rendering.native_renderer import render_native
+        return render_native(request)
+    else:
+        raise OSError(f'unknown value {request.framework}')
@@ -0,0 +1,65 @@
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+
+def resample_ohlcv(columns: Dict[str, np.ndarray], minutes: int) -> Dict[str, np.ndarray]:
+    """
+    Aggregates 1min OHLCV columns into `minutes` candles in a single vectorized pass.
+    Buckets are aligned to the epoch (so 5min candles go from 10:00 to 10:05, not from 10:01 to 10:06),
+    empty buckets are skipped rather than filled with NaN.
+    :param columns: dictionary with open_unix, open, high, low, close and volume columns, ordered by open_unix
+    :param minutes: the resulting timeframe in minutes
+    :return: a dictionary with the same keys as columns
+    """
+    bucket = columns['open_unix'] // (minutes * 60_000)
+    if len(bucket) == 0:
+        return columns
+
+    # Index of the first candle of each bucket, then the last one is the one right before the next bucket
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket)) + 1))
+    ends = np.append(starts[1:], len(bucket)) - 1
+
+    return {
+        'open_unix': bucket[starts] * minutes * 60_000,
+        'open': columns['open'][starts],  # The Open value to keep is the first Opening value for the aggregate
+        'high': np.maximum.reduceat(columns['high'], starts),  # The High value to keep is the Max/highest
+        'low': np.minimum.reduceat(columns['low'], starts),  # The Low value to keep is the low/min
+        'close': columns['close'][ends],  # The Close value to keep is the latest Close price in the aggregate
+        'volume': np.add.reduceat(columns['volume'], starts),  # The Volume to keep is the sum of volumes
+    }
+
+
+def ohlcv_columns(candles: Dict[str, np.ndarray], timeframe_plot: int = 1) -> Dict[str, np.ndarray]:
+    """
+    Picks the columns to plot out of CandleRingBuffer columns (either views or a snapshot),
+    resampled to timeframe_plot minutes
+    """
+    columns = {
+        'open_unix': candles['open_unix'],
+        'open': candles['open'],
+        'high': candles['high'],
+        'low': candles['low'],
+        'close': candles['close'],
+        'volume': candles['base_asset_volume'],
+    }
+
+    # Resample the data. For example we fetch the data in 1min, but we need to plot it in 5min
+    if timeframe_plot > 1:
+        columns = resample_ohlcv(columns, timeframe_plot)
+    return columns
+
+
+def build_ohlcv_frame(candles: Dict[str, np.ndarray], timeframe_plot: int = 1) -> pd.DataFrame:
+    """
+    Builds the DataFrame to plot, indexed by date, in one go out of CandleRingBuffer columns
+    instead of appending rows one by one.
+    """
+    columns = ohlcv_columns(candles, timeframe_plot)
+
+    # https://stackoverflow.com/questions/19231871/convert-unix-time-to-readable-date-in-pandas-dataframe
+    # if unix is in nanoseconds then unit='ns' but we know from documentation that Binance API issues
+    # dates as Unix timestamps with ms precision and not nanosecond precision.
+    index = pd.DatetimeIndex(pd.to_datetime(columns.pop('open_unix'), unit='ms'), name='date')
+    return pd.DataFrame(columns, index=index, columns=['open', 'high', 'low', 'close', 'volume'])
@@ -0,0 +1,198 @@
+import collections
+import datetime
+import io
+import threading
+from typing import Dict, Optional, OrderedDict, Tuple
+
+import matplotlib.ticker as mticker
+import mplfinance as mpf
+import numpy as np
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.colors import to_rgba
+from matplotlib.figure import Figure
+
+from rendering import RenderRequest
+from rendering.frames import build_ohlcv_frame, ohlcv_columns
+
+# Of the cached charts, as a share of the space given to a candle
+BODY_WIDTH = 0.6
+VOLUME_WIDTH = 0.8
+WICK_LINE_WIDTH = 0.7
+
+
+def render_matplotlib(request: RenderRequest) -> bytes:
+    if FIGURE_CACHE is not None:
+        return FIGURE_CACHE.render(request)
+
+    df_ohlcv = build_ohlcv_frame(request.candles, request.timeframe_plot)
+
+    fig, ax1, ax2 = new_figure()
+    # https://stackoverflow.com/questions/63918394/how-can-i-change-the-formatting-of-the-mplfinance-volume-on-the-chart
+    mpf.plot(df_ohlcv, type='candle', style='binance',
+             volume=ax2,
+             ax=ax1)
+
+    fig.suptitle(f'{request.base}/{request.quote}')
+    fig.autofmt_xdate()
+    return save(fig)
+
+
+def new_figure() -> Tuple[Figure, object, object]:
+    # Charts may be rendered from several threads, pyplot keeps global state and is not thread safe,
+    # so a standalone Figure is used instead
+    fig = Figure()
+    fig.set_size_inches(11.25, 7.5)
+    ax1, ax2 = fig.subplots(nrows=2, gridspec_kw=dict(height_ratios=[3, 1]))
+    # Make sure the Volume plot shows zeros rather than 10 to the power, for example: 1000000 rather than 10^6
+    ax2.yaxis.set_major_formatter(mticker.FormatStrFormatter('%d'))
+    return fig, ax1, ax2
+
+
+def save(fig: Figure) -> bytes:
+    # export plot to jpg, from there get the bytes array
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='jpg')
+    buffer.seek(0)
+    return buffer.read()
+
+
+class CachedChart:
+    """
+    Figure of a symbol kept between alerts: it is laid out and styled once, the next alerts only replace the data
+    of its candle and volume artists and the axis limits, which skips building the figure, mplfinance's work and
+    the DataFrame.
+    """
+
+    def __init__(self, title: str):
+        self.lock = threading.Lock()
+        self.fig, self.ax1, self.ax2 = new_figure()
+        self.open_unix = np.empty(0, dtype=np.int64)
+
+        # mplfinance styles the axes, then its artists are replaced by collections whose data can be updated
+        self.style = mpf.make_mpf_style(base_mpf_style='binance')
+        placeholder = {k: np.ones(2) for k in ('open', 'high', 'low', 'close', 'base_asset_volume')}
+        placeholder['open_unix'] = np.array([0, 60_000], dtype=np.int64)
+        mpf.plot(build_ohlcv_frame(placeholder), type='candle', style=self.style, volume=self.ax2, ax=self.ax1)
+        for artist in list(self.ax1.collections) + list(self.ax2.patches):
+            artist.remove()
+        self.ax2.containers.clear()
+
+        alpha = self.style['marketcolors']['alpha']
+        self.wicks = LineCollection([], linewidths=WICK_LINE_WIDTH)
+        self.bodies = PolyCollection([], linewidths=WICK_LINE_WIDTH, alpha=alpha)
+        self.volumes = PolyCollection([], linewidths=0, alpha=alpha)
+        self.ax1.add_collection(self.wicks)
+        self.ax1.add_collection(self.bodies)
+        self.ax2.add_collection(self.volumes)
+
+        for ax in (self.ax1, self.ax2):
+            ax.xaxis.set_major_locator(mticker.MaxNLocator(nbins=8, integer=True))
+            ax.xaxis.set_major_formatter(mticker.FuncFormatter(self.format_date))
+        # What fig.autofmt_xdate() does, but kept by the ticks created on later updates
+        self.ax1.tick_params(axis='x', labelbottom=False)
+        self.ax2.tick_params(axis='x', labelrotation=30)
+        self.fig.subplots_adjust(bottom=0.2)
+        self.fig.suptitle(title)
+
+    def format_date(self, x: float, _pos=None) -> str:
+        i = int(round(x))
+        if i < 0 or i >= len(self.open_unix):
+            return ''
+        at = datetime.datetime.fromtimestamp(int(self.open_unix[i]) / 1000, datetime.timezone.utc)
+        # Same formats as mplfinance, time only for charts of less than a day
+        span = self.open_unix[-1] - self.open_unix[0]
+        return at.strftime('%H:%M' if span < 24 * 60 * 60 * 1000 else '%b %d, %H:%M')
+
+    def update(self, columns: Dict[str, np.ndarray]):
+        open_, high, low, close, volume = (columns[k] for k in ('open', 'high', 'low', 'close', 'volume'))
+        n = len(open_)
+        self.open_unix = columns['open_unix']
+        x = np.arange(n, dtype=np.float64)
+
+        colors = self.style['marketcolors']['candle']
+        up = close >= open_
+        face = np.where(up[:, None], to_rgba(colors['up']), to_rgba(colors['down']))
+
+        self.wicks.set_segments(np.stack([np.stack([x, low], axis=1), np.stack([x, high], axis=1)], axis=1))
+        self.wicks.set_color(face)
+        self.bodies.set_verts(boxes(x, BODY_WIDTH / 2, np.minimum(open_, close), np.maximum(open_, close)))
+        self.bodies.set_facecolor(face)
+        self.bodies.set_edgecolor(face)
+        self.volumes.set_verts(boxes(x, VOLUME_WIDTH / 2, np.zeros(n), volume))
+        self.volumes.set_facecolor(face)
+
+        for ax in (self.ax1, self.ax2):
+            ax.set_xlim(-1, max(n, 1))
+        if n > 0:
+            pmin, pmax = float(low.min()), float(high.max())
+            padding = (pmax - pmin) * 0.05 or abs(pmax) * 0.01 or 1
+            self.ax1.set_ylim(pmin - padding, pmax + padding)
+            self.ax2.set_ylim(0, float(volume.max()) * 1.05 or 1)
+
+
+def boxes(x: np.ndarray, half_width: float, bottom: np.ndarray, top: np.ndarray) -> np.ndarray:
+    """
+    :return: (n, 4, 2) corners of the rectangles centered on x
+    """
+    left, right = x - half_width, x + half_width
+    return np.stack([np.stack([left, bottom], axis=1), np.stack([left, top], axis=1),
+                     np.stack([right, top], axis=1), np.stack([right, bottom], axis=1)], axis=1)
+
+
+class FigureCache:
+    """
+    Least recently used figures, one per symbol, up to max_size of them (a figure and its canvas take a few MB).
+    During a pump the same symbols alert again and again, their charts are redrawn on the figure already built.
+    """
+    max_size: int
+    hits: int
+    misses: int
+
+    def __init__(self, max_size: int):
+        self.max_size = max(1, max_size)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._charts: OrderedDict[Tuple, CachedChart] = collections.OrderedDict()
+
+    def chart(self, request: RenderRequest) -> CachedChart:
+        key = (request.base, request.quote)
+        with self._lock:
+            chart = self._charts.get(key)
+            if chart is not None:
+                self._charts.move_to_end(key)
+                self.hits += 1
+                return chart
+
+        # Built without holding the lock, the other symbols keep rendering meanwhile
+        chart = CachedChart(f'{request.base}/{request.quote}')
+        with self._lock:
+            self.misses += 1
+            chart = self._charts.setdefault(key, chart)
+            self._charts.move_to_end(key)
+            # Evicted figures are not cleared, one may still be rendering, they are freed once no longer used
+            while len(self._charts) > self.max_size:
+                self._charts.popitem(last=False)
+        return chart
+
+    def render(self, request: RenderRequest) -> bytes:
+        chart = self.chart(request)
+        columns = ohlcv_columns(request.candles, request.timeframe_plot)
+        with chart.lock:
+            chart.update(columns)
+            return save(chart.fig)
+
+    def __len__(self) -> int:
+        return len(self._charts)
+
+
+# Set by set_figure_cache_size(), None renders every chart on a new figure
+FIGURE_CACHE: Optional[FigureCache] = None
+
+
+def set_figure_cache_size(size: int):
+    """
+    Keeps the figures of the last size symbols rendered to redraw their next charts faster, 0 to disable it
+    """
+    global FIGURE_CACHE
+    FIGURE_CACHE = FigureCache(size) if size > 0 else None
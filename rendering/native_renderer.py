@@ -0,0 +1,250 @@
+"""
+Candlestick charts drawn straight from the OHLCV arrays into a pixel buffer and encoded as PNG, with NumPy and zlib
+only: no browser (kaleido) nor figure machinery (matplotlib), a chart takes a few ms and little memory.
+
+The image is drawn with the handful of colors of PALETTE, as palette indices (1 byte per pixel), and saved as an
+indexed PNG, which is 3 times less data to compress than RGB and makes small files.
+
+Only PNG is produced, WebP was left out: the writers and the alert log name every chart .png, and encoding WebP
+would need Pillow (or libwebp), which is not a dependency.
+"""
+import datetime
+import math
+import struct
+import zlib
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from rendering import RenderRequest
+from rendering.frames import ohlcv_columns
+
+# 5x7 pixels glyphs, one int per row, the 5 low bits being the pixels from left to right
+FONT_5X7 = {
+    '0': (0x0E, 0x11, 0x13, 0x15, 0x19, 0x11, 0x0E), '1': (0x04, 0x0C, 0x04, 0x04, 0x04, 0x04, 0x0E),
+    '2': (0x0E, 0x11, 0x01, 0x02, 0x04, 0x08, 0x1F), '3': (0x1F, 0x02, 0x04, 0x02, 0x01, 0x11, 0x0E),
+    '4': (0x02, 0x06, 0x0A, 0x12, 0x1F, 0x02, 0x02), '5': (0x1F, 0x10, 0x1E, 0x01, 0x01, 0x11, 0x0E),
+    '6': (0x06, 0x08, 0x10, 0x1E, 0x11, 0x11, 0x0E), '7': (0x1F, 0x01, 0x02, 0x04, 0x08, 0x08, 0x08),
+    '8': (0x0E, 0x11, 0x11, 0x0E, 0x11, 0x11, 0x0E), '9': (0x0E, 0x11, 0x11, 0x0F, 0x01, 0x02, 0x0C),
+    'A': (0x0E, 0x11, 0x11, 0x11, 0x1F, 0x11, 0x11), 'B': (0x1E, 0x11, 0x11, 0x1E, 0x11, 0x11, 0x1E),
+    'C': (0x0E, 0x11, 0x10, 0x10, 0x10, 0x11, 0x0E), 'D': (0x1C, 0x12, 0x11, 0x11, 0x11, 0x12, 0x1C),
+    'E': (0x1F, 0x10, 0x10, 0x1E, 0x10, 0x10, 0x1F), 'F': (0x1F, 0x10, 0x10, 0x1E, 0x10, 0x10, 0x10),
+    'G': (0x0E, 0x11, 0x10, 0x17, 0x11, 0x11, 0x0F), 'H': (0x11, 0x11, 0x11, 0x1F, 0x11, 0x11, 0x11),
+    'I': (0x0E, 0x04, 0x04, 0x04, 0x04, 0x04, 0x0E), 'J': (0x07, 0x02, 0x02, 0x02, 0x02, 0x12, 0x0C),
+    'K': (0x11, 0x12, 0x14, 0x18, 0x14, 0x12, 0x11), 'L': (0x10, 0x10, 0x10, 0x10, 0x10, 0x10, 0x1F),
+    'M': (0x11, 0x1B, 0x15, 0x15, 0x11, 0x11, 0x11), 'N': (0x11, 0x11, 0x19, 0x15, 0x13, 0x11, 0x11),
+    'O': (0x0E, 0x11, 0x11, 0x11, 0x11, 0x11, 0x0E), 'P': (0x1E, 0x11, 0x11, 0x1E, 0x10, 0x10, 0x10),
+    'Q': (0x0E, 0x11, 0x11, 0x11, 0x15, 0x12, 0x0D), 'R': (0x1E, 0x11, 0x11, 0x1E, 0x14, 0x12, 0x11),
+    'S': (0x0F, 0x10, 0x10, 0x0E, 0x01, 0x01, 0x1E), 'T': (0x1F, 0x04, 0x04, 0x04, 0x04, 0x04, 0x04),
+    'U': (0x11, 0x11, 0x11, 0x11, 0x11, 0x11, 0x0E), 'V': (0x11, 0x11, 0x11, 0x11, 0x11, 0x0A, 0x04),
+    'W': (0x11, 0x11, 0x11, 0x15, 0x15, 0x15, 0x0A), 'X': (0x11, 0x11, 0x0A, 0x04, 0x0A, 0x11, 0x11),
+    'Y': (0x11, 0x11, 0x11, 0x0A, 0x04, 0x04, 0x04), 'Z': (0x1F, 0x01, 0x02, 0x04, 0x08, 0x10, 0x1F),
+    '/': (0x00, 0x01, 0x02, 0x04, 0x08, 0x10, 0x00), '.': (0x00, 0x00, 0x00, 0x00, 0x00, 0x0C, 0x0C),
+    ',': (0x00, 0x00, 0x00, 0x00, 0x0C, 0x04, 0x08), ':': (0x00, 0x0C, 0x0C, 0x00, 0x0C, 0x0C, 0x00),
+    '-': (0x00, 0x00, 0x00, 0x1F, 0x00, 0x00, 0x00), '(': (0x02, 0x04, 0x08, 0x08, 0x08, 0x04, 0x02),
+    ')': (0x08, 0x04, 0x02, 0x02, 0x02, 0x04, 0x08), '%': (0x18, 0x19, 0x02, 0x04, 0x08, 0x13, 0x03),
+    ' ': (0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00),
+}
+GLYPHS = {c: np.array([[(row >> (4 - i)) & 1 for i in range(5)] for row in rows], dtype=bool)
+          for c, rows in FONT_5X7.items()}
+GLYPH_W, GLYPH_H = 5, 7
+
+# Palette indices
+BACKGROUND, GRID, AXIS, TEXT, UP, DOWN = range(6)
+PALETTE = {BACKGROUND: '#ffffff', GRID: '#e6e6e6', AXIS: '#9e9e9e', TEXT: '#333333'}
+
+# Time between two labels of the time axis, in minutes, the first giving at most MAX_TIME_LABELS labels is used
+TIME_STEPS = (1, 2, 5, 10, 15, 30, 60, 120, 240, 480, 720, 1440, 2880, 10080)
+MAX_TIME_LABELS = 8
+
+
+def hex_to_rgb(color: str) -> Tuple[int, int, int]:
+    color = color.lstrip('#')
+    return int(color[0:2], 16), int(color[2:4], 16), int(color[4:6], 16)
+
+
+def encode_png(pixels: np.ndarray, palette: List[Tuple[int, int, int]], compresslevel: int = 6) -> bytes:
+    """
+    :param pixels: (height, width) palette indices
+    """
+    height, width = pixels.shape
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    # Every scanline starts with its filter type, 0 (none)
+    raw = np.zeros((height, width + 1), dtype=np.uint8)
+    raw[:, 1:] = pixels
+    return b''.join((
+        b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0)),
+        chunk(b'PLTE', bytes(c for rgb in palette for c in rgb)),
+        chunk(b'IDAT', zlib.compress(raw.tobytes(), compresslevel)),
+        chunk(b'IEND', b''),
+    ))
+
+
+def text_width(text: str, scale: int) -> int:
+    return max(0, len(text) * (GLYPH_W + 1) - 1) * scale
+
+
+def draw_text(canvas: np.ndarray, text: str, x: int, y: int, scale: int, color: int):
+    """
+    Draws text with its top left corner at (x, y), characters not in the font are drawn as blanks
+    """
+    for c in text.upper():
+        glyph = GLYPHS.get(c)
+        if glyph is not None:
+            if scale > 1:
+                glyph = glyph.repeat(scale, axis=0).repeat(scale, axis=1)
+            region = canvas[y:y + glyph.shape[0], x:x + glyph.shape[1]]
+            region[glyph[:region.shape[0], :region.shape[1]]] = color
+        x += (GLYPH_W + 1) * scale
+
+
+def nice_step(span: float, max_ticks: int) -> float:
+    """
+    Step of 1, 2 or 5 times a power of 10 giving at most max_ticks ticks over span
+    """
+    raw = span / max(1, max_ticks)
+    magnitude = 10 ** math.floor(math.log10(raw))
+    for multiple in (1, 2, 5, 10):
+        if multiple * magnitude >= raw:
+            return multiple * magnitude
+    return 10 * magnitude
+
+
+def format_price(price: float, step: float) -> str:
+    decimals = max(0, -math.floor(math.log10(step)))
+    return f'{price:.{decimals}f}'
+
+
+def format_volume(volume: float) -> str:
+    for divisor, suffix in ((1e9, 'B'), (1e6, 'M'), (1e3, 'K')):
+        if volume >= divisor:
+            return f'{volume / divisor:.3g}{suffix}'
+    return f'{volume:.3g}'
+
+
+class Panel:
+    """
+    A rectangle of the canvas where values are plotted, top to bottom rows map max to min values
+    """
+
+    def __init__(self, left: int, top: int, width: int, height: int, vmin: float, vmax: float):
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+        self.vmin = vmin
+        self.vmax = vmax if vmax > vmin else vmin + 1
+
+    @property
+    def bottom(self) -> int:
+        return self.top + self.height - 1
+
+    def rows(self, values: np.ndarray) -> np.ndarray:
+        scaled = (self.vmax - values) / (self.vmax - self.vmin) * (self.height - 1)
+        return self.top + np.clip(np.rint(scaled), 0, self.height - 1).astype(np.int64)
+
+    def frame(self, canvas: np.ndarray):
+        canvas[self.top, self.left:self.left + self.width] = AXIS
+        canvas[self.bottom, self.left:self.left + self.width] = AXIS
+        canvas[self.top:self.bottom + 1, self.left] = AXIS
+        canvas[self.top:self.bottom + 1, self.left + self.width - 1] = AXIS
+
+
+def draw_chart(columns: Dict[str, np.ndarray], title: str, price_label: str, volume_label: str, width: int,
+               height: int) -> np.ndarray:
+    """
+    :return: (height, width) palette indices
+    """
+    canvas = np.full((height, width), BACKGROUND, dtype=np.uint8)
+    n = len(columns['open_unix'])
+    open_, high, low, close, volume = (columns[k] for k in ('open', 'high', 'low', 'close', 'volume'))
+
+    # Bigger text on bigger charts, 1080x720 gets labels 2 and the title 3 times the font's size
+    scale = max(1, min(width, height) // 360)
+    title_scale = scale + 1
+    margin = 5 * scale
+    title_h = GLYPH_H * title_scale + 2 * margin
+    time_axis_h = GLYPH_H * scale + 2 * margin
+
+    price_step = 1.0
+    price_ticks = np.empty(0)
+    if n > 0:
+        pmin, pmax = float(low.min()), float(high.max())
+        padding = (pmax - pmin) * 0.05 or abs(pmax) * 0.01 or 1
+        pmin, pmax = pmin - padding, pmax + padding
+        price_step = nice_step(pmax - pmin, 6)
+        price_ticks = np.arange(math.ceil(pmin / price_step), math.floor(pmax / price_step) + 1) * price_step
+    else:
+        pmin, pmax = 0.0, 1.0
+    price_labels = [format_price(p, price_step) for p in price_ticks]
+
+    vmax = float(volume.max()) if n > 0 else 1.0
+    volume_ticks = [vmax / 2, vmax] if vmax > 0 else []
+    volume_labels = [format_volume(v) for v in volume_ticks]
+
+    axis_w = max([text_width(label, scale) for label in price_labels + volume_labels] + [0]) + 2 * margin
+    plot_left = margin
+    plot_w = max(1, width - plot_left - axis_w)
+    panels_h = max(2, height - title_h - time_axis_h - margin)
+    price_h = int(panels_h * 0.7)
+    price = Panel(plot_left, title_h, plot_w, price_h, pmin, pmax)
+    vol = Panel(plot_left, title_h + price_h + margin, plot_w, panels_h - price_h - margin, 0, vmax * 1.05)
+
+    draw_text(canvas, title, (width - text_width(title, title_scale)) // 2, margin, title_scale, TEXT)
+
+    # Horizontal grid and labels of the price and volume axes
+    label_x = plot_left + plot_w + margin
+    for panel, ticks, labels in ((price, price_ticks, price_labels), (vol, np.array(volume_ticks), volume_labels)):
+        for row, label in zip(panel.rows(np.asarray(ticks, dtype=np.float64)), labels):
+            canvas[row, panel.left:panel.left + panel.width] = GRID
+            draw_text(canvas, label, label_x, max(0, row - GLYPH_H * scale // 2), scale, TEXT)
+
+    if n > 0:
+        slot = plot_w / n
+        centers = (plot_left + (np.arange(n) + 0.5) * slot).astype(np.int64)
+        half_body = max(0, int(slot * 0.35))
+
+        # Vertical grid and labels of the time axis, on round times
+        minutes = max(1, int(np.median(np.diff(columns['open_unix']))) // 60_000) if n > 1 else 1
+        step = next((s for s in TIME_STEPS if s >= minutes and n * minutes / s <= MAX_TIME_LABELS), TIME_STEPS[-1])
+        label_y = vol.bottom + margin
+        for i in np.flatnonzero(columns['open_unix'] % (step * 60_000) == 0):
+            at = datetime.datetime.fromtimestamp(int(columns['open_unix'][i]) / 1000, datetime.timezone.utc)
+            label = at.strftime('%m-%d' if step >= 1440 or (at.hour == 0 and at.minute == 0) else '%H:%M')
+            x = int(centers[i])
+            canvas[price.top:price.bottom + 1, x] = GRID
+            canvas[vol.top:vol.bottom + 1, x] = GRID
+            lw = text_width(label, scale)
+            draw_text(canvas, label, min(max(0, x - lw // 2), width - lw), label_y, scale, TEXT)
+
+        colors = np.where(close >= open_, UP, DOWN).astype(np.uint8)
+        high_rows, low_rows = price.rows(high), price.rows(low)
+        body_top, body_bottom = price.rows(np.maximum(open_, close)), price.rows(np.minimum(open_, close))
+        volume_rows = vol.rows(volume)
+        for i in range(n):
+            x, color = int(centers[i]), colors[i]
+            canvas[high_rows[i]:low_rows[i] + 1, x] = color
+            canvas[body_top[i]:body_bottom[i] + 1, x - half_body:x + half_body + 1] = color
+            canvas[volume_rows[i]:vol.bottom + 1, x - half_body:x + half_body + 1] = color
+
+    price.frame(canvas)
+    vol.frame(canvas)
+    for panel, label in ((price, price_label), (vol, volume_label)):
+        # On a blank box, the label must stay readable over the candles
+        x, y = panel.left + margin, panel.top + margin
+        canvas[y - scale:y + (GLYPH_H + 1) * scale, x - scale:x + text_width(label, scale) + scale] = BACKGROUND
+        draw_text(canvas, label, x, y, scale, TEXT)
+    return canvas
+
+
+def render_native(request: RenderRequest) -> bytes:
+    columns = ohlcv_columns(request.candles, request.timeframe_plot)
+    pixels = draw_chart(columns, f'{request.base}/{request.quote}', f'Price ({request.quote})',
+                        f'Volume ({request.base})', request.width, request.height)
+
+    palette = {**PALETTE, UP: request.up_color, DOWN: request.down_color}
+    return encode_png(pixels, [hex_to_rgb(palette[i]) for i in range(len(palette))])
@@ -0,0 +1,47 @@
+import plotly.graph_objects as plotly_go
+import plotly.subplots as plotly_subplots
+
+from rendering import RenderRequest
+from rendering.frames import build_ohlcv_frame
+
+
+def render_plotly(request: RenderRequest) -> bytes:
+    df = build_ohlcv_frame(request.candles, request.timeframe_plot)
+    up_color = request.up_color
+    down_color = request.down_color
+
+    # Create a figure with 2 subplots
+    fig = plotly_subplots.make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.7, 0.3])
+    # In the first subplot add the Candlestick
+    # noinspection PyTypeChecker
+    fig.add_trace(
+        plotly_go.Candlestick(name='price', showlegend=False,
+                              x=df.index, open=df.open, high=df.high, low=df.low, close=df.close,
+                              increasing_line_color=up_color, decreasing_line_color=down_color),
+        row=1, col=1)
+
+    # In the second subplot add the Volume
+    bullish_rows = df[df['close'] > df['open']]
+    bearish_rows = df[df['close'] < df['open']]
+
+    # noinspection PyTypeChecker
+    fig.add_trace(
+        plotly_go.Bar(x=bearish_rows.index, y=bearish_rows.volume,
+                      showlegend=False, marker_color=down_color), row=2, col=1)
+    # noinspection PyTypeChecker
+    fig.add_trace(
+        plotly_go.Bar(x=bullish_rows.index, y=bullish_rows.volume,
+                      showlegend=False, marker_color=up_color), row=2, col=1)
+    # Hide the Range Slider, it is not useful in a static image which is what we are going to get at the end
+    # noinspection PyArgumentList
+    fig.update(layout_xaxis_rangeslider_visible=False)
+    fig.update_layout(title=f'{request.base}/{request.quote}',
+                      yaxis_title=f'Price ({request.quote})')
+    # Adjust the plot size
+    fig.update_layout(width=request.width, height=request.height)
+
+    fig.update_yaxes(title_text=f'Volume ({request.base})', row=2, col=1)
+    fig.update_xaxes(title_text='Date', row=2)
+
+    # Export plot to bytes
+    return fig.to_image(format="png")
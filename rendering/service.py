@@ -0,0 +1,154 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+from termcolor import colored
+
+from alerts.pipeline import StageTimer
+from rendering import RenderRequest, RenderResult, render
+
+
+def warm_up(framework: str):
+    """
+    Renders a tiny chart so the framework is imported and its first call costs (kaleido starting its
+    browser, matplotlib building its font cache...) are paid before the first alert.
+    """
+    n = 10
+    open_unix = np.arange(n, dtype=np.int64) * 60_000
+    prices = np.linspace(1, 2, n)
+    render(RenderRequest(framework, 'WARM', 'UP', {
+        'open_unix': open_unix,
+        'open': prices,
+        'high': prices * 1.01,
+        'low': prices * 0.99,
+        'close': prices * 1.005,
+        'base_asset_volume': np.ones(n),
+    }, width=200, height=200))
+
+
+def configure(framework: str, figure_cache_size: int):
+    if framework == 'matplotlib':
+        from rendering.matplotlib_renderer import set_figure_cache_size
+        set_figure_cache_size(figure_cache_size)
+
+
+def _warm_up(framework: str):
+    try:
+        warm_up(framework)
+    except Exception as exc:
+        print(colored(f'Render worker {os.getpid()} could not warm up {framework} - {exc}', 'red'))
+
+
+def _init_worker(framework: str, figure_cache_size: int = 0):
+    _warm_up(framework)
+    # Once warmed up, the warm up chart does not take a place in the figure cache
+    try:
+        configure(framework, figure_cache_size)
+    except Exception as exc:
+        print(colored(f'Render worker {os.getpid()} could not configure {framework} - {exc}', 'red'))
+
+
+def _render_in_worker(request: RenderRequest) -> RenderResult:
+    started = time.perf_counter()
+    image = render(request)
+    return RenderResult(image, time.perf_counter() - started, os.getpid())
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+class RenderService:
+    """
+    Renders charts on a pool of long-lived worker processes. Each worker imports the plotting framework and
+    renders a warm up chart once, when it starts, so alerts only pay for the rendering itself. Rendering is
+    CPU bound and holds the GIL, with processes alerts of several symbols render in parallel on all cores.
+
+    Requests only carry compact OHLCV arrays, results carry the image bytes and how long the worker took.
+    With processes=0 charts are rendered in the calling thread instead.
+
+    figure_cache_size: matplotlib figures each process keeps, one per symbol, to redraw the next charts of the
+    same symbol on them (see rendering.matplotlib_renderer.FigureCache), 0 builds a new figure for every chart.
+    """
+    processes: int
+    timeout: Optional[float]
+
+    def __init__(self, framework: str = 'plotly', processes: int = 2, timeout: Optional[float] = 60,
+                 debug: bool = False, figure_cache_size: int = 0):
+        self.framework = framework
+        self.processes = processes
+        self.figure_cache_size = figure_cache_size
+        self.timeout = timeout
+        self.debug = debug
+        self._lock = threading.Lock()
+        # time spent rendering inside the worker, and time from submitting until the result is back
+        self.render_timer = StageTimer()
+        self.round_trip_timer = StageTimer()
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+        if processes > 0:
+            # spawn rather than fork, the parent process runs threads (the event loop, the alert pipeline) and
+            # forking a multithreaded process is unsafe
+            self._executor = ProcessPoolExecutor(max_workers=processes,
+                                                 mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=_init_worker,
+                                                 initargs=(framework, figure_cache_size))
+        # Without processes the framework is only imported once started or on the first chart, not at startup
+        self._configured = False
+
+    def start(self):
+        """
+        Starts every worker process right away rather than on the first alert, workers warm up in the background.
+        Without processes, the framework is warmed up on a thread of this process.
+        """
+        if self._executor is None:
+            threading.Thread(target=self._warm_up_in_process, name='render-warm-up', daemon=True).start()
+            return
+
+        for _ in range(self.processes):
+            self._executor.submit(_ping)
+
+    def _warm_up_in_process(self):
+        _warm_up(self.framework)
+        try:
+            self._configure_in_process()
+        except Exception as exc:
+            print(colored(f'Could not configure {self.framework} - {exc}', 'red'))
+
+    def _configure_in_process(self):
+        with self._lock:
+            if not self._configured:
+                self._configured = True
+                configure(self.framework, self.figure_cache_size)
+
+    def render(self, request: RenderRequest) -> RenderResult:
+        started = time.perf_counter()
+        if self._executor is None:
+            self._configure_in_process()
+            result = _render_in_worker(request)
+        else:
+            result = self._executor.submit(_render_in_worker, request).result(self.timeout)
+
+        round_trip = time.perf_counter() - started
+        with self._lock:
+            self.render_timer.add(result.elapsed)
+            self.round_trip_timer.add(round_trip)
+
+        if self.debug:
+            print(f'Rendered {request.base}/{request.quote} with {request.framework} in {result.elapsed * 1000:.1f}ms '
+                  f'(round trip {round_trip * 1000:.1f}ms, pid {result.pid})')
+
+        return result
+
+    def stats_line(self) -> str:
+        with self._lock:
+            return f'Render service: render[{self.render_timer}] round_trip[{self.round_trip_timer}]'
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,214 @@
+"""
+Replays websocket frames recorded with the record_dir setting through the kline processor, as fast as possible
+or at the pace they were received, and reports the throughput, alerts produced and time spent per stage.
+
+    python replay.py ./recordings/binance_futures --speed max --set detector_mode=zscore --set min_volume_zscore=5
+
+Buffers start empty, as many candles as min_candles_to_plot must be replayed before any alert can fire,
+lower it with --min-candles to tune detectors on short recordings.
+"""
+import argparse
+import ast
+import contextlib
+import os
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import colorama
+from termcolor import colored
+
+from alerts import AlertJob
+from alerts.dispatcher import AlertDispatcher, IAlertSink
+from alerts.pipeline import StageTimer
+from core import config
+from core.models import Ticker, TickerInfo
+from exchanges.binance import AbstractBinanceWsClient
+from exchanges.binance.binance_futures_ws import BinanceFuturesWsClient
+from exchanges.binance.binance_spot_ws import BinanceSpotWsApi
+from storage.frame_recorder import find_recordings, merge_recordings, read_header
+
+colorama.init(autoreset=True)
+
+
+class CountingAlertSink(IAlertSink):
+    """
+    Keeps the alerts instead of rendering and sending them, optionally forwarding them to another sink
+    """
+
+    def __init__(self, forward_to: Optional[IAlertSink] = None):
+        self.forward_to = forward_to
+        self.alerts: List[AlertJob] = []
+
+    def submit(self, job: AlertJob) -> bool:
+        self.alerts.append(job)
+        if self.forward_to is not None:
+            return self.forward_to.submit(job)
+        return True
+
+    def close(self):
+        if self.forward_to is not None:
+            self.forward_to.close()
+
+
+class ReplayStats:
+    frames: int
+    elapsed: float
+    # Seconds between the first and last frame when they were recorded
+    recorded_span: float
+
+    def __init__(self):
+        self.frames = 0
+        self.elapsed = 0
+        self.recorded_span = 0
+        self.timers: Dict[str, StageTimer] = {'decode': StageTimer(), 'process': StageTimer()}
+
+    @property
+    def frames_per_sec(self) -> float:
+        return self.frames / self.elapsed if self.elapsed > 0 else 0
+
+    @property
+    def speedup(self) -> float:
+        return self.recorded_span / self.elapsed if self.elapsed > 0 else 0
+
+
+def create_client(app_config: config.AppConfig, market: str, symbols: List[Dict[str, str]],
+                  alert_sink: IAlertSink) -> AbstractBinanceWsClient:
+    tickers = []
+    for s in symbols:
+        ticker = Ticker()
+        ticker.base = s['base'].upper()
+        ticker.quote = s['quote'].upper()
+        # Not recorded, alerts print the price as received
+        ticker.price_precision = -1
+        ticker.quantity_precision = -1
+        ticker_info = TickerInfo()
+        ticker_info.ticker = ticker
+        tickers.append(ticker_info)
+
+    if market == 'binance_spot':
+        return BinanceSpotWsApi(app_config, tickers, '1m', alert_sink)
+    return BinanceFuturesWsClient(app_config, tickers, '1m', alert_sink)
+
+
+def replay(client: AbstractBinanceWsClient, frames: Iterable[Tuple[float, bytes]],
+           speed: Optional[float] = None) -> ReplayStats:
+    """
+    Feeds the frames to the client as on_message would, timing decoding and processing separately
+    :param speed: None as fast as possible, 1 at the pace they were received, 10 ten times faster
+    """
+    stats = ReplayStats()
+    decode = client.kline_decoder.decode
+    on_kline = client.on_kline
+    decode_timer = stats.timers['decode']
+    process_timer = stats.timers['process']
+    perf_counter = time.perf_counter
+
+    first_received_at = None
+    received_at = None
+    # Cooldowns run on the time frames were received at, however fast they are replayed
+    client.alert_coalescer.clock = lambda: received_at
+    started = perf_counter()
+    for received_at, payload in frames:
+        if first_received_at is None:
+            first_received_at = received_at
+
+        if speed is not None:
+            wait = (received_at - first_received_at) / speed - (perf_counter() - started)
+            if wait > 0:
+                time.sleep(wait)
+
+        t0 = perf_counter()
+        fields = decode(payload)
+        t1 = perf_counter()
+        on_kline(*fields)
+        t2 = perf_counter()
+
+        decode_timer.add(t1 - t0)
+        process_timer.add(t2 - t1)
+        stats.frames += 1
+
+    stats.elapsed = perf_counter() - started
+    if first_received_at is not None:
+        stats.recorded_span = received_at - first_received_at
+    return stats
+
+
+def parse_overrides(overrides: List[str]) -> Dict:
+    values = {}
+    for override in overrides:
+        name, _, value = override.partition('=')
+        try:
+            values[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            values[name] = value
+    return values
+
+
+def print_report(stats: ReplayStats, sink: CountingAlertSink):
+    print()
+    print(colored(f'Replayed {stats.frames:,} frames ({stats.recorded_span / 3600:.2f}h recorded) in '
+                  f'{stats.elapsed:.2f}s: {stats.frames_per_sec:,.0f} msg/s, {stats.speedup:,.0f}x real time',
+                  'green'))
+    for stage, timer in stats.timers.items():
+        print(f'\t{stage:<8} avg={timer.avg * 1e6:8.2f}us max={timer.max * 1e6:10.2f}us '
+              f'total={timer.total:8.2f}s')
+
+    by_symbol = Counter(job.trading_symbol for job in sink.alerts)
+    print(colored(f'{len(sink.alerts)} alerts on {len(by_symbol)} symbols', 'cyan'))
+    for trading_symbol, count in by_symbol.most_common(10):
+        print(f'\t{trading_symbol}: {count}')
+
+
+# noinspection PyShadowingNames
+def run(args: argparse.Namespace):
+    files = find_recordings(args.paths)
+    if len(files) == 0:
+        raise ValueError(f'No recordings found in {args.paths}')
+
+    header = read_header(files[0])
+    symbols = {}
+    for path in files:
+        for s in read_header(path)['symbols']:
+            symbols[f'{s["base"]}{s["quote"]}'] = s
+    print(f'Replaying {len(files)} files, {header["market"]}, {len(symbols)} symbols')
+
+    app_config = config.AppConfig()
+    for name, value in parse_overrides(args.overrides).items():
+        setattr(app_config, name, value)
+    if args.min_candles is not None:
+        app_config.min_candles_to_plot = args.min_candles
+
+    sink = CountingAlertSink(AlertDispatcher(app_config) if args.dispatch else None)
+    out = None if args.verbose else open(os.devnull, 'w')
+    with contextlib.redirect_stdout(out) if out is not None else contextlib.nullcontext():
+        client = create_client(app_config, header['market'], list(symbols.values()), sink)
+        speed = None if args.speed == 'max' else float(args.speed)
+        try:
+            stats = replay(client, merge_recordings(files), speed)
+        finally:
+            sink.close()
+
+    if out is not None:
+        out.close()
+
+    print_report(stats, sink)
+    if args.dispatch:
+        print(sink.forward_to.alert_pipeline.stats_line())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+', help='Recorded files or directories holding them')
+    parser.add_argument('--speed', default='max',
+                        help='max to replay as fast as possible, 1 at the pace frames were received, 10 ten times '
+                             'faster')
+    parser.add_argument('--min-candles', type=int, dest='min_candles', default=None,
+                        help='Overrides min_candles_to_plot')
+    parser.add_argument('--set', action='append', dest='overrides', default=[], metavar='SETTING=VALUE',
+                        help='Overrides a setting of AppConfig, can be repeated')
+    parser.add_argument('--dispatch', action='store_true',
+                        help='Renders and sends the alerts to the writers (Slack included), as the app would')
+    parser.add_argument('--verbose', action='store_true', help='Shows what the processor prints')
+
+    run(parser.parse_args())
@@ -0,0 +1,5 @@
+"""
+A local stand-in for Binance, to run the app (or load test it) offline: a REST server answering exchangeInfo and
+klines with request weights and 429s, and a websocket server pushing combined stream kline frames of thousands
+of synthetic symbols, see simulator.__main__ for how to run it.
+"""
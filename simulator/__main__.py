@@ -0,0 +1,119 @@
+"""
+Runs the simulator until interrupted:
+
+    python -m simulator --symbols 5000 --ticks-per-sec 2 --spike BTCUSDT@90:40
+
+then point the app at it with the settings it prints (rest_base_url, ws_base_url), with monitor_all_pairs to
+load every synthetic symbol. Spikes are SYMBOL@SECONDS:MULTIPLE, SECONDS after the start the volume of every
+tick of the symbol is MULTIPLE times higher, until its candle closes.
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import List, Tuple
+
+import colorama
+from termcolor import colored
+
+from core import config
+from simulator.market import SyntheticMarket
+from simulator.rest import RestSimulator
+from simulator.ws import StreamSimulator
+
+colorama.init(autoreset=True)
+
+
+def parse_spike(spike: str) -> Tuple[str, float, float]:
+    try:
+        trading_symbol, _, rest = spike.partition('@')
+        after_secs, _, multiple = rest.partition(':')
+        return trading_symbol.upper(), float(after_secs), float(multiple)
+    except ValueError:
+        raise ValueError(f'invalid spike {spike}, expected SYMBOL@SECONDS:MULTIPLE, for instance BTCUSDT@90:40')
+
+
+def load_spikes(args: argparse.Namespace) -> List[Tuple[str, float, float]]:
+    spikes = [parse_spike(s) for s in args.spikes]
+    if args.spikes_file:
+        # [{"symbol": "BTCUSDT", "after_secs": 90, "multiple": 40}, ...]
+        with open(args.spikes_file) as fd:
+            spikes += [(s['symbol'].upper(), float(s['after_secs']), float(s['multiple'])) for s in json.load(fd)]
+    return spikes
+
+
+def report(loop: asyncio.AbstractEventLoop, rest: RestSimulator, ws: StreamSimulator, interval: float,
+           last: Tuple[float, int]):
+    now = time.monotonic()
+    rate = (ws.sent - last[1]) / (now - last[0])
+    print(f'{len(ws.connections)} connections, {rate:,.0f} frames/s, lag {ws.lag:.2f}s, '
+          f'{rest.requests} REST requests ({rest.rejected} rejected)')
+    loop.call_later(interval, report, loop, rest, ws, interval, (now, ws.sent))
+
+
+# noinspection PyShadowingNames
+def run(args: argparse.Namespace):
+    pairs = []
+    if not args.synthetic_only:
+        # So the app finds the symbols it is configured to monitor
+        trading_symbols = config.spot_trading_symbols if args.market == 'binance_spot' else \
+            config.futures_trading_symbols
+        pairs = [(t['base'], t['quote']) for t in trading_symbols]
+
+    market = SyntheticMarket(symbols=args.symbols, ticks_per_sec=args.ticks_per_sec, market=args.market,
+                             spike_probability=args.spike_probability, start_unix=int(time.time() * 1000),
+                             seed=args.seed, pairs=pairs)
+    for trading_symbol, after_secs, multiple in load_spikes(args):
+        if trading_symbol not in market.symbols:
+            raise ValueError(f'spike on {trading_symbol}, which is not simulated')
+        market.script_spike(trading_symbol, after_secs, multiple)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    rest = RestSimulator(market, args.host, args.rest_port, weight_limit=args.weight_limit,
+                         latency=args.latency).start()
+    ws = StreamSimulator(loop, market, args.host, args.ws_port)
+    loop.run_until_complete(ws.start())
+
+    print(colored(f'Simulating {len(market.symbols)} {args.market} symbols at {args.ticks_per_sec} ticks/s, '
+                  f'{len(market.symbols) * args.ticks_per_sec:,.0f} frames/s', 'green'))
+    print(f'Point the app at it with:\n'
+          f'\trest_base_url = {rest.base_url!r}\n'
+          f'\tws_base_url = {ws.base_url!r}')
+    loop.call_later(args.report_secs, report, loop, rest, ws, args.report_secs, (time.monotonic(), 0))
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ws.close()
+        rest.close()
+        loop.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--symbols', type=int, default=1000, help='Number of symbols simulated')
+    parser.add_argument('--ticks-per-sec', type=float, dest='ticks_per_sec', default=1,
+                        help='Updates per second of every symbol')
+    parser.add_argument('--market', default='binance_futures', choices=('binance_futures', 'binance_spot'))
+    parser.add_argument('--synthetic-only', action='store_true', dest='synthetic_only',
+                        help='Do not include the symbols of the config file, only S0USDT, S1USDT...')
+    parser.add_argument('--spike', action='append', dest='spikes', default=[], metavar='SYMBOL@SECONDS:MULTIPLE',
+                        help='Scripted volume spike, can be repeated')
+    parser.add_argument('--spikes-file', dest='spikes_file', default='',
+                        help='JSON list of spikes: [{"symbol": "BTCUSDT", "after_secs": 90, "multiple": 40}]')
+    parser.add_argument('--spike-probability', type=float, dest='spike_probability', default=0.001,
+                        help='Probability of a candle to have a random volume spike')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--rest-port', type=int, dest='rest_port', default=9100)
+    parser.add_argument('--ws-port', type=int, dest='ws_port', default=9101)
+    parser.add_argument('--weight-limit', type=int, dest='weight_limit', default=2400,
+                        help='Request weight allowed per minute, requests beyond it get a 429')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds REST requests wait before the answer')
+    parser.add_argument('--report-secs', type=float, dest='report_secs', default=10)
+    parser.add_argument('--seed', type=int, default=0)
+
+    run(parser.parse_args())
@@ -0,0 +1,222 @@
+"""
+Synthetic market data: kline stream frames as Binance sends them, candle history as the klines REST endpoint
+returns it, and the exchangeInfo listing the synthetic symbols.
+"""
+import itertools
+import json
+import math
+import random
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from core.candle_buffer import CandleRingBuffer
+from utils.timeframes import ms_to_timeframe
+
+
+class SyntheticMarket:
+    """
+    A market of n symbols (the names given first, then S0USDT, S1USDT...) whose prices follow a random walk.
+    Every symbol receives ticks_per_sec updates of its live candle per second, a candle now and then gets a
+    volume spike so detectors have something to alert on, spikes can also be scripted at given times.
+
+    The same seed always generates the same data, runs of the benchmarks can be compared.
+    """
+    market: str
+    symbols: List[str]
+    ticks_per_sec: float
+    interval_ms: int
+    # Kline interval of interval_ms as the streams name it, 1m
+    interval: str
+
+    def __init__(self, symbols: int = 100, ticks_per_sec: float = 1, market: str = 'binance_futures',
+                 interval_ms: int = 60_000, spike_probability: float = 0.01, start_unix: int = 1_669_999_980_000,
+                 seed: int = 0, pairs: Optional[Iterable[Tuple[str, str]]] = None):
+        """
+        :param symbols: number of symbols, at least as many as pairs
+        :param start_unix: time in ms of the first tick
+        :param pairs: (base, quote) of the first symbols, to simulate real names
+        """
+        self.market = market
+        self.pairs = list(dict.fromkeys((b.upper(), q.upper()) for b, q in (pairs or [])))
+        self.pairs += [(f'S{i}', 'USDT') for i in range(max(0, symbols - len(self.pairs)))]
+        self.symbols = [f'{b}{q}' for b, q in self.pairs]
+        self.ticks_per_sec = ticks_per_sec
+        self.interval_ms = interval_ms
+        self.interval = ms_to_timeframe(interval_ms)
+        self.spike_probability = spike_probability
+        self.start_unix = start_unix
+        # Candles of the history end right before the candle of the first tick
+        self.first_open_unix = start_unix - start_unix % interval_ms
+        self.seed = seed
+        # trading symbol -> (ms since start_unix, volume multiple) sorted by time
+        self.scripted_spikes: Dict[str, List[Tuple[int, float]]] = {}
+
+    def symbol_dicts(self) -> List[Dict[str, str]]:
+        return [{'base': b, 'quote': q} for b, q in self.pairs]
+
+    def script_spike(self, trading_symbol: str, after_secs: float, multiple: float):
+        """
+        From after_secs seconds after the start, the volume of every tick of the symbol's candle is multiplied
+        by multiple, until the candle closes
+        """
+        spikes = self.scripted_spikes.setdefault(trading_symbol.upper(), [])
+        spikes.append((int(after_secs * 1000), multiple))
+        spikes.sort()
+
+    def stream_name(self, trading_symbol: str) -> str:
+        if self.market == 'binance_spot':
+            return f'{trading_symbol.lower()}@kline_{self.interval}'
+        return f'{trading_symbol.lower()}_perpetual@continuousKline_{self.interval}'
+
+    def initial_price(self, trading_symbol: str) -> float:
+        return random.Random(f'{self.seed}:{trading_symbol}').uniform(0.1, 100)
+
+    def frame(self, trading_symbol: str, event_unix: int, open_unix: int, open_: float, high: float, low: float,
+              close: float, volume: float, quote_volume: float, closed: bool) -> bytes:
+        kline = {
+            't': open_unix, 'T': open_unix + self.interval_ms - 1, 'i': self.interval, 'f': 1, 'L': 2,
+            'o': f'{open_:.6f}', 'c': f'{close:.6f}', 'h': f'{high:.6f}', 'l': f'{low:.6f}',
+            'v': f'{volume:.3f}', 'n': 100, 'x': closed, 'q': f'{quote_volume:.5f}', 'V': '0', 'Q': '0', 'B': '0',
+        }
+        if self.market == 'binance_spot':
+            kline['s'] = trading_symbol
+            data = {'e': 'kline', 'E': event_unix, 's': trading_symbol, 'k': kline}
+        else:
+            data = {'e': 'continuous_kline', 'E': event_unix, 'ps': trading_symbol, 'ct': 'PERPETUAL', 'k': kline}
+        message = {'stream': self.stream_name(trading_symbol), 'data': data}
+        return json.dumps(message, separators=(',', ':')).encode()
+
+    def ticks(self, duration_secs: Optional[float] = None) -> Iterator[Tuple[int, str, bytes]]:
+        """
+        Frames of the stream of every symbol, ordered by time, as (event time in ms, trading symbol, payload).
+        The last update of a candle is sent again as closed once the candle is over, as Binance does.
+        :param duration_secs: None to never stop
+        """
+        rng = random.Random(self.seed)
+        n = len(self.symbols)
+        step_ms = 1000 / self.ticks_per_sec
+        # symbol -> open time, open, high, low, close, volume, quote volume, volume per tick of the candle
+        states: List[list] = []
+        for trading_symbol in self.symbols:
+            price = self.initial_price(trading_symbol)
+            states.append([-1, price, price, price, price, 0.0, 0.0, 0.0])
+        # scripted spikes not reached yet, per symbol
+        pending_spikes = [list(self.scripted_spikes.get(s, [])) for s in self.symbols]
+
+        ticks = itertools.count() if duration_secs is None else range(int(duration_secs * self.ticks_per_sec))
+        for k in ticks:
+            for i, trading_symbol in enumerate(self.symbols):
+                # Symbols tick one after the other, spread over the step
+                elapsed = int((k + i / n) * step_ms)
+                now = self.start_unix + elapsed
+                open_unix = now - now % self.interval_ms
+                state = states[i]
+                if state[0] != open_unix:
+                    if state[0] >= 0:
+                        yield now - 1, trading_symbol, self.frame(trading_symbol, now - 1, state[0], *state[1:7], True)
+                    price = state[4]
+                    volume_per_tick = rng.uniform(1, 50)
+                    if rng.random() < self.spike_probability:
+                        volume_per_tick *= rng.uniform(20, 60)
+                    states[i] = state = [open_unix, price, price, price, price, 0.0, 0.0, volume_per_tick]
+
+                spikes = pending_spikes[i]
+                while spikes and spikes[0][0] <= elapsed:
+                    state[7] *= spikes.pop(0)[1]
+
+                close = state[4] * rng.uniform(0.999, 1.001)
+                volume = state[7] * rng.uniform(0.5, 1.5)
+                state[2] = max(state[2], close)
+                state[3] = min(state[3], close)
+                state[4] = close
+                state[5] += volume
+                state[6] += volume * close
+                yield now, trading_symbol, self.frame(trading_symbol, now, open_unix, *state[1:7], False)
+
+    def frames(self, duration_secs: Optional[float] = None) -> Iterator[Tuple[float, bytes]]:
+        """
+        Frames of the stream as (receive time in seconds, payload), as FrameRecorder stores them
+        """
+        for now, _, payload in self.ticks(duration_secs):
+            yield now / 1000, payload
+
+    def candle_columns(self, n: int, trading_symbol: str = '') -> Dict[str, np.ndarray]:
+        """
+        n closed candles ending right before the start of the stream, as CandleRingBuffer columns
+        """
+        rng = np.random.default_rng([self.seed, zlib.crc32(trading_symbol.encode())])
+        open_unix = self.first_open_unix - np.arange(n, 0, -1, dtype=np.int64) * self.interval_ms
+        close = rng.uniform(0.1, 100) * np.cumprod(rng.uniform(0.995, 1.005, n))
+        open_ = np.concatenate(([close[0]], close[:-1]))
+        volume = rng.uniform(1, 50, n) * 60
+        return {
+            'open_unix': open_unix,
+            'close_unix': open_unix + self.interval_ms - 1,
+            'open': open_,
+            'high': np.maximum(open_, close) * rng.uniform(1, 1.003, n),
+            'low': np.minimum(open_, close) * rng.uniform(0.997, 1, n),
+            'close': close,
+            'base_asset_volume': volume,
+            'quote_asset_volume': volume * close,
+        }
+
+    def candle_buffer(self, n: int, trading_symbol: str = '') -> CandleRingBuffer:
+        candles = CandleRingBuffer(n)
+        candles.extend(self.candle_columns(n, trading_symbol))
+        return candles
+
+    def kline_row(self, trading_symbol: str, open_unix: int, base_price: float) -> list:
+        """
+        The candle opened at open_unix as returned by the klines REST endpoint. A candle is always the same
+        whatever the request it is part of, overlapping requests (backfill then gap filling) agree.
+        """
+        rng = random.Random(f'{self.seed}:{trading_symbol}:{open_unix}')
+        # A slow wave around the initial price, so consecutive candles are close to each other
+        open_ = base_price * (1 + 0.05 * math.sin(open_unix / (self.interval_ms * 240)))
+        close = open_ * rng.uniform(0.995, 1.005)
+        volume = rng.uniform(60, 3000)
+        return [open_unix, f'{open_:.6f}', f'{max(open_, close) * rng.uniform(1, 1.002):.6f}',
+                f'{min(open_, close) * rng.uniform(0.998, 1):.6f}', f'{close:.6f}', f'{volume:.3f}',
+                open_unix + self.interval_ms - 1, f'{volume * close:.5f}', 100, '0', '0', '0']
+
+    def kline_rows(self, trading_symbol: str, limit: int, now_unix: int, start_unix: Optional[int] = None,
+                   end_unix: Optional[int] = None) -> List[list]:
+        """
+        Candles as returned by the klines REST endpoint: up to limit candles from start_unix, or up to end_unix,
+        or the latest ones. Unlike Binance the live candle (the one of now_unix) is left out, it is the stream's:
+        its volume must grow from one update to the next
+        """
+        interval = self.interval_ms
+        last = now_unix - now_unix % interval - interval
+        if end_unix is not None:
+            last = min(last, end_unix - end_unix % interval)
+        if start_unix is not None:
+            first = start_unix + (-start_unix) % interval
+            last = min(last, first + (limit - 1) * interval)
+        else:
+            first = last - (limit - 1) * interval
+
+        base_price = self.initial_price(trading_symbol)
+        return [self.kline_row(trading_symbol, open_unix, base_price)
+                for open_unix in range(first, last + 1, interval)]
+
+    def exchange_info(self, weight_limit: int = 2400) -> Dict:
+        contract_type = '' if self.market == 'binance_spot' else 'PERPETUAL'
+        symbols = []
+        for base, quote in self.pairs:
+            symbol = {
+                'symbol': f'{base}{quote}', 'status': 'TRADING', 'baseAsset': base, 'quoteAsset': quote,
+                'filters': [{'filterType': 'PRICE_FILTER', 'tickSize': '0.000001'},
+                            {'filterType': 'LOT_SIZE', 'stepSize': '0.001'}],
+            }
+            if contract_type:
+                symbol['contractType'] = contract_type
+            symbols.append(symbol)
+
+        return {
+            'rateLimits': [{'rateLimitType': 'REQUEST_WEIGHT', 'interval': 'MINUTE', 'intervalNum': 1,
+                            'limit': weight_limit}],
+            'symbols': symbols,
+        }
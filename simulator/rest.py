@@ -0,0 +1,139 @@
+import json
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+from simulator.market import SyntheticMarket
+
+
+class RestSimulator:
+    """
+    Answers exchangeInfo and klines requests, futures (/fapi/v1) and spot (/api/v3) alike, with the synthetic
+    market's data, on a thread.
+
+    Requests are weighed as Binance does and the weight used in the current minute is sent back in the
+    X-MBX-USED-WEIGHT-1M header. A request going over weight_limit gets a 429 with Retry-After set to the
+    seconds left until the next minute, as Binance does.
+    """
+    weight_limit: int
+    latency: float
+    requests: int
+    rejected: int
+
+    def __init__(self, market: SyntheticMarket, host: str = '127.0.0.1', port: int = 0, weight_limit: int = 2400,
+                 latency: float = 0.0):
+        """
+        :param port: 0 to pick a free one
+        :param latency: seconds every request waits before being answered, to mimic round trips to the exchange
+        """
+        self.market = market
+        self.weight_limit = weight_limit
+        self.latency = latency
+        self.requests = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._minute = 0
+        self._used_weight = 0
+        self._exchange_info = json.dumps(market.exchange_info(weight_limit)).encode()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @staticmethod
+    def weight(path: str, params: Dict[str, str]) -> int:
+        if path.endswith('/exchangeInfo'):
+            return 1
+        limit = int(params.get('limit', 500))
+        if limit < 100:
+            return 1
+        elif limit < 500:
+            return 2
+        elif limit <= 1000:
+            return 5
+        return 10
+
+    def use_weight(self, weight: int) -> Tuple[bool, int, int]:
+        """
+        :return: whether the request is allowed, weight used in the current minute, seconds until the next one
+        """
+        now = time.time()
+        minute = int(now // 60)
+        with self._lock:
+            self.requests += 1
+            if minute != self._minute:
+                self._minute = minute
+                self._used_weight = 0
+            allowed = self._used_weight + weight <= self.weight_limit
+            if allowed:
+                self._used_weight += weight
+            else:
+                self.rejected += 1
+            return allowed, self._used_weight, int((minute + 1) * 60 - now) + 1
+
+    def _handler_class(self):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                params = dict(urllib.parse.parse_qsl(url.query))
+                if simulator.latency > 0:
+                    time.sleep(simulator.latency)
+
+                allowed, used_weight, retry_after = simulator.use_weight(simulator.weight(url.path, params))
+                headers = {'X-MBX-USED-WEIGHT-1M': str(used_weight)}
+                if not allowed:
+                    headers['Retry-After'] = str(retry_after)
+                    self.reply(429, {'code': -1003, 'msg': 'Too many requests'}, headers)
+                elif url.path in ('/fapi/v1/exchangeInfo', '/api/v3/exchangeInfo'):
+                    self.reply(200, simulator._exchange_info, headers)
+                elif url.path in ('/fapi/v1/klines', '/api/v3/klines'):
+                    self.klines(params, headers)
+                else:
+                    self.reply(404, {'code': -1, 'msg': f'unknown endpoint {url.path}'}, headers)
+
+            def klines(self, params: Dict[str, str], headers: Dict[str, str]):
+                trading_symbol = params.get('symbol', '').upper()
+                if trading_symbol not in simulator.market.symbols:
+                    self.reply(400, {'code': -1121, 'msg': 'Invalid symbol.'}, headers)
+                    return
+
+                rows = simulator.market.kline_rows(
+                    trading_symbol, min(int(params.get('limit', 500)), 1500), int(time.time() * 1000),
+                    start_unix=int(params['startTime']) if 'startTime' in params else None,
+                    end_unix=int(params['endTime']) if 'endTime' in params else None)
+                self.reply(200, rows, headers)
+
+            def reply(self, status: int, body, headers: Dict[str, str]):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> 'RestSimulator':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='rest-simulator', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,113 @@
+import asyncio
+import time
+from typing import Dict, List, Optional, Set
+
+from autobahn.asyncio.websocket import WebSocketServerFactory, WebSocketServerProtocol
+from termcolor import colored
+
+from simulator.market import SyntheticMarket
+
+
+class StreamConnection(WebSocketServerProtocol):
+    """
+    A client of the combined streams endpoint, /stream?streams=btcusdt@kline_1m/ethusdt@kline_1m
+    """
+
+    def __init__(self, simulator: 'StreamSimulator'):
+        super().__init__()
+        self.simulator = simulator
+        self.symbols: List[str] = []
+
+    def onConnect(self, request):
+        if request.path != '/stream':
+            raise ValueError(f'unknown endpoint {request.path}, only /stream is served')
+
+        streams = request.params.get('streams', [''])[0].split('/')
+        self.symbols = [self.simulator.stream_index[s] for s in streams if s in self.simulator.stream_index]
+
+    def onOpen(self):
+        self.simulator.subscribe(self)
+
+    # noinspection PyPep8Naming
+    def onClose(self, wasClean, code, reason):
+        self.simulator.unsubscribe(self)
+
+
+class StreamSimulator:
+    """
+    Pushes the kline frames of the synthetic market, in real time, to the clients subscribed to their streams.
+    Frames are generated as they become due, every push_interval seconds all the frames due are sent.
+
+    A client that does not read its frames fast enough is disconnected once max_buffer bytes are waiting to be
+    sent to it, as Binance does with slow consumers.
+    """
+    push_interval: float
+    max_buffer: int
+    sent: int
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, market: SyntheticMarket, host: str = '127.0.0.1',
+                 port: int = 9101, push_interval: float = 0.05, max_buffer: int = 64 * 1024 * 1024):
+        self.loop = loop
+        self.market = market
+        self.host = host
+        self.port = port
+        self.push_interval = push_interval
+        self.max_buffer = max_buffer
+        self.stream_index = {market.stream_name(s): s for s in market.symbols}
+        # trading symbol -> connections subscribed to it
+        self.subscribers: Dict[str, Set[StreamConnection]] = {s: set() for s in market.symbols}
+        self.connections: Set[StreamConnection] = set()
+        self.sent = 0
+        # How late the last frame sent was, grows if frames can not be generated as fast as asked
+        self.lag = 0.0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def base_url(self) -> str:
+        return f'ws://{self.host}:{self.port}'
+
+    def subscribe(self, conn: StreamConnection):
+        self.connections.add(conn)
+        for trading_symbol in conn.symbols:
+            self.subscribers[trading_symbol].add(conn)
+        print(colored(f'{conn.peer} subscribed to {len(conn.symbols)} streams', 'cyan'))
+
+    def unsubscribe(self, conn: StreamConnection):
+        self.connections.discard(conn)
+        for trading_symbol in conn.symbols:
+            self.subscribers[trading_symbol].discard(conn)
+
+    async def start(self):
+        factory = WebSocketServerFactory(self.base_url)
+        factory.protocol = lambda: StreamConnection(self)
+        factory.setProtocolOptions(autoPingInterval=60, autoPingTimeout=30)
+        self._server = await self.loop.create_server(factory, self.host, self.port)
+        self._task = self.loop.create_task(self._push())
+
+    async def _push(self):
+        ticks = self.market.ticks()
+        due_at, trading_symbol, payload = next(ticks)
+        while True:
+            now = time.time() * 1000
+            while due_at <= now:
+                for conn in self.subscribers[trading_symbol]:
+                    conn.sendMessage(payload)
+                    self.sent += 1
+                self.lag = (now - due_at) / 1000
+                due_at, trading_symbol, payload = next(ticks)
+
+            for conn in list(self.connections):
+                if conn.transport is not None and conn.transport.get_write_buffer_size() > self.max_buffer:
+                    print(colored(f'{conn.peer} is too slow reading its frames, disconnecting it', 'red'))
+                    self.unsubscribe(conn)
+                    conn.dropConnection(abort=True)
+            await asyncio.sleep(self.push_interval)
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        for conn in list(self.connections):
+            conn.sendClose()
+        if self._server is not None:
+            self._server.close()
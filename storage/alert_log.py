@@ -0,0 +1,284 @@
+import datetime
+import glob
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from termcolor import colored
+
+SEGMENT_SUFFIX = '.alerts.jsonl'
+INDEX_SUFFIX = '.idx'
+
+
+class IndexEntry(NamedTuple):
+    # Detection time in ms since the epoch
+    detected_unix: int
+    trading_symbol: str
+    # Offset of the record in its segment
+    offset: int
+
+
+class AlertLog:
+    """
+    Append-only history of the alerts sent, to look back at them and measure their quality.
+
+    Layout of log_dir:
+     - segments/{YYYYmmdd-HHMMSS}-{pid}-{n}.alerts.jsonl: one JSON record per alert, a new segment is started once
+       the current one is segment_max_bytes big or segment_max_secs old. Records are never modified.
+     - segments/{...}.idx: index of its segment, one line per record: detection time (ms), symbol, offset of the
+       record. Its first entry is the earliest alert of the segment: records are written in batches sorted by
+       detection time, and one detected before that first entry (it took longer to render) starts a new segment.
+       A range query only reads the index of the segments which may hold alerts of the range, then seeks to the
+       matching records.
+     - charts/{sha256[:2]}/{sha256}.{png|jpg|...}: charts are stored by content, records refer to them by hash
+       (chart) and format (chart_format, the extension, told from the image's first bytes).
+
+    append() hands the record over to a thread, which writes what is waiting in batches (one write and flush
+    per file and batch), it never blocks the caller.
+    """
+    log_dir: str
+    segment_max_bytes: int
+    segment_max_secs: float
+    written: int
+    dropped: int
+
+    def __init__(self, log_dir: str, segment_max_bytes: int = 64 * 1024 * 1024, segment_max_secs: float = 24 * 60 * 60,
+                 max_queue_size: int = 10_000, fsync: bool = False):
+        self.log_dir = os.path.abspath(log_dir)
+        self.segments_dir = os.path.join(self.log_dir, 'segments')
+        self.charts_dir = os.path.join(self.log_dir, 'charts')
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_secs = segment_max_secs
+        self.fsync = fsync
+        self.written = 0
+        self.dropped = 0
+        os.makedirs(self.segments_dir, exist_ok=True)
+        os.makedirs(self.charts_dir, exist_ok=True)
+
+        self._queue: queue.Queue[Optional[Tuple[Dict, Optional[bytes]]]] = queue.Queue(maxsize=max_queue_size)
+        self._segment = None
+        self._index = None
+        self._segment_started_at = 0.0
+        # Detection time of the first record of the current segment
+        self._segment_first_unix: Optional[int] = None
+        self._segments_opened = 0
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> 'AlertLog':
+        self._thread = threading.Thread(target=self._work, name='alert-log', daemon=True)
+        self._thread.start()
+        return self
+
+    def append(self, record: Dict, chart_bytes: Optional[bytes] = None) -> bool:
+        """
+        :param record: JSON serializable, with at least detected_unix (ms) and trading_symbol, the chart's hash
+        is added to it as chart
+        """
+        try:
+            self._queue.put_nowait((record, chart_bytes))
+        except queue.Full:
+            self.dropped += 1
+            print(colored(f'Alert log queue is full, {record["trading_symbol"]} alert not logged', 'red'))
+            return False
+        return True
+
+    def _work(self):
+        while True:
+            batch = [self._queue.get()]
+            # Whatever else is waiting goes in the same batch
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            closing = batch[-1] is None
+            batch = [item for item in batch if item is not None]
+            if batch:
+                # Whatever goes wrong, the thread keeps logging the next alerts
+                try:
+                    self._write(batch)
+                except Exception as exc:
+                    print(colored(f'Could not log {len(batch)} alerts - {exc!r}', 'red'))
+            if closing:
+                self._close_segment()
+                return
+
+    def chart_path(self, digest: str, chart_format: str = 'png') -> str:
+        return chart_path(self.log_dir, digest, chart_format)
+
+    def _store_chart(self, chart_bytes: bytes) -> Tuple[str, str]:
+        """
+        :return: hash and format of the chart
+        """
+        digest = hashlib.sha256(chart_bytes).hexdigest()
+        chart_format = image_format(chart_bytes)
+        path = self.chart_path(digest, chart_format)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written aside then renamed, a chart file is always complete
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as fd:
+                fd.write(chart_bytes)
+            os.replace(tmp, path)
+        return digest, chart_format
+
+    def _write(self, batch: List[Tuple[Dict, Optional[bytes]]]):
+        batch = sorted(batch, key=lambda item: item[0]['detected_unix'])
+        now = time.time()
+        if self._segment is None or now - self._segment_started_at >= self.segment_max_secs or \
+                self._segment.tell() >= self.segment_max_bytes or \
+                (self._segment_first_unix is not None and batch[0][0]['detected_unix'] < self._segment_first_unix):
+            self._open_segment(now)
+
+        offset = self._segment.tell()
+        lines = []
+        index_lines = []
+        for record, chart_bytes in batch:
+            digest, chart_format = self._store_chart(chart_bytes) if chart_bytes else (None, None)
+            record = dict(record, chart=digest, chart_format=chart_format)
+            try:
+                line = json.dumps(record, separators=(',', ':')).encode() + b'\n'
+            except (TypeError, ValueError) as exc:
+                # Not JSON serializable, the rest of the batch is still logged
+                print(colored(f'Could not log the {record.get("trading_symbol")} alert - {exc}', 'red'))
+                continue
+            lines.append(line)
+            index_lines.append(f'{record["detected_unix"]}\t{record["trading_symbol"]}\t{offset}\n'.encode())
+            offset += len(line)
+
+        if not lines:
+            return
+        if self._segment_first_unix is None:
+            self._segment_first_unix = int(index_lines[0].split(b'\t', 1)[0])
+
+        # The index is written after its records, an entry always points to a complete record
+        self._segment.write(b''.join(lines))
+        self._segment.flush()
+        self._index.write(b''.join(index_lines))
+        self._index.flush()
+        if self.fsync:
+            os.fsync(self._segment.fileno())
+            os.fsync(self._index.fileno())
+        self.written += len(lines)
+
+    def _open_segment(self, now: float):
+        self._close_segment()
+        started = datetime.datetime.fromtimestamp(now, datetime.timezone.utc).strftime('%Y%m%d-%H%M%S')
+        self._segments_opened += 1
+        path = os.path.join(self.segments_dir, f'{started}-{os.getpid()}-{self._segments_opened}{SEGMENT_SUFFIX}')
+        self._segment = open(path, 'ab')
+        self._index = open(path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX, 'ab')
+        self._segment_started_at = now
+        self._segment_first_unix = None
+
+    def _close_segment(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._index.close()
+            self._segment = self._index = None
+
+    def close(self, timeout: Optional[float] = None):
+        """
+        Writes the records waiting, then stops the thread
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+
+# Extension of the images by their first bytes
+IMAGE_SIGNATURES = ((b'\x89PNG\r\n\x1a\n', 'png'), (b'\xff\xd8\xff', 'jpg'), (b'GIF8', 'gif'))
+
+
+def image_format(image_bytes: bytes) -> str:
+    """
+    Extension of the image (renderers return different formats): png, jpg, gif or webp, bin if not recognized
+    """
+    for signature, extension in IMAGE_SIGNATURES:
+        if image_bytes.startswith(signature):
+            return extension
+    if image_bytes[:4] == b'RIFF' and image_bytes[8:12] == b'WEBP':
+        return 'webp'
+    return 'bin'
+
+
+def chart_path(log_dir: str, digest: str, chart_format: Optional[str] = None) -> str:
+    """
+    :param chart_format: chart_format of the record, records logged before it was stored are all png
+    """
+    return os.path.join(os.path.abspath(log_dir), 'charts', digest[:2], f'{digest}.{chart_format or "png"}')
+
+
+def parse_index_line(line: bytes) -> Optional[IndexEntry]:
+    fields = line.rstrip(b'\n').split(b'\t')
+    # A line cut short, the app was killed while writing it
+    if len(fields) != 3 or not line.endswith(b'\n'):
+        return None
+    return IndexEntry(int(fields[0]), fields[1].decode(), int(fields[2]))
+
+
+def read_index(index_path: str) -> List[IndexEntry]:
+    entries = []
+    with open(index_path, 'rb') as fd:
+        for line in fd:
+            entry = parse_index_line(line)
+            if entry is not None:
+                entries.append(entry)
+    return entries
+
+
+def first_detected_unix(index_path: str) -> Optional[int]:
+    """
+    Detection time of the earliest alert of the segment, its first entry, None if it has none
+    """
+    with open(index_path, 'rb') as fd:
+        entry = parse_index_line(fd.readline())
+    return entry.detected_unix if entry is not None else None
+
+
+def query(log_dir: str, trading_symbol: Optional[str] = None, start_unix: Optional[int] = None,
+          end_unix: Optional[int] = None) -> Iterator[Dict]:
+    """
+    Alerts logged, ordered by detection time, of the given symbol if any (BTCUSDT), detected between start_unix and
+    end_unix (ms, both included) if given
+    """
+    segments_dir = os.path.join(os.path.abspath(log_dir), 'segments')
+    trading_symbol = trading_symbol.upper() if trading_symbol is not None else None
+    matches: List[Tuple[IndexEntry, str]] = []
+    for index_path in sorted(glob.glob(os.path.join(segments_dir, f'*{INDEX_SUFFIX}'))):
+        # A segment only holds alerts detected between its first entry and its last write
+        if end_unix is not None:
+            first = first_detected_unix(index_path)
+            if first is None or first > end_unix:
+                continue
+        if start_unix is not None and os.path.getmtime(index_path) * 1000 < start_unix:
+            continue
+
+        segment_path = index_path[:-len(INDEX_SUFFIX)] + SEGMENT_SUFFIX
+        for entry in read_index(index_path):
+            if trading_symbol is not None and entry.trading_symbol != trading_symbol:
+                continue
+            if start_unix is not None and entry.detected_unix < start_unix:
+                continue
+            if end_unix is not None and entry.detected_unix > end_unix:
+                continue
+            matches.append((entry, segment_path))
+
+    matches.sort(key=lambda match: match[0].detected_unix)
+    files = {}
+    try:
+        for entry, segment_path in matches:
+            fd = files.get(segment_path)
+            if fd is None:
+                fd = files[segment_path] = open(segment_path, 'rb')
+            fd.seek(entry.offset)
+            yield json.loads(fd.readline())
+    finally:
+        for fd in files.values():
+            fd.close()
@@ -0,0 +1,153 @@
+import os
+import time
+from typing import Dict, Optional
+
+import numpy as np
+from termcolor import colored
+
+from core.candle_buffer import CandleRingBuffer
+from core.models import TickerInfo
+
+# One fixed size (64 bytes) record per candle, fields as CandleRingBuffer's columns, little endian
+RECORD_DTYPE = np.dtype([(name, np.dtype(dtype).newbyteorder('<')) for name, dtype in CandleRingBuffer.COLUMNS.items()])
+
+
+class CandleCache:
+    """
+    Local store of closed candles so a restart only needs to download the candles it missed.
+
+    One append-only binary file per market, symbol and timeframe: {cache_dir}/{market}/{SYMBOL}-{timeframe}.bin,
+    each record being a closed candle, ordered by open time (it is only truncated when candles already stored
+    are corrected). Only the tail of the file is read on startup (memory
+    mapped), files are rewritten keeping only the newest candles once they grow compact_factor times the
+    buffer capacity.
+    """
+    cache_dir: str
+    market: str
+    compact_factor: int
+    # file path -> open time of the newest candle it holds
+    _last_open_unix: Dict[str, int]
+
+    def __init__(self, cache_dir: str, market: str, compact_factor: int = 4):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.market = market
+        self.compact_factor = compact_factor
+        self._last_open_unix = {}
+        os.makedirs(os.path.join(self.cache_dir, self.market), exist_ok=True)
+
+    def path(self, trading_symbol: str, timeframe: str) -> str:
+        return os.path.join(self.cache_dir, self.market, f'{trading_symbol.upper()}-{timeframe}.bin')
+
+    def _read_tail(self, path: str, n: int) -> np.ndarray:
+        if not os.path.exists(path):
+            return np.empty(0, dtype=RECORD_DTYPE)
+
+        count = os.path.getsize(path) // RECORD_DTYPE.itemsize
+        if count == 0:
+            return np.empty(0, dtype=RECORD_DTYPE)
+
+        n = min(n, count)
+        records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=(count - n) * RECORD_DTYPE.itemsize,
+                            shape=(n,))
+        return np.array(records)
+
+    def load(self, trading_symbol: str, timeframe: str, capacity: int) -> CandleRingBuffer:
+        """
+        :return: a buffer with the newest candles stored, it is empty if nothing was stored yet
+        """
+        path = self.path(trading_symbol, timeframe)
+        candles = CandleRingBuffer(capacity)
+        try:
+            records = self._read_tail(path, capacity)
+        except (OSError, ValueError) as exc:
+            print(colored(f'Could not read the candle cache {path}, ignoring it - {exc}', 'red'))
+            return candles
+
+        if len(records) > 0:
+            candles.extend({name: records[name] for name in CandleRingBuffer.COLUMNS})
+            self._last_open_unix[path] = int(records['open_unix'][-1])
+        return candles
+
+    def store(self, trading_symbol: str, timeframe: str, candles: CandleRingBuffer, now_ms: Optional[int] = None,
+              rewrite: bool = False):
+        """
+        Appends the closed candles of the buffer that are not stored yet, the live candle is never stored.
+        Candles already stored that the buffer merged again (backfilled gaps, the candle live when the connection
+        dropped, see CandleRingBuffer.rewritten_from) are written again from the oldest of them.
+        :param rewrite: the buffer's candles replace everything stored, after a full download
+        """
+        if now_ms is None:
+            now_ms = int(time.time() * 1000)
+
+        path = self.path(trading_symbol, timeframe)
+        open_unix = candles.column('open_unix')
+        close_unix = candles.column('close_unix')
+        end = np.searchsorted(close_unix, now_ms, side='left')
+
+        rewritten_from, candles.rewritten_from = candles.rewritten_from, None
+        if rewrite:
+            self._replace(path, self._records(candles, 0, end))
+            return
+        if rewritten_from is not None and rewritten_from <= self._last_open_unix.get(path, -1):
+            self._truncate(path, rewritten_from)
+
+        last_open_unix = self._last_open_unix.get(path, -1)
+        # Both are sorted, so are the candles to store: the ones after the last stored, up to the last closed
+        start = np.searchsorted(open_unix, last_open_unix, side='right')
+        if start >= end:
+            return
+
+        records = self._records(candles, start, end)
+        with open(path, 'ab') as fd:
+            records.tofile(fd)
+        self._last_open_unix[path] = int(records['open_unix'][-1])
+
+        if os.path.getsize(path) > self.compact_factor * candles.capacity * RECORD_DTYPE.itemsize:
+            self._compact(path, candles.capacity)
+
+    @staticmethod
+    def _records(candles: CandleRingBuffer, start: int, end: int) -> np.ndarray:
+        records = np.empty(max(0, end - start), dtype=RECORD_DTYPE)
+        for name in CandleRingBuffer.COLUMNS:
+            records[name] = candles.column(name)[start:end]
+        return records
+
+    def _replace(self, path: str, records: np.ndarray):
+        tmp_path = f'{path}.tmp'
+        records.tofile(tmp_path)
+        os.replace(tmp_path, path)
+        if len(records) > 0:
+            self._last_open_unix[path] = int(records['open_unix'][-1])
+        else:
+            self._last_open_unix.pop(path, None)
+
+    def _truncate(self, path: str, from_open_unix: int):
+        """
+        Drops the stored candles opened at or after from_open_unix
+        """
+        count = os.path.getsize(path) // RECORD_DTYPE.itemsize
+        open_unix = np.memmap(path, dtype=RECORD_DTYPE, mode='r', shape=(count,))['open_unix']
+        keep = int(np.searchsorted(open_unix, from_open_unix, side='left'))
+        last_open_unix = int(open_unix[keep - 1]) if keep > 0 else None
+        del open_unix
+
+        os.truncate(path, keep * RECORD_DTYPE.itemsize)
+        if last_open_unix is not None:
+            self._last_open_unix[path] = last_open_unix
+        else:
+            self._last_open_unix.pop(path, None)
+
+    def _compact(self, path: str, keep: int):
+        self._replace(path, self._read_tail(path, keep))
+
+    def flush(self, tickers: Dict[str, TickerInfo], timeframe: str):
+        """
+        Snapshots the closed candles of every ticker, meant to be called periodically so a crash only loses
+        the candles closed since the last flush
+        """
+        now_ms = int(time.time() * 1000)
+        for trading_symbol, ticker_info in tickers.items():
+            try:
+                self.store(trading_symbol, timeframe, ticker_info.candles, now_ms)
+            except OSError as exc:
+                print(colored(f'Could not store candles of {trading_symbol} - {exc}', 'red'))
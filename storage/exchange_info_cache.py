@@ -0,0 +1,117 @@
+import json
+import os
+import time
+from typing import Dict, Optional
+
+from termcolor import colored
+
+from core.market_index import MarketIndex
+
+
+class ExchangeInfoCache:
+    """
+    Local copy of the markets of an exchange, so a restart neither downloads exchangeInfo (several MB for futures)
+    nor parses it again while it is younger than ttl seconds.
+
+    What is stored is the MarketIndex built from exchangeInfo, not the response itself, along with the validators
+    of the response (ETag, Last-Modified) used to refresh it conditionally once it expires:
+    {cache_dir}/{market}/exchange_info.json
+    """
+    VERSION = 1
+
+    cache_dir: str
+    market: str
+    ttl: float
+
+    def __init__(self, cache_dir: str, market: str, ttl: float = 60 * 60):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.market = market
+        self.ttl = ttl
+        self._entry: Optional[Dict] = None
+        self._index: Optional[MarketIndex] = None
+        os.makedirs(os.path.join(self.cache_dir, self.market), exist_ok=True)
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.cache_dir, self.market, 'exchange_info.json')
+
+    def _read(self) -> Optional[Dict]:
+        if self._entry is not None:
+            return self._entry
+        if not os.path.exists(self.path):
+            return None
+
+        try:
+            with open(self.path, 'r') as fd:
+                entry = json.load(fd)
+            if entry.get('version') != self.VERSION:
+                return None
+            self._index = MarketIndex.from_dict(entry['index'])
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            print(colored(f'Could not read the exchange info cache {self.path}, ignoring it - {exc}', 'red'))
+            return None
+
+        self._entry = entry
+        return entry
+
+    def age(self) -> Optional[float]:
+        """
+        Seconds since the cached markets were fetched or last confirmed unchanged, None if nothing is cached
+        """
+        entry = self._read()
+        return None if entry is None else time.time() - entry['fetched_at']
+
+    def is_fresh(self) -> bool:
+        age = self.age()
+        return age is not None and age < self.ttl
+
+    def load(self) -> Optional[MarketIndex]:
+        """
+        :return: the cached markets, even if expired, None if nothing is cached
+        """
+        if self._read() is None:
+            return None
+        return self._index
+
+    def validators(self) -> Dict[str, str]:
+        """
+        Headers to send so the server answers 304 Not Modified if the markets did not change
+        """
+        entry = self._read()
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, index: MarketIndex, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        entry = {
+            'version': self.VERSION,
+            'fetched_at': time.time(),
+            'etag': etag,
+            'last_modified': last_modified,
+            'index': index.to_dict(),
+        }
+        self._write(entry)
+        self._entry = entry
+        self._index = index
+
+    def touch(self):
+        """
+        The server confirmed the cached markets are still current, they are fresh for another ttl
+        """
+        entry = self._read()
+        if entry is not None:
+            entry['fetched_at'] = time.time()
+            self._write(entry)
+
+    def _write(self, entry: Dict):
+        tmp_path = f'{self.path}.tmp'
+        try:
+            with open(tmp_path, 'w') as fd:
+                json.dump(entry, fd, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        except OSError as exc:
+            print(colored(f'Could not write the exchange info cache {self.path} - {exc}', 'red'))
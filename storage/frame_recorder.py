@@ -0,0 +1,129 @@
+import datetime
+import glob
+import gzip
+import heapq
+import json
+import os
+import struct
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from termcolor import colored
+
+# Every frame: receive time (seconds since the epoch, float64) and payload length, little endian, then the payload
+FRAME_HEADER = struct.Struct('<dI')
+FILE_SUFFIX = '.frames.gz'
+
+
+class FrameRecorder:
+    """
+    Records the raw websocket frames received, with the time they were received, so a session can be replayed
+    later (see replay.py).
+
+    Frames go to gzip compressed chunk files, a new one every chunk_secs:
+    {record_dir}/{market}/{YYYYmmdd-HHMMSS}-{pid}.frames.gz
+    Each file starts with a JSON line describing the recording (market, symbols subscribed), then the frames.
+    The pid tells apart the files of the worker processes recording at the same time.
+    """
+    VERSION = 1
+
+    record_dir: str
+    market: str
+    chunk_secs: float
+    frames: int
+
+    def __init__(self, record_dir: str, market: str, symbols: List[Dict[str, str]], chunk_secs: float = 60 * 60,
+                 compresslevel: int = 3):
+        """
+        :param symbols: the symbols subscribed to, [{'base': 'BTC', 'quote': 'USDT'}]
+        """
+        self.record_dir = os.path.join(os.path.abspath(record_dir), market)
+        self.market = market
+        self.symbols = symbols
+        self.chunk_secs = chunk_secs
+        self.compresslevel = compresslevel
+        self.frames = 0
+        self._file: Optional[gzip.GzipFile] = None
+        self._chunk_started_at = 0.0
+        os.makedirs(self.record_dir, exist_ok=True)
+
+    def _open_chunk(self, now: float):
+        self.close()
+        started = datetime.datetime.fromtimestamp(now, datetime.timezone.utc).strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(self.record_dir, f'{started}-{os.getpid()}{FILE_SUFFIX}')
+        self._file = gzip.open(path, 'wb', compresslevel=self.compresslevel)
+        header = {'version': self.VERSION, 'market': self.market, 'symbols': self.symbols, 'started_at': now}
+        self._file.write(json.dumps(header).encode() + b'\n')
+        self._chunk_started_at = now
+        print(colored(f'Recording frames to {path}', 'cyan'))
+
+    def write(self, payload: bytes, received_at: Optional[float] = None):
+        if received_at is None:
+            received_at = time.time()
+        if self._file is None or received_at - self._chunk_started_at >= self.chunk_secs:
+            self._open_chunk(received_at)
+
+        self._file.write(FRAME_HEADER.pack(received_at, len(payload)))
+        self._file.write(payload)
+        self.frames += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_header(path: str) -> Dict:
+    with gzip.open(path, 'rb') as fd:
+        return json.loads(fd.readline())
+
+
+def read_frames(path: str) -> Iterator[Tuple[float, bytes]]:
+    """
+    Frames of a chunk file as (receive time, payload). A file cut short (the app was killed while recording)
+    is read up to its last complete frame.
+    """
+    with gzip.open(path, 'rb') as fd:
+        try:
+            fd.readline()
+            while True:
+                header = fd.read(FRAME_HEADER.size)
+                if len(header) < FRAME_HEADER.size:
+                    break
+                received_at, size = FRAME_HEADER.unpack(header)
+                payload = fd.read(size)
+                if len(payload) < size:
+                    break
+                yield received_at, payload
+        except (EOFError, OSError) as exc:
+            print(colored(f'{path} is truncated, replaying it up to the last complete frame - {exc}', 'yellow'))
+
+
+def find_recordings(paths: Iterable[str]) -> List[str]:
+    """
+    Chunk files given, or found in the directories given
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, '**', f'*{FILE_SUFFIX}'), recursive=True))
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+def merge_recordings(files: List[str]) -> Iterator[Tuple[float, bytes]]:
+    """
+    Frames of all the files ordered by receive time. Files of one process follow each other, files of
+    different processes (workers recording at the same time) are interleaved.
+    """
+    by_process: Dict[str, List[str]] = {}
+    for path in sorted(files):
+        pid = os.path.basename(path)[:-len(FILE_SUFFIX)].rsplit('-', 1)[-1]
+        by_process.setdefault(pid, []).append(path)
+
+    def chain(paths: List[str]) -> Iterator[Tuple[float, bytes]]:
+        for p in paths:
+            yield from read_frames(p)
+
+    return heapq.merge(*(chain(paths) for paths in by_process.values()), key=lambda frame: frame[0])
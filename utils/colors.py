@@ -1,6 +1,14 @@
 valid_hex = '0123456789ABCDEF'.__contains__
 RESET = '\033[0m'
 
+# Colors of the symbols in the terminal, 30 colors as distinct as possible from each other and from black and white,
+# generated once with distinctipy.get_colors(30, [(0, 0, 0), (1, 1, 1)], rng=7)
+TICKER_PALETTE = [
+    '00ff00', 'ff00ff', '007fff', 'ff7f00', '7fbf7f', '4901b4', 'bf0031', '28fdf6', '098118', 'fbfb37',
+    'aa70fd', '00ff7f', '70565d', 'f7a4a3', '6fba01', '009c86', 'fa3789', '013364', '87cdea', '9e15f2',
+    '0000ff', '5176b6', '5c063b', 'cdf299', '85fd3c', 'c08550', '4b3bfe', '984d00', 'a5168f', 'cbbb07',
+]
+
 
 def rgb_to_hex(rgb):
     return '%02x%02x%02x' % rgb
@@ -0,0 +1,110 @@
+import threading
+import time
+from typing import Optional
+
+
+class WeightRateLimiter:
+    """
+    Token bucket shared by every thread calling a weight limited API (Binance limits the sum of the weights
+    of the requests sent in a 1 minute window, per IP).
+
+    Tokens are weight units, the bucket holds up to `limit * safety_margin` units and refills at `limit` units
+    per minute. Besides our own accounting, the bucket follows what the exchange reports as used weight
+    (X-MBX-USED-WEIGHT-1M header), which also accounts for requests we did not send ourselves (another
+    instance of the app running on the same IP), and it stops everyone when we are told to back off (429/418).
+
+    Processes sharing the IP each get a share of the limit (worker processes, see set_share()): the bucket and
+    its refill rate are that share of the limit, and so is the used weight reported by the exchange, which is the
+    total of the IP.
+    """
+    limit: int
+    safety_margin: float
+    share: float
+
+    def __init__(self, limit: int = 1200, safety_margin: float = 0.8):
+        self._cond = threading.Condition()
+        self.safety_margin = safety_margin
+        self.limit = limit
+        self.share = 1.0
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+
+    @property
+    def capacity(self) -> float:
+        return self.limit * self.share * self.safety_margin
+
+    @property
+    def rate(self) -> float:
+        """
+        Units refilled per second
+        """
+        return self.limit * self.share / 60
+
+    def set_limit(self, limit: int):
+        """
+        :param limit: weight per minute of the IP
+        """
+        with self._cond:
+            self.limit = limit
+            self._tokens = min(self._tokens, self.capacity)
+
+    def set_share(self, share: float):
+        """
+        :param share: fraction of the IP's limit this bucket may use, 1 / processes for processes sharing the IP
+        """
+        with self._cond:
+            self.share = share
+            self._tokens = min(self._tokens, self.capacity)
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def acquire(self, weight: int, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until `weight` units can be spent
+        :return: False if the timeout expired before that
+        """
+        # A request heavier than the whole bucket would wait forever
+        weight = min(weight, self.capacity)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+
+                if now >= self._blocked_until and self._tokens >= weight:
+                    self._tokens -= weight
+                    return True
+
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                else:
+                    wait = (weight - self._tokens) / self.rate
+
+                if deadline is not None:
+                    if now >= deadline:
+                        return False
+                    wait = min(wait, deadline - now)
+
+                self._cond.wait(wait)
+
+    def update_used_weight(self, used_weight: int):
+        """
+        Syncs the bucket with the weight the exchange says was already used in the current window, by the whole
+        IP: only our share of it is counted against our share of the limit
+        """
+        with self._cond:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, self.capacity - used_weight * self.share)
+
+    def block_for(self, seconds: float):
+        """
+        Nobody acquires tokens for the next `seconds`, used when the exchange answers 429 with a Retry-After
+        """
+        with self._cond:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = min(self._tokens, 0)
+            self._cond.notify_all()
@@ -0,0 +1,28 @@
+_UNIT_MS = {
+    'm': 60_000,
+    'h': 60 * 60_000,
+    'd': 24 * 60 * 60_000,
+    'w': 7 * 24 * 60 * 60_000,
+}
+
+
+def timeframe_to_ms(timeframe: str) -> int:
+    """
+    Length in milliseconds of a Binance kline interval, 1m -> 60000, 4h -> 14400000
+    Months (1M) are not supported as they do not have a fixed length.
+    """
+    unit = timeframe[-1]
+    if unit not in _UNIT_MS:
+        raise ValueError(f'unsupported timeframe {timeframe}')
+    return int(timeframe[:-1]) * _UNIT_MS[unit]
+
+
+def ms_to_timeframe(interval_ms: int) -> str:
+    """
+    Binance kline interval of the given length, in the largest unit it is a whole number of: 60000 -> 1m,
+    14400000 -> 4h
+    """
+    for unit, unit_ms in sorted(_UNIT_MS.items(), key=lambda item: -item[1]):
+        if interval_ms > 0 and interval_ms % unit_ms == 0:
+            return f'{interval_ms // unit_ms}{unit}'
+    raise ValueError(f'no timeframe lasts {interval_ms}ms')
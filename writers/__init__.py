@@ -1,3 +1,17 @@
 class IWriter:
+    # Alerts that may be handed over before the previous ones are delivered, writers batching alerts take several
+    max_in_flight: int = 1
+
+    @property
+    def name(self) -> str:
+        return type(self).__name__
+
     def write(self, base: str, quote: str, message: str, image_bytes: bytes) -> None:
+        """
+        Sends the alert. Writers sending in the background return a concurrent.futures.Future instead,
+        completed once the alert is delivered.
+        """
+        pass
+
+    def close(self):
         pass
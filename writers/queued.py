@@ -0,0 +1,251 @@
+import collections
+import concurrent.futures
+import threading
+import time
+from typing import Deque, List, Optional
+
+from termcolor import colored
+
+from core import metrics
+from writers import IWriter
+
+WRITER_QUEUE_DEPTH = metrics.gauge('writer_queue_depth', 'Alerts waiting for the writer', ('writer',))
+WRITER_DROPPED = metrics.counter('writer_dropped_total', 'Alerts dropped because the queue of the writer was full',
+                                 ('writer',))
+WRITER_MERGED = metrics.counter('writer_merged_total', 'Alerts replaced by a newer alert of the same symbol',
+                                ('writer',))
+WRITER_RETRIES = metrics.counter('writer_retries_total', 'Writes retried after failing', ('writer',))
+WRITER_HEALTH = metrics.gauge('writer_health', 'Health of the writer: 0 healthy, 1 degraded, 2 down', ('writer',))
+
+
+class AlertDropped(Exception):
+    pass
+
+
+class QueuedAlert:
+    base: str
+    quote: str
+    message: str
+    image_bytes: bytes
+    # Of the alert and of the older alerts of the same symbol it replaced (merge policy)
+    futures: List[concurrent.futures.Future]
+
+    def __init__(self, base: str, quote: str, message: str, image_bytes: bytes):
+        self.base = base
+        self.quote = quote
+        self.message = message
+        self.image_bytes = image_bytes
+        self.futures = [concurrent.futures.Future()]
+
+    def settle(self, exc: Optional[BaseException] = None):
+        for f in self.futures:
+            if exc is None:
+                f.set_result(None)
+            else:
+                f.set_exception(exc)
+
+
+class QueuedWriter(IWriter):
+    """
+    Gives a writer its own bounded queue and thread, write() hands the alert over and returns a future completed
+    once the writer delivered it, so a slow or failing writer never holds up the others. Writers sending in the
+    background get as many threads as alerts they take at once (max_in_flight), they batch them.
+
+    When the queue is full:
+     - 'block': write() waits for room, at most timeout seconds, then drops the new alert
+     - 'drop_oldest': the oldest alert waiting is dropped
+     - 'drop_newest': the new alert is dropped
+     - 'merge': an alert of the same symbol waiting is replaced by the new one (its chart is the most recent),
+       if there is none the oldest alert is dropped
+
+    Failed writes are retried up to retries times with an exponential backoff, a write taking more than timeout
+    seconds is given up (it may still complete, it is not retried so it is not sent twice).
+    After down_after failures in a row the writer is down: alerts get a single attempt, so the queue does not pile
+    up behind retries, until a write succeeds again.
+    """
+    OVERFLOW_POLICIES = ('block', 'drop_oldest', 'drop_newest', 'merge')
+    HEALTHY, DEGRADED, DOWN = 0, 1, 2
+    HEALTH_NAMES = ('healthy', 'degraded', 'down')
+
+    writer: IWriter
+    max_size: int
+    overflow_policy: str
+    retries: int
+    retry_delay: float
+    timeout: float
+    consecutive_failures: int
+
+    def __init__(self, writer: IWriter, max_size: int = 100, overflow_policy: str = 'drop_oldest', retries: int = 3,
+                 retry_delay: float = 1, timeout: float = 60, down_after: int = 5):
+        if overflow_policy not in self.OVERFLOW_POLICIES:
+            raise ValueError(f'unknown overflow policy {overflow_policy}, expected one of {self.OVERFLOW_POLICIES}')
+        self.writer = writer
+        self.max_size = max(1, max_size)
+        self.overflow_policy = overflow_policy
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.down_after = down_after
+        self.consecutive_failures = 0
+        self.health = self.HEALTHY
+
+        self._queue: Deque[QueuedAlert] = collections.deque()
+        self._cond = threading.Condition()
+        self._closing = False
+        self._health_lock = threading.Lock()
+        # Writes run on their own threads so the workers can give up on the ones taking too long
+        in_flight = max(1, writer.max_in_flight)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=in_flight,
+                                                               thread_name_prefix=f'{self.name}-write')
+        self._depth = WRITER_QUEUE_DEPTH.labels(self.name)
+        self._dropped = WRITER_DROPPED.labels(self.name)
+        self._merged = WRITER_MERGED.labels(self.name)
+        self._retried = WRITER_RETRIES.labels(self.name)
+        WRITER_HEALTH.labels(self.name).set(self.health)
+        self._workers = []
+        for i in range(in_flight):
+            worker = threading.Thread(target=self._work, name=f'{self.name}-queue-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    @property
+    def name(self) -> str:
+        return self.writer.name
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def write(self, base: str, quote: str, message: str, image_bytes: bytes) -> concurrent.futures.Future:
+        alert = QueuedAlert(base, quote, message, image_bytes)
+        future = alert.futures[0]
+        with self._cond:
+            if self._closing:
+                future.set_exception(AlertDropped(f'{self.name} is closed'))
+                return future
+
+            if len(self._queue) >= self.max_size:
+                if self.overflow_policy == 'merge' and self._merge(alert):
+                    return future
+
+                dropped = self._make_room(alert)
+                if dropped is not None:
+                    self._dropped.inc()
+                    dropped.settle(AlertDropped(f'{self.name} queue is full, alert of {dropped.base}/{dropped.quote} '
+                                                f'dropped'))
+                    if dropped is alert:
+                        return future
+
+            self._queue.append(alert)
+            self._depth.set(len(self._queue))
+            self._cond.notify_all()
+        return future
+
+    def _merge(self, alert: QueuedAlert) -> bool:
+        """
+        Replaces the alert of the same symbol waiting, if any, by the given one, called with the lock held
+        """
+        for i, waiting in enumerate(self._queue):
+            if waiting.base == alert.base and waiting.quote == alert.quote:
+                # Both are settled once the new one is delivered
+                alert.futures = waiting.futures + alert.futures
+                self._queue[i] = alert
+                self._merged.inc()
+                return True
+        return False
+
+    def _make_room(self, alert: QueuedAlert) -> Optional[QueuedAlert]:
+        """
+        Called with the queue full and the lock held
+        :return: the alert dropped to make room, alert itself if it is the one dropped, None if there is room
+        """
+        if self.overflow_policy == 'block':
+            deadline = time.monotonic() + self.timeout
+            while len(self._queue) >= self.max_size and not self._closing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return alert
+                self._cond.wait(remaining)
+            return alert if self._closing else None
+        elif self.overflow_policy == 'drop_newest':
+            return alert
+        return self._queue.popleft()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closing:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                alert = self._queue.popleft()
+                self._depth.set(len(self._queue))
+                self._cond.notify_all()
+
+            alert.settle(self._deliver(alert))
+
+    def _deliver(self, alert: QueuedAlert) -> Optional[BaseException]:
+        attempts = 1 if self.health == self.DOWN else self.retries + 1
+        exc = None
+        for attempt in range(attempts):
+            try:
+                self._write_once(alert)
+            except concurrent.futures.TimeoutError:
+                exc = TimeoutError(f'{self.name} took more than {self.timeout}s sending {alert.base}/{alert.quote}')
+                break
+            except Exception as e:
+                exc = e
+                if attempt + 1 < attempts and not self._closing:
+                    self._retried.inc()
+                    time.sleep(self.retry_delay * 2 ** attempt)
+                    continue
+                break
+            else:
+                self._set_health(False)
+                return None
+
+        self._set_health(True)
+        return exc
+
+    def _write_once(self, alert: QueuedAlert):
+        deadline = time.monotonic() + self.timeout
+        call = self._executor.submit(self.writer.write, alert.base, alert.quote, alert.message, alert.image_bytes)
+        result = call.result(self.timeout)
+        if isinstance(result, concurrent.futures.Future):
+            result.result(max(0.0, deadline - time.monotonic()))
+
+    def _set_health(self, failed: bool):
+        with self._health_lock:
+            self.consecutive_failures = self.consecutive_failures + 1 if failed else 0
+            if self.consecutive_failures == 0:
+                health = self.HEALTHY
+            elif self.consecutive_failures < self.down_after:
+                health = self.DEGRADED
+            else:
+                health = self.DOWN
+
+            if health != self.health:
+                color = ('green', 'yellow', 'red')[health]
+                print(colored(f'{self.name} is {self.HEALTH_NAMES[health]} '
+                              f'({self.consecutive_failures} failures in a row)', color))
+                self.health = health
+                WRITER_HEALTH.labels(self.name).set(health)
+
+    def close(self, timeout: Optional[float] = None):
+        """
+        Waits for the alerts queued to be sent, then closes the writer. Alerts still waiting after timeout are
+        dropped.
+        """
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for worker in self._workers:
+            worker.join(max(0.0, deadline - time.monotonic()) if deadline is not None else None)
+
+        with self._cond:
+            while self._queue:
+                self._queue.popleft().settle(AlertDropped(f'{self.name} closed before sending it'))
+            self._depth.set(0)
+        self._executor.shutdown(wait=False)
+        self.writer.close()
@@ -0,0 +1,243 @@
+import asyncio
+import concurrent.futures
+import json
+import threading
+from typing import Dict, List, Optional
+
+import aiohttp
+from termcolor import colored
+
+from writers import IWriter
+
+
+class SlackError(Exception):
+    def __init__(self, method: str, error: str):
+        super().__init__(f'{method} failed: {error}')
+        self.method = method
+        self.error = error
+
+
+class SlackAlert:
+    base: str
+    quote: str
+    message: str
+    image_bytes: bytes
+    # Completed once the alert is posted, or failed
+    future: concurrent.futures.Future
+    # Upload of the chart (external flow), started as soon as the alert arrives, gives the Slack file id
+    upload: Optional[asyncio.Task]
+
+    def __init__(self, base: str, quote: str, message: str, image_bytes: bytes):
+        self.base = base
+        self.quote = quote
+        self.message = message
+        self.image_bytes = image_bytes
+        self.future = concurrent.futures.Future()
+        self.upload = None
+
+
+class AsyncSlackWriter(IWriter):
+    """
+    Sends the alerts to Slack from its own event loop thread, write() never blocks: it returns a future completed
+    once Slack acknowledged the alert.
+
+    - Requests go over a pool of keep-alive connections.
+    - When Slack rate limits a method (429) no request of that method is sent until Retry-After elapsed, then
+      the request is retried, 5xx are retried with a backoff.
+    - Alerts arriving within batch_window seconds of each other are posted as a single message with one file
+      per symbol (up to max_batch files).
+
+    Upload flows:
+     - 'external': files.getUploadURLExternal then the upload of the chart, started for every alert as soon as
+       it arrives and concurrently, then a single files.completeUploadExternal shares the batch's files.
+     - 'legacy': files.upload, one file per call so alerts are not batched. Slack is retiring it.
+
+    https://api.slack.com/messaging/files#uploading_files
+    """
+    API_URL = 'https://slack.com/api/'
+    UPLOAD_FLOWS = ('external', 'legacy')
+
+    slack_token: str
+    channel_id: str
+    batch_window: float
+    max_batch: int
+
+    def __init__(self, slack_token: str, channel_id: str, batch_window: float = 1.0, max_batch: int = 10,
+                 upload_flow: str = 'external', max_connections: int = 10, max_retries: int = 5,
+                 timeout: float = 30, api_url: str = API_URL):
+        if upload_flow not in self.UPLOAD_FLOWS:
+            raise ValueError(f'unknown Slack upload flow {upload_flow}, expected one of {self.UPLOAD_FLOWS}')
+        self.slack_token = slack_token
+        self.channel_id = channel_id
+        self.batch_window = batch_window
+        # Slack shares at most 10 files per message
+        self.max_batch = max(1, min(max_batch, 10))
+        # Queued, alerts must keep coming while the batch is open
+        self.max_in_flight = self.max_batch
+        self.upload_flow = upload_flow
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.api_url = api_url
+        self.sent = 0
+        self.rate_limited = 0
+
+        self.loop = asyncio.new_event_loop()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._pending: List[SlackAlert] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        # method -> loop time until which Slack asked us not to call it
+        self._retry_at: Dict[str, float] = {}
+        self._thread = threading.Thread(target=self.loop.run_forever, name='slack-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, base: str, quote: str, message: str, image_bytes: bytes) -> concurrent.futures.Future:
+        alert = SlackAlert(base, quote, message, image_bytes)
+        self.loop.call_soon_threadsafe(self._add, alert)
+        return alert.future
+
+    def _add(self, alert: SlackAlert):
+        if self.upload_flow == 'legacy':
+            self._spawn(self._send_legacy(alert))
+            return
+
+        alert.upload = self._spawn(self._upload(alert))
+        self._pending.append(alert)
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = self.loop.call_later(self.batch_window, self._flush)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._pending:
+            batch, self._pending = self._pending, []
+            self._spawn(self._send_batch(batch))
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = self.loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={'Authorization': f'Bearer {self.slack_token}'})
+        return self._session
+
+    async def _request(self, key: str, url: str, data) -> aiohttp.ClientResponse:
+        """
+        POSTs data to url, waiting out the rate limit of key (the API method) and retrying rate limited and
+        failed requests. The response is read before being returned.
+        :param data: the body, or a function building it for bodies that can only be sent once (multipart forms)
+        """
+        for attempt in range(self.max_retries + 1):
+            delay = self._retry_at.get(key, 0) - self.loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            try:
+                async with self.session().post(url, data=data() if callable(data) else data) as res:
+                    await res.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                if attempt == self.max_retries:
+                    raise
+                print(colored(f'Slack {key} failed ({exc}), retrying', 'yellow'))
+                await asyncio.sleep(min(30, 2 ** attempt))
+                continue
+
+            if res.status == 429:
+                retry_after = float(res.headers.get('Retry-After', 1))
+                self._retry_at[key] = max(self._retry_at.get(key, 0), self.loop.time() + retry_after)
+                self.rate_limited += 1
+                print(colored(f'Slack rate limited {key}, waiting {retry_after:.0f}s', 'yellow'))
+            elif res.status >= 500:
+                await asyncio.sleep(min(30, 2 ** attempt))
+            else:
+                return res
+        raise SlackError(key, f'still failing after {self.max_retries} retries')
+
+    async def _call(self, method: str, data) -> Dict:
+        res = await self._request(method, self.api_url + method, data)
+        body = await res.json(content_type=None)
+        if not body.get('ok'):
+            raise SlackError(method, body.get('error', f'HTTP {res.status}'))
+        return body
+
+    async def _upload(self, alert: SlackAlert) -> str:
+        ticket = await self._call('files.getUploadURLExternal', {
+            'filename': f'{alert.base.lower()}-{alert.quote.lower()}.png',
+            'length': str(len(alert.image_bytes)),
+        })
+        res = await self._request('upload', ticket['upload_url'], alert.image_bytes)
+        if res.status != 200:
+            raise SlackError('upload', f'HTTP {res.status}')
+        return ticket['file_id']
+
+    async def _send_batch(self, batch: List[SlackAlert]):
+        # The uploads started when the alerts arrived, most are done by now
+        results = await asyncio.gather(*(a.upload for a in batch), return_exceptions=True)
+        uploaded = []
+        for alert, result in zip(batch, results):
+            if isinstance(result, BaseException):
+                alert.future.set_exception(result)
+            else:
+                uploaded.append((alert, result))
+        if not uploaded:
+            return
+
+        try:
+            await self._call('files.completeUploadExternal', {
+                'files': json.dumps([{'id': file_id, 'title': f'{a.base}/{a.quote}'} for a, file_id in uploaded]),
+                'channel_id': self.channel_id,
+                'initial_comment': '\n\n'.join(a.message for a, _ in uploaded),
+            })
+        except Exception as exc:
+            for alert, _ in uploaded:
+                alert.future.set_exception(exc)
+            return
+
+        self.sent += len(uploaded)
+        for alert, _ in uploaded:
+            alert.future.set_result(None)
+
+    async def _send_legacy(self, alert: SlackAlert):
+        def form() -> aiohttp.FormData:
+            data = aiohttp.FormData()
+            data.add_field('channels', self.channel_id)
+            data.add_field('initial_comment', alert.message)
+            data.add_field('title', f'{alert.base}/{alert.quote}')
+            data.add_field('file', alert.image_bytes, filename=f'{alert.base.lower()}-{alert.quote.lower()}.png',
+                           content_type='image/png')
+            return data
+
+        try:
+            await self._call('files.upload', form)
+        except Exception as exc:
+            alert.future.set_exception(exc)
+            return
+        self.sent += 1
+        alert.future.set_result(None)
+
+    async def _close(self):
+        self._flush()
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+
+    def close(self, timeout: Optional[float] = None):
+        """
+        Sends the alerts still waiting, then stops the writer's thread
+        """
+        try:
+            asyncio.run_coroutine_threadsafe(self._close(), self.loop).result(timeout)
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout)
@@ -0,0 +1,239 @@
+import asyncio
+import random
+import time
+from typing import Callable, Dict, List, Optional
+
+from autobahn.asyncio.websocket import WebSocketClientFactory, WebSocketClientProtocol
+from termcolor import colored
+
+from core import metrics
+from ws_facades import IWsFacade
+
+WS_MESSAGES = metrics.counter('ws_messages_total', 'Messages forwarded by the active connection of the shard',
+                              ('shard',))
+WS_RECONNECTS = metrics.counter('ws_reconnects_total', 'Reconnections scheduled after a connection dropped')
+WS_ROTATIONS = metrics.counter('ws_rotations_total', 'Connections replaced before Binance closes them')
+WS_STALLS = metrics.counter('ws_stalls_total', 'Connections dropped for not receiving anything')
+
+
+class ShardProtocol(WebSocketClientProtocol):
+    """
+    One websocket connection of a shard, it only reports to the manager, which decides what reaches the facade
+    """
+
+    def __init__(self, manager: 'AutobahnConnectionManager', shard: int):
+        super().__init__()
+        self.manager = manager
+        self.shard = shard
+        self.opened_at = 0.0
+        self.last_message_at = 0.0
+        self.messages = 0
+        # Set when we close it ourselves, so the manager does not try to reconnect
+        self.retired = False
+
+    def onConnect(self, response):
+        self.manager.facade.on_connected(f'{response.peer} (shard {self.shard})')
+
+    def onOpen(self):
+        self.opened_at = self.last_message_at = time.monotonic()
+        self.manager.on_shard_open(self)
+
+    def onMessage(self, payload, isBinary):
+        self.last_message_at = time.monotonic()
+        self.messages += 1
+        if isBinary:
+            print(f"Binary message received: {len(payload)} bytes")
+        else:
+            self.manager.on_shard_message(self, payload)
+
+    # noinspection PyPep8Naming
+    def onClose(self, wasClean, code, reason):
+        self.manager.on_shard_closed(self, code, reason)
+
+
+class AutobahnConnectionManager:
+    """
+    Spreads the streams over several websocket connections (shards) and keeps each of them alive:
+
+    - If a connection drops it is reconnected with an exponential backoff with jitter, so shards do not
+      reconnect all at once.
+    - Binance closes connections after 24h, before that (rotate_after seconds) a new connection is opened for
+      the shard, and only once it delivers its first message the old one is closed (make before break), so no
+      kline is missed.
+    - A watchdog drops connections that did not deliver any message in stall_timeout seconds, a connection
+      may stall without being closed, kline streams push updates every second or two. That includes the
+      replacement of a rotation that never delivers anything, the rotation is tried again later.
+
+    Only messages from the active connection of each shard reach the facade.
+    """
+    host: str
+    port: int
+    urls: List[str]
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, facade: IWsFacade, urls: List[str], host: str, port: int,
+                 ssl: bool = True, reconnect_min_delay: float = 1, reconnect_max_delay: float = 60,
+                 rotate_after: float = 23 * 60 * 60, stall_timeout: float = 30,
+                 on_first_message: Optional[Callable[[], None]] = None):
+        self.loop = loop
+        self.facade = facade
+        self.urls = urls
+        self.host = host
+        self.port = port
+        self.ssl = ssl
+        self.reconnect_min_delay = reconnect_min_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.rotate_after = rotate_after
+        self.stall_timeout = stall_timeout
+        # Called once, right after the facade processed the first message of any shard
+        self.on_first_message = on_first_message
+
+        # shard -> connection whose messages are forwarded
+        self.active: Dict[int, Optional[ShardProtocol]] = {shard: None for shard in range(len(urls))}
+        # shard -> new connection waiting for its first message to replace the active one
+        self.standby: Dict[int, Optional[ShardProtocol]] = {shard: None for shard in range(len(urls))}
+        self._attempts: Dict[int, int] = {shard: 0 for shard in range(len(urls))}
+        self._connecting: Dict[int, bool] = {shard: False for shard in range(len(urls))}
+        self._message_counters = [WS_MESSAGES.labels(shard) for shard in range(len(urls))]
+        self.reconnects = 0
+        self.rotations = 0
+        self.stalls = 0
+        self._closing = False
+
+    def start(self):
+        for shard in range(len(self.urls)):
+            self._connect(shard)
+        self.loop.call_later(self.stall_timeout / 2, self._watchdog)
+
+    def close(self):
+        self._closing = True
+        for conns in (self.active, self.standby):
+            for conn in conns.values():
+                if conn is not None:
+                    conn.retired = True
+                    conn.sendClose()
+
+    def _connect(self, shard: int, delay: float = 0):
+        if self._closing or self._connecting[shard]:
+            return
+        self._connecting[shard] = True
+
+        async def connect():
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            factory = WebSocketClientFactory(self.urls[shard])
+            factory.protocol = lambda: ShardProtocol(self, shard)
+            try:
+                await self.loop.create_connection(factory, self.host, self.port, ssl=self.ssl)
+            except Exception as exc:
+                print(colored(f'Shard {shard} could not connect - {exc}', 'red'))
+                self._connecting[shard] = False
+                self._schedule_reconnect(shard)
+                return
+            self._connecting[shard] = False
+
+        self.loop.create_task(connect())
+
+    def _schedule_reconnect(self, shard: int):
+        attempt = self._attempts[shard]
+        self._attempts[shard] += 1
+        delay = min(self.reconnect_max_delay, self.reconnect_min_delay * 2 ** attempt) * random.uniform(0.5, 1.5)
+        print(colored(f'Shard {shard} reconnecting in {delay:.1f}s', 'yellow'))
+        self.reconnects += 1
+        WS_RECONNECTS.inc()
+        self._connect(shard, delay)
+
+    def on_shard_open(self, conn: ShardProtocol):
+        shard = conn.shard
+        if self.active[shard] is None:
+            self.active[shard] = conn
+            self.facade.on_open()
+        else:
+            # A rotation, it takes over once it proves it delivers messages
+            self.standby[shard] = conn
+
+        self.loop.call_later(self.rotate_after * random.uniform(0.95, 1), self._rotate, conn)
+
+    def on_shard_message(self, conn: ShardProtocol, payload):
+        shard = conn.shard
+        if conn is self.standby[shard]:
+            old = self.active[shard]
+            self.active[shard] = conn
+            self.standby[shard] = None
+            self.rotations += 1
+            WS_ROTATIONS.inc()
+            if old is not None:
+                old.retired = True
+                old.sendClose()
+            print(colored(f'Shard {shard} rotated to a new connection', 'cyan'))
+
+        if conn is self.active[shard]:
+            self._attempts[shard] = 0
+            self._message_counters[shard].inc()
+            self.facade.on_message(payload)
+            if self.on_first_message is not None:
+                on_first_message, self.on_first_message = self.on_first_message, None
+                on_first_message()
+
+    def on_shard_closed(self, conn: ShardProtocol, code, reason):
+        shard = conn.shard
+        if self.standby[shard] is conn:
+            self.standby[shard] = None
+        was_active = self.active[shard] is conn
+        if was_active:
+            self.active[shard] = None
+            # If a replacement is already open, promote it
+            if self.standby[shard] is not None:
+                self.active[shard] = self.standby[shard]
+                self.standby[shard] = None
+
+        if conn.retired or self._closing:
+            return
+
+        self.facade.on_closed(code, f'shard {shard}: {reason}')
+        if self.active[shard] is None:
+            self._schedule_reconnect(shard)
+        elif not was_active:
+            # The replacement of a rotation failed, the active connection is still fine, try again later
+            self.loop.call_later(self.reconnect_max_delay, self._rotate, self.active[shard])
+
+    def _rotate(self, conn: ShardProtocol):
+        shard = conn.shard
+        if conn is not self.active[shard] or self.standby[shard] is not None or self._closing:
+            return
+        print(colored(f'Shard {shard} connection is {(time.monotonic() - conn.opened_at) / 3600:.1f}h old, '
+                      f'opening its replacement', 'cyan'))
+        self._connect(shard)
+
+    def _watchdog(self):
+        now = time.monotonic()
+        for conns, role in ((self.active, 'connection'), (self.standby, 'replacement connection')):
+            for shard, conn in conns.items():
+                if conn is None or now - conn.last_message_at <= self.stall_timeout:
+                    continue
+                print(colored(f'Shard {shard} {role} did not receive anything in '
+                              f'{now - conn.last_message_at:.0f}s, dropping it', 'red'))
+                self.stalls += 1
+                WS_STALLS.inc()
+                if conns is self.standby:
+                    # Cleared right away, a rotation does not start while a replacement is pending
+                    self.standby[shard] = None
+                # The closing handshake would likely stall as well, onClose still gets called
+                conn.dropConnection(abort=True)
+
+        if not self._closing:
+            self.loop.call_later(self.stall_timeout / 2, self._watchdog)
+
+    def shard_stats(self) -> List[Dict]:
+        now = time.monotonic()
+        stats = []
+        for shard in range(len(self.urls)):
+            conn = self.active[shard]
+            stats.append({
+                'shard': shard,
+                'connected': conn is not None,
+                'messages': conn.messages if conn is not None else 0,
+                'age': now - conn.opened_at if conn is not None else 0,
+                'idle': now - conn.last_message_at if conn is not None else 0,
+            })
+        return stats